@@ -0,0 +1,164 @@
+## Answer cache for repeated HR questions
+# A hit skips both the hybrid search and the chat completion. Keys combine the normalized
+# question, the chat deployment, the prompt template, the settings that change what an
+# answer is built from, and the index version. The index version is bumped every time an
+# indexer run started by load_data_create_index() finishes and every time the local index
+# is rebuilt, so answers built from an older index are not served once the new one is complete.
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from . import provision_state, telemetry
+
+# Retrieval and answer settings that change the answer to the same question
+KEY_SETTINGS = ("RETRIEVAL_BACKEND", "INDEX_PROFILE", "INDEX_EXHAUSTIVE", "DOCUMENT_ROUTING", "CLIENT_SIDE_EMBEDDING",
+                "SEARCH_DEADLINE", "SEARCH_TOP_K", "CONTEXT_TOKEN_BUDGET", "ANSWER_POLICY", "SEMANTIC_ANSWER_MIN_SCORE", "SEMANTIC_ANSWER_MIN_RERANKER")
+
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+class MemoryCache:
+    # In-process LRU with a time to live
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteCache:
+    # On-disk store shared between processes and restarts
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        self._connection.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT value, expires FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO answers (key, value, expires) VALUES (?, ?, ?)", (key, value, time.time() + self.ttl))
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM answers")
+            self._connection.commit()
+
+class AnswerCache:
+    def __init__(self, backends):
+        # Backends are checked in order (memory first), and a hit in a later one fills the earlier ones
+        self.backends = backends
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+
+    def key(self, question, prompt_template):
+        parts = [normalize_question(question), os.getenv("CHAT_COMPLETION_NAME", ""),
+                 hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(), provision_state.index_version(),
+                 [os.getenv(name, "") for name in KEY_SETTINGS]]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def lookup(self, question, prompt_template):
+        start = time.perf_counter()
+        key = self.key(question, prompt_template)
+        for i, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not None:
+                for earlier in self.backends[:i]:
+                    earlier.set(key, value)
+                entry = json.loads(value)
+                with self._lock:
+                    self.hits += 1
+                    self.latency_saved += max(entry["latency"] - (time.perf_counter() - start), 0.0)
+                telemetry.increment("hrchatbot_answer_cache_hits_total")
+                telemetry.annotate(answer_cache="hit")
+                return entry["answer"]
+        with self._lock:
+            self.misses += 1
+        telemetry.increment("hrchatbot_answer_cache_misses_total")
+        return None
+
+    def store(self, question, prompt_template, answer, latency):
+        value = json.dumps({"answer": answer, "latency": latency})
+        key = self.key(question, prompt_template)
+        for backend in self.backends:
+            backend.set(key, value)
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "latency_saved_seconds": round(self.latency_saved, 3),
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    # ANSWER_CACHE is one of off, memory (default) or sqlite (memory in front of an on-disk store)
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                mode = os.getenv("ANSWER_CACHE", "memory")
+                ttl = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+                backends = []
+                if mode in ("memory", "sqlite"):
+                    backends.append(MemoryCache(maxsize=int(os.getenv("ANSWER_CACHE_SIZE", 1024)), ttl=ttl))
+                if mode == "sqlite":
+                    backends.append(SQLiteCache(os.getenv("ANSWER_CACHE_PATH", os.path.join(".hrchatbot", "answer_cache.sqlite3")), ttl=ttl))
+                _cache = AnswerCache(backends)
+    return _cache if _cache.backends else None
+
+def invalidate():
+    # Entries from older index versions can no longer be hit, so drop them to free the space
+    if _cache is not None:
+        _cache.clear()
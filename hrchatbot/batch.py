@@ -0,0 +1,145 @@
+## Batch question answering
+# Runs a list of questions through the retrieval_generation pipeline on a worker pool and
+# appends one JSON line per question to the output as soon as it is answered: the answer,
+# the chunk_ids and reranker scores it was built from, and per-stage timings. Questions are
+# read from a file or stdin, one per line, or as JSONL objects with "question" and an
+# optional "id" (the line number otherwise). Ids already answered in the output file are
+# skipped, so an interrupted run picks up where it stopped when started again.
+# python -m hrchatbot.batch questions.txt [--output answers.jsonl] [--workers 8] [--rate 5]
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import scheduler
+from .telemetry import collect_stages
+
+class RateLimiter:
+    # Spaces calls at least 1/rate seconds apart across all workers; rate 0 means unlimited
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def read_questions(f):
+    questions = []
+    for number, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            item = json.loads(line)
+            questions.append({"id": str(item.get("id", number)), "question": item["question"]})
+        else:
+            questions.append({"id": str(number), "question": line})
+    return questions
+
+def answered_ids(path):
+    # Ids with a successful answer in an earlier, possibly interrupted, run
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by the interruption
+                continue
+            if "error" not in result:
+                done.add(result["id"])
+    return done
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def answer_one(item, limiter):
+    from .retrieval_generation import answer_with_context
+
+    limiter.wait()
+    result = {"id": item["id"], "question": item["question"]}
+    start = time.perf_counter()
+    # Batch questions yield to interactive ones when the deployment quota runs short
+    with collect_stages() as stages, scheduler.priority(scheduler.BATCH):
+        try:
+            answer, context = answer_with_context(item["question"])
+            result["answer"] = answer
+            result["cached"] = context is None
+            result["chunk_ids"] = [chunk["chunk_id"] for chunk in context or []]
+            result["scores"] = [chunk["reranker_score"] for chunk in context or []]
+        except Exception as error:
+            result["error"] = f"{type(error).__name__}: {error}"
+    result["stages"] = {name: round(seconds, 4) for name, seconds in stages.items()}
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+def run_batch(questions, output, workers=8, rate=0.0):
+    done = answered_ids(output)
+    pending = [item for item in questions if item["id"] not in done]
+    limiter = RateLimiter(rate)
+    latencies = []
+    failed = 0
+
+    start = time.perf_counter()
+    with open(output, "a", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        if f.tell() and not _ends_with_newline(output):
+            # Close off a line cut short by the interruption before appending
+            f.write("\n")
+        futures = [executor.submit(answer_one, item, limiter) for item in pending]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+                if "error" in result:
+                    failed += 1
+                else:
+                    latencies.append(result["seconds"])
+        except KeyboardInterrupt:
+            # Questions not started yet are dropped; the next run resumes from the output file
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "questions": len(questions),
+        "skipped": len(questions) - len(pending),
+        "answered": len(latencies),
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "questions_per_second": len(pending) / elapsed if elapsed else 0,
+        "p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+        "p95_seconds": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.batch")
+    parser.add_argument("input", nargs="?", default="-", help="questions file, or - for stdin")
+    parser.add_argument("--output", default="answers.jsonl")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_WORKERS", 8)))
+    parser.add_argument("--rate", type=float, default=float(os.getenv("BATCH_RATE", 0)), help="questions started per second, 0 for no limit")
+    args = parser.parse_args()
+
+    if args.input == "-":
+        questions = read_questions(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            questions = read_questions(f)
+
+    print(json.dumps(run_batch(questions, args.output, args.workers, args.rate), indent=2), file=sys.stderr)
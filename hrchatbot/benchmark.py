@@ -0,0 +1,1066 @@
+## Offline benchmarks against the local stand-ins in fakes.py
+# python -m hrchatbot.benchmark <name> [options]
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from .fakes import FakeAzureServer
+
+QUESTIONS = [
+    "What will an organization of the Government of British Columbia do if an employee got health problems?",
+    "Which HR policy document talks about occupational safety and health?",
+    "What is the role of political staff?",
+]
+
+def _use_server(server, answer_cache="off"):
+    os.environ.update(server.environ())
+    os.environ["ANSWER_CACHE"] = answer_cache
+
+def _report(name, result):
+    print(json.dumps({"benchmark": name, **result}, indent=2))
+    return result
+
+def bench_connections(args):
+    # Runs the same search and chat completion per question with new clients for every
+    # question (the old pattern) and with the pooled clients, then measures how many
+    # questions per second the aio path sustains with many in flight
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    from openai import AzureOpenAI
+    from . import clients
+    from .retrieval_generation import aretrieval_generation, build_messages, context_item, search_kwargs
+
+    def ask(search_client, openai_client, query):
+        context = [context_item(result) for result in search_client.search(**search_kwargs(query))]
+        openai_client.chat.completions.create(model=os.getenv("CHAT_COMPLETION_NAME"), messages=build_messages(query, context))
+
+    result = {}
+    with FakeAzureServer(search_latency=args.latency, chat_latency=args.latency) as server:
+        _use_server(server)
+
+        start = time.perf_counter()
+        for i in range(args.questions):
+            with SearchClient(server.url, "int-vec", AzureKeyCredential("fake-key")) as search_client, \
+                    AzureOpenAI(azure_endpoint=server.url, api_key="fake-key", api_version="2024-10-21") as openai_client:
+                ask(search_client, openai_client, QUESTIONS[i % len(QUESTIONS)])
+        elapsed = time.perf_counter() - start
+        result["per_question_client"] = {"connections": server.connections, "seconds": elapsed, "questions_per_second": args.questions / elapsed}
+
+        server.connections = 0
+        start = time.perf_counter()
+        for i in range(args.questions):
+            ask(clients.get_search_client(), clients.get_openai_client(), QUESTIONS[i % len(QUESTIONS)])
+        elapsed = time.perf_counter() - start
+        result["pooled_sequential"] = {"connections": server.connections, "seconds": elapsed, "questions_per_second": args.questions / elapsed}
+
+        async def run_concurrent():
+            semaphore = asyncio.Semaphore(args.concurrency)
+            async def ask(i):
+                async with semaphore:
+                    return await aretrieval_generation(QUESTIONS[i % len(QUESTIONS)])
+            try:
+                await asyncio.gather(*(ask(i) for i in range(args.questions)))
+            finally:
+                await clients.aclose()
+
+        server.connections = 0
+        start = time.perf_counter()
+        asyncio.run(run_concurrent())
+        elapsed = time.perf_counter() - start
+        result["async_concurrent"] = {"connections": server.connections, "seconds": elapsed, "concurrency": args.concurrency,
+                                      "questions_per_second": args.questions / elapsed}
+        clients.close()
+
+    return _report("connections", result)
+
+def bench_answer_cache(args):
+    # Replays a question mix where a few popular questions dominate, as seen in production
+    import random
+    from . import answer_cache
+    from .retrieval_generation import retrieval_generation
+
+    rng = random.Random(0)
+    questions = [rng.choice(QUESTIONS) if rng.random() < args.repeat_ratio else f"{rng.choice(QUESTIONS)} (variant {i})"
+                 for i in range(args.questions)]
+    with FakeAzureServer(search_latency=args.latency, chat_latency=args.latency * 10) as server:
+        _use_server(server, answer_cache=args.backend)
+        start = time.perf_counter()
+        for question in questions:
+            retrieval_generation(question)
+        elapsed = time.perf_counter() - start
+        result = {"questions": args.questions, "seconds": elapsed, "backend_requests": server.requests,
+                  **answer_cache.get_answer_cache().stats()}
+    return _report("answer-cache", result)
+
+def bench_embedding_cache(args):
+    # Embeds a question mix twice: the first pass goes to the fake endpoint, the second is served from cache
+    import statistics
+    import tempfile
+    from . import embeddings
+
+    result = {}
+    with tempfile.TemporaryDirectory() as directory, FakeAzureServer(embedding_latency=args.latency) as server:
+        _use_server(server)
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(directory, "embeddings.sqlite3")
+        questions = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i})" for i in range(args.questions)]
+
+        for name in ("miss", "hit"):
+            latencies = []
+            for question in questions:
+                start = time.perf_counter()
+                embeddings.embed_query(question)
+                latencies.append(time.perf_counter() - start)
+            result[name] = {"mean_ms": statistics.mean(latencies) * 1000, "p50_ms": statistics.median(latencies) * 1000}
+
+        # A fresh process only has the on-disk store to go on
+        embeddings._cache = None
+        latencies = []
+        for question in questions:
+            start = time.perf_counter()
+            embeddings.embed_query(question)
+            latencies.append(time.perf_counter() - start)
+        result["disk_hit"] = {"mean_ms": statistics.mean(latencies) * 1000, "p50_ms": statistics.median(latencies) * 1000}
+        result["endpoint_requests"] = server.requests
+        result["latency_removed_ms"] = result["miss"]["mean_ms"] - result["hit"]["mean_ms"]
+
+    return _report("embedding-cache", result)
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+def bench_local_backend(args):
+    # Synthetic chunks with Zipf-distributed words and random unit vectors, queried with hybrid search
+    import tempfile
+    import numpy as np
+    from .local_index import LocalIndex, build_local_index
+
+    rng = np.random.default_rng(0)
+    vocabulary = np.array([f"term{i}" for i in range(args.vocabulary)])
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            def documents():
+                for row in range(size):
+                    words = vocabulary[np.minimum(rng.zipf(1.3, 60), args.vocabulary) - 1]
+                    yield {"parent_id": f"doc{row // 20}", "chunk_id": f"doc{row // 20}_pages_{row % 20}", "title": f"doc{row // 20}.pdf", "chunk": " ".join(words)}
+            def vectors():
+                for start in range(0, size, 10000):
+                    for vector in rng.standard_normal((min(10000, size - start), args.dimensions), dtype=np.float32):
+                        yield vector
+
+            start = time.perf_counter()
+            build_local_index(directory, documents(), vectors(), args.dimensions)
+            index = LocalIndex(directory)
+            build_seconds = time.perf_counter() - start
+
+            latencies = []
+            start = time.perf_counter()
+            for i in range(args.queries):
+                query = " ".join(vocabulary[rng.integers(0, 200, 4)])
+                query_start = time.perf_counter()
+                index.search(query, rng.standard_normal(args.dimensions, dtype=np.float32), top=args.top)
+                latencies.append(time.perf_counter() - query_start)
+            elapsed = time.perf_counter() - start
+            results[str(size)] = {"build_seconds": build_seconds, "queries_per_second": args.queries / elapsed,
+                                  "p50_ms": _percentile(latencies, 50) * 1000, "p99_ms": _percentile(latencies, 99) * 1000}
+            del index
+
+    return _report("local-backend", {"dimensions": args.dimensions, "sizes": results})
+
+def bench_bulk_embedding(args):
+    # Embeds a synthetic corpus, re-embeds it unchanged, then with a share of chunks edited,
+    # against a fake endpoint that throttles some requests
+    import random
+    import tempfile
+    from . import clients
+    from .bulk_embedding import BulkEmbedder, embed_chunks, upload_documents
+
+    rng = random.Random(0)
+    words = "employee leave policy ministry supervisor health safety political staff agreement".split()
+    chunks = [{"parent_id": f"doc{i // 10}", "chunk_id": f"doc{i // 10}_pages_{i % 10}", "title": f"doc{i // 10}.pdf",
+               "chunk": " ".join(rng.choice(words) for _ in range(300))} for i in range(args.chunks)]
+
+    result = {}
+    with tempfile.TemporaryDirectory() as directory, FakeAzureServer(documents=[], dimensions=args.dimensions, embedding_latency=args.latency,
+                                                                        embedding_throttle_ratio=args.throttle_ratio) as server:
+        _use_server(server)
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(directory, "embeddings.sqlite3")
+        os.environ["AZURE_OPENAI_EMBEDDING_DIMENSIONS"] = str(args.dimensions)
+
+        for name in ("initial", "unchanged", "edited"):
+            if name == "edited":
+                for chunk in rng.sample(chunks, len(chunks) * args.edited_percent // 100):
+                    chunk["chunk"] += " amended"
+            embedder = BulkEmbedder(max_workers=args.workers, max_batch_tokens=args.batch_tokens)
+            start = time.perf_counter()
+            embed_chunks(chunks, embedder)
+            result[name] = {**embedder.stats, "seconds": time.perf_counter() - start}
+
+        start = time.perf_counter()
+        uploaded = upload_documents(clients.get_search_client(), chunks)
+        result["upload"] = {"documents": uploaded, "seconds": time.perf_counter() - start}
+        result["throttled_requests"] = server.throttled
+
+    return _report("bulk-embedding", result)
+
+def _git_commit():
+    import subprocess
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _summarize(values):
+    return {"p50_ms": _percentile(values, 50) * 1000, "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000, "count": len(values)}
+
+def bench_stages(args):
+    # Drives retrieval_generation() at several concurrency levels against fakes with
+    # log-normal latencies and reports p50/p95/p99 per stage plus end-to-end throughput
+    from concurrent.futures import ThreadPoolExecutor
+    from .fakes import lognormal
+    from .retrieval_generation import retrieval_generation
+    from .telemetry import collect_stages
+
+    def ask(i):
+        with collect_stages() as stages:
+            start = time.perf_counter()
+            retrieval_generation(QUESTIONS[i % len(QUESTIONS)])
+            stages["end_to_end"] = time.perf_counter() - start
+        return stages
+
+    result = {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": {key: value for key, value in vars(args).items() if key != "func"}, "levels": {}}
+    with FakeAzureServer(search_latency=lognormal(args.search_median, args.sigma, seed=1),
+                         chat_latency=lognormal(args.chat_median, args.sigma, seed=2)) as server:
+        _use_server(server)
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                samples = list(executor.map(ask, range(args.questions)))
+            elapsed = time.perf_counter() - start
+
+            names = sorted({name for sample in samples for name in sample})
+            result["levels"][str(concurrency)] = {
+                "questions_per_second": args.questions / elapsed,
+                "stages": {name: _summarize([sample[name] for sample in samples if name in sample]) for name in names},
+            }
+
+    output = args.output or os.path.join(".hrchatbot", "benchmarks", f"stages-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    result["output"] = output
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        result["change_vs_baseline"] = {
+            level: {name: {key: stats[key] - baseline["levels"][level]["stages"][name][key] for key in ("p50_ms", "p99_ms")}
+                    for name, stats in current["stages"].items() if name in baseline["levels"].get(level, {}).get("stages", {})}
+            for level, current in result["levels"].items() if level in baseline["levels"]
+        }
+    return _report("stages", result)
+
+# The prompt before context packing: one system message with the repr of the results
+REPR_PROMPT = '''
+    You are a helpful assistant. Use the following context to answer the user's question.
+    
+    Context:
+    {context}
+    
+    Question:
+    {query}
+    
+    Answer:
+    '''
+
+def bench_context_packing(args):
+    # Prompt tokens and completion latency with the old repr-of-results context and with
+    # packed context, at top 1 and at --top, over documents split with the SplitSkill overlap
+    import random
+    import statistics
+    from . import retrieval_generation as rg
+    from .chunking import split_pages
+
+    rng = random.Random(1)
+    words = ["employee", "leave", "policy", "manager", "days", "benefits", "ministry", "health", "salary", "review"]
+    documents = []
+    for d in range(3):
+        text = " ".join(rng.choice(words) + ("." if rng.random() < 0.1 else "") for _ in range(args.words))
+        parent_id = f"doc{d}"
+        documents += [{"parent_id": parent_id, "chunk_id": f"{parent_id}_pages_{n}", "title": f"Policy {d}.pdf", "chunk": page}
+                      for n, page in enumerate(split_pages([text]))]
+
+    result = {}
+    with FakeAzureServer(documents=documents, chat_latency=args.chat_latency, prompt_token_latency=args.prompt_token_latency) as server:
+        _use_server(server)
+        for top in (1, args.top):
+            os.environ["SEARCH_TOP_K"] = str(top)
+            for layout in ("repr", "packed"):
+                prompt_tokens = []
+                latencies = []
+                for i in range(args.questions):
+                    query = QUESTIONS[i % len(QUESTIONS)]
+                    context = rg.retrieve(query)
+                    if layout == "repr":
+                        messages = [{"role": "system", "content": REPR_PROMPT.format(context=context, query=query)}]
+                    else:
+                        messages = rg.build_messages(query, context)
+                    start = time.perf_counter()
+                    response = rg.client.chat.completions.create(model=os.getenv("CHAT_COMPLETION_NAME"), messages=messages)
+                    latencies.append(time.perf_counter() - start)
+                    prompt_tokens.append(response.usage.prompt_tokens)
+                result[f"{layout}_top{top}"] = {"prompt_tokens": statistics.mean(prompt_tokens),
+                                                "completion_p50_ms": statistics.median(latencies) * 1000}
+        result["prompt_tokens_saved"] = result[f"repr_top{args.top}"]["prompt_tokens"] - result[f"packed_top{args.top}"]["prompt_tokens"]
+    return _report("context-packing", result)
+
+def bench_serve(args):
+    # Load test of python -m hrchatbot.serve against the fakes: many clients on keep-alive
+    # connections, drawing from a small set of questions so identical ones overlap in flight
+    import http.client
+    import random
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from . import serve
+
+    with FakeAzureServer(search_latency=args.search_latency, chat_latency=args.chat_latency) as fake:
+        _use_server(fake)
+        ready = threading.Event()
+        started = {}
+
+        def on_ready(server):
+            started["server"] = server
+            started["loop"] = asyncio.get_running_loop()
+            ready.set()
+
+        def run():
+            try:
+                asyncio.run(serve.serve("127.0.0.1", 0, args.server_concurrency, args.queue, False, on_ready))
+            except asyncio.CancelledError:
+                pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        ready.wait()
+        port = started["server"].sockets[0].getsockname()[1]
+
+        rng = random.Random(1)
+        questions = [f"{QUESTIONS[i % len(QUESTIONS)]} ({rng.randrange(args.distinct)})" for i in range(args.requests)]
+        local = threading.local()
+
+        def ask(question):
+            if not hasattr(local, "connection"):
+                local.connection = http.client.HTTPConnection("127.0.0.1", port)
+            start = time.perf_counter()
+            local.connection.request("POST", "/ask", body=json.dumps({"question": question}), headers={"Content-Type": "application/json"})
+            response = local.connection.getresponse()
+            response.read()
+            return response.status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            responses = list(executor.map(ask, questions))
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for status, latency in responses if status == 200]
+        result = {
+            "requests_per_second": len(questions) / elapsed,
+            "ok": len(latencies),
+            "rejected": sum(1 for status, latency in responses if status == 503),
+            "latency_p50_ms": _percentile(latencies, 50) * 1000 if latencies else None,
+            "latency_p99_ms": _percentile(latencies, 99) * 1000 if latencies else None,
+            "server": dict(started["server"].app.stats),
+            "backend_requests": fake.requests,
+        }
+        started["loop"].call_soon_threadsafe(started["server"].close)
+        thread.join()
+    return _report("serve", result)
+
+def bench_conversation(args):
+    # Prompt tokens per turn of a long conversation, with every turn kept verbatim and with
+    # recent turns plus a rolling summary
+    from . import telemetry
+    from .conversation import Conversation
+    from .retrieval_generation import retrieval_generation_stream
+
+    answer = " ".join(["Employees should follow the policy and talk to their supervisor about the details."] * args.answer_sentences)
+    result = {}
+    with FakeAzureServer(answer=answer) as server:
+        _use_server(server)
+        telemetry.configure("metrics")
+        for name, conversation in (("verbatim", Conversation(recent_turns=args.turns, history_tokens=10 ** 9)),
+                                   ("summarized", Conversation())):
+            prompt_tokens = []
+            for turn in range(args.turns):
+                telemetry.reset()
+                "".join(retrieval_generation_stream(f"{QUESTIONS[turn % len(QUESTIONS)]} And what about case {turn}?", conversation))
+                counters = telemetry.snapshot()["counters"]
+                prompt_tokens.append(counters.get('hrchatbot_prompt_tokens_total{operation="chat"}', 0))
+            result[name] = {"prompt_tokens_per_turn": prompt_tokens, "last_turn": prompt_tokens[-1]}
+        telemetry.configure()
+    return _report("conversation", result)
+
+def bench_hedged_search(args):
+    # Retrieval latency with the semantic query alone and hedged against a plain hybrid query,
+    # when the semantic ranker occasionally stalls
+    from . import retrieval_generation as rg
+    from . import telemetry
+    from .fakes import lognormal
+
+    result = {}
+    with FakeAzureServer(search_latency=lognormal(args.search_median, 0.3, seed=1),
+                         semantic_latency=lognormal(args.semantic_median, 0.3, args.spike_probability, args.spike, seed=2)) as server:
+        _use_server(server)
+        telemetry.configure("metrics")
+        rg.retrieve(QUESTIONS[0])
+        for mode, deadline in (("semantic_only", ""), ("hedged", str(args.deadline))):
+            os.environ["SEARCH_DEADLINE"] = deadline
+            telemetry.reset()
+            latencies = []
+            for i in range(args.questions):
+                start = time.perf_counter()
+                rg.retrieve(QUESTIONS[i % len(QUESTIONS)])
+                latencies.append(time.perf_counter() - start)
+            paths = {key.split('"')[1]: value for key, value in telemetry.snapshot()["counters"].items() if key.startswith("hrchatbot_search_path_total")}
+            result[mode] = {"p50_ms": _percentile(latencies, 50) * 1000, "p99_ms": _percentile(latencies, 99) * 1000,
+                            "max_ms": max(latencies) * 1000, "paths": paths}
+        os.environ.pop("SEARCH_DEADLINE")
+        telemetry.configure()
+    result["p99_saved_ms"] = result["semantic_only"]["p99_ms"] - result["hedged"]["p99_ms"]
+    return _report("hedged-search", result)
+
+def bench_index_profiles(args):
+    # recall@k and memory per index profile, simulated with NumPy on stored chunk embeddings
+    # (a local index directory or a .npy file) or on synthetic ones, searched with held-out
+    # query vectors; see index_profiles.simulate() for what is modelled
+    import numpy as np
+    from . import index_profiles
+
+    rng = np.random.default_rng(0)
+    if args.vectors:
+        # Held-out chunks stand in for the questions and are left out of the index
+        vectors = index_profiles.load_vectors(args.vectors)
+        rows = rng.choice(len(vectors), size=min(args.queries, len(vectors) // 10), replace=False)
+        queries = vectors[rows]
+        vectors = np.delete(vectors, rows, axis=0)
+    else:
+        # Clustered vectors whose leading dimensions carry the most variance, like embeddings
+        # trained to survive truncation; the queries are fresh draws from the same clusters
+        centers = rng.standard_normal((args.clusters, args.dimensions), dtype=np.float32)
+        weights = (1.0 / np.sqrt(1.0 + np.arange(args.dimensions) / 256.0)).astype(np.float32)
+
+        def draw(count):
+            return (centers[rng.integers(0, args.clusters, count)] + 0.8 * rng.standard_normal((count, args.dimensions), dtype=np.float32)) * weights
+
+        vectors, queries = draw(args.count), draw(args.queries)
+
+    result = {"vectors": len(vectors), "dimensions": int(vectors.shape[1]), "k": args.k, "profiles": {}}
+    for name in args.profiles.split(","):
+        profile = index_profiles.index_profile(name)
+        profile.update({key: value for key, value in (("m", args.m), ("ef_search", args.ef_search)) if value})
+        if profile["truncate_dimensions"] and profile["truncate_dimensions"] >= vectors.shape[1]:
+            continue
+        start = time.perf_counter()
+        stats = index_profiles.simulate(vectors, queries, profile, args.k)
+        stats["index_mb"] = (stats["vector_bytes"] + stats["graph_bytes"]) / 2 ** 20
+        stats["query_ms"] = (time.perf_counter() - start) / len(queries) * 1000
+        result["profiles"][name] = stats
+    return _report("index-profiles", result)
+
+def bench_scheduler(args):
+    # Interactive questions and a batch job sharing one chat deployment quota, sent straight
+    # through (the SDK retries the 429s) and through the quota scheduler
+    import threading
+    from . import clients, scheduler
+
+    quota = {"tpm": args.tpm, "rpm": args.rpm}
+    prompt = "Summarize the sick leave policy for a new employee. " * 8
+    result = {}
+    with FakeAzureServer(chat_latency=args.latency, quotas={"chat": quota}) as server:
+        _use_server(server)
+        # Stay a little under the deployment quota, the fake counts tokens slightly differently
+        os.environ["CHAT_TPM"] = str(args.tpm * 0.95)
+        os.environ["CHAT_RPM"] = str(args.rpm * 0.95)
+        os.environ["COMPLETION_TOKEN_ESTIMATE"] = str(len(server.answer) // 4)
+        client = clients.get_openai_client()
+
+        for mode in ("off", "on"):
+            os.environ["OPENAI_SCHEDULER"] = mode
+            scheduler.reset()
+            if mode == "on":
+                # Let the fake's quota refill between modes
+                time.sleep(10)
+            server.throttled = 0
+            latencies = []
+            counts = {"batch": 0, "failed": 0}
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.seconds
+
+            def ask():
+                start = time.perf_counter()
+                client.chat.completions.create(model=os.getenv("CHAT_COMPLETION_NAME"), messages=[{"role": "user", "content": prompt}])
+                return time.perf_counter() - start
+
+            def interactive():
+                while time.perf_counter() < deadline:
+                    try:
+                        seconds = ask()
+                        with lock:
+                            latencies.append(seconds)
+                    except Exception:
+                        with lock:
+                            counts["failed"] += 1
+                    time.sleep(args.think_time)
+
+            def batch():
+                with scheduler.priority(scheduler.BATCH):
+                    while time.perf_counter() < deadline:
+                        try:
+                            ask()
+                            with lock:
+                                counts["batch"] += 1
+                        except Exception:
+                            with lock:
+                                counts["failed"] += 1
+
+            threads = [threading.Thread(target=interactive) for _ in range(args.interactive)]
+            threads += [threading.Thread(target=batch) for _ in range(args.batch)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            result[f"scheduler_{mode}"] = {
+                "throttled_429": server.throttled,
+                "failed": counts["failed"],
+                "interactive_answered": len(latencies),
+                "interactive_p50_ms": _percentile(latencies, 50) * 1000 if latencies else None,
+                "interactive_p99_ms": _percentile(latencies, 99) * 1000 if latencies else None,
+                "batch_per_second": counts["batch"] / args.seconds,
+            }
+        for name in ("OPENAI_SCHEDULER", "CHAT_TPM", "CHAT_RPM", "COMPLETION_TOKEN_ESTIMATE"):
+            os.environ.pop(name)
+    return _report("scheduler", result)
+
+def bench_snapshot(args):
+    # Export of a synthetic index to a snapshot file and its restore into fresh indexes,
+    # with one upload worker and with several
+    import tempfile
+    import numpy as np
+    from . import snapshot
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.documents, args.dimensions)).astype(np.float32)
+    documents = [{"parent_id": f"doc{i // 20}", "chunk_id": f"doc{i // 20}_pages_{i % 20}", "title": f"Human Resource Policy {i // 20:03d}.pdf",
+                  "chunk": " ".join(QUESTIONS[(i + j) % len(QUESTIONS)] for j in range(8)), "vector": vectors[i].tolist()}
+                 for i in range(args.documents)]
+    result = {}
+    with FakeAzureServer(documents=documents, index_latency=args.latency) as server, tempfile.TemporaryDirectory() as directory:
+        _use_server(server)
+        path = os.path.join(directory, "snapshot.npz")
+        index_client = server.index_client()
+        result["export"] = snapshot.export_index(path, page_size=args.page_size, index_client=index_client)
+        result["export"]["json_bytes"] = len(json.dumps(documents))
+
+        for workers in (1, args.workers):
+            name = f"restored-{workers}"
+            result[f"import_{workers}_workers"] = snapshot.import_index(path, name, args.batch_size, workers, index_client)
+            restored = sorted(server.index_documents[name], key=lambda document: document["chunk_id"])
+            expected = sorted(documents, key=lambda document: document["chunk_id"])
+            result[f"import_{workers}_workers"]["identical"] = all(
+                a["chunk_id"] == b["chunk_id"] and a["chunk"] == b["chunk"] and np.array_equal(np.float32(a["vector"]), np.float32(b["vector"]))
+                for a, b in zip(restored, expected)) and len(restored) == len(expected)
+    return _report("snapshot", result)
+
+POLICY_TOPICS = [
+    "Employee Health", "Occupational Safety and Health", "Political Staff", "Sick Leave", "Vacation Leave", "Overtime",
+    "Harassment Prevention", "Travel Expenses", "Recruitment and Selection", "Performance Management",
+    "Termination of Employment", "Parental Leave", "Workplace Accommodation", "Conflict of Interest",
+    "Flexible Work Arrangements", "Bereavement Leave", "Training and Development", "Standards of Conduct",
+    "Grievance Procedure", "Remote Work", "Probationary Period", "Compensation and Classification",
+    "Benefits Administration", "Dress Code", "Records Management", "Information Security", "Volunteer Leave",
+    "Jury Duty", "Relocation Expenses", "Retirement",
+]
+
+def bench_document_routing(args):
+    # Retrieval latency over every chunk and pre-filtered to the routed documents, with search
+    # latency that grows with the chunks searched, plus how often the router finds the
+    # document a question is about and how often it routes a question that names none
+    import tempfile
+    from . import catalog
+    from . import retrieval_generation as rg
+
+    topics = POLICY_TOPICS[:args.documents]
+    documents = [{"parent_id": f"doc{i}", "chunk_id": f"doc{i}_pages_{j}", "title": f"Human Resource Policy {i + 1:02d} - {topic}.pdf",
+                  "chunk": f"Section {j} of the {topic.lower()} policy."}
+                 for i, topic in enumerate(topics) for j in range(args.chunks)]
+    targeted = []
+    for i, topic in enumerate(topics):
+        for template in ("Which HR policy document talks about {}?", "What does the {} policy say about approvals?", "How does {} work for part-time staff?"):
+            targeted.append((template.format(topic.lower()), f"doc{i}"))
+    general = ["How do I update my direct deposit details?", "Who approves a change to my job title?",
+               "What should I do on my first day?", "Can my manager change my schedule without notice?"]
+    result = {}
+    with FakeAzureServer(documents=documents, search_latency=args.search_latency, search_chunk_latency=args.chunk_latency) as server, \
+         tempfile.TemporaryDirectory() as directory:
+        _use_server(server)
+        os.environ["DOCUMENT_CATALOG_PATH"] = os.path.join(directory, "catalog.json")
+        start = time.perf_counter()
+        built = catalog.refresh_catalog()
+        result["catalog"] = {"documents": len(built["documents"]), "refresh_ms": (time.perf_counter() - start) * 1000}
+
+        router = catalog.DocumentRouter(built["documents"])
+        hits = sum(1 for question, parent_id in targeted if parent_id in router.route(question))
+        result["router"] = {
+            "hit_rate": hits / len(targeted),
+            "documents_per_routed_question": sum(len(router.route(question)) for question, _ in targeted) / len(targeted),
+            "general_questions_routed": sum(1 for question in general if router.route(question)) / len(general),
+        }
+        start = time.perf_counter()
+        for question, _ in targeted:
+            router.route(question)
+        result["router"]["route_us"] = (time.perf_counter() - start) / len(targeted) * 1e6
+
+        questions = [question for question, _ in targeted] + general
+        rg.retrieve(questions[0])
+        for mode in ("off", "on"):
+            os.environ["DOCUMENT_ROUTING"] = mode
+            latencies = []
+            for i in range(args.questions):
+                start = time.perf_counter()
+                rg.retrieve(questions[i % len(questions)])
+                latencies.append(time.perf_counter() - start)
+            result[f"routing_{mode}"] = {"p50_ms": _percentile(latencies, 50) * 1000, "p95_ms": _percentile(latencies, 95) * 1000}
+        os.environ.pop("DOCUMENT_ROUTING")
+        os.environ.pop("DOCUMENT_CATALOG_PATH")
+    return _report("document-routing", result)
+
+def bench_replay(args):
+    # Records questions against the fake services into a cassette, then replays them with
+    # the services gone: at the recorded speed (latencies should match) and instantly
+    # (what is left is the client-side time per question)
+    import tempfile
+    from . import clients, cassette
+    from . import retrieval_generation as rg
+    from .fakes import lognormal
+
+    def run(mode, speed="1"):
+        os.environ.update(HTTP_CASSETTE=path, HTTP_CASSETTE_MODE=mode, HTTP_REPLAY_SPEED=speed)
+        # New clients pick up the cassette transport; the pipeline holds on to its own references
+        clients.close()
+        rg._initialized = False
+        answers, first_token, total = [], [], []
+        for i in range(args.questions):
+            stream = rg.retrieval_generation_stream(QUESTIONS[i % len(QUESTIONS)])
+            answers.append("".join(stream))
+            first_token.append(stream.time_to_first_token)
+            total.append(stream.total_time)
+        return answers, {"ttft_p50_ms": _percentile(first_token, 50) * 1000, "total_p50_ms": _percentile(total, 50) * 1000,
+                         "total_p95_ms": _percentile(total, 95) * 1000, "seconds": sum(total)}
+
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.jsonl")
+        with FakeAzureServer(search_latency=lognormal(args.search_median, 0.3, seed=1), chat_latency=lognormal(args.chat_median, 0.3, seed=2),
+                             token_latency=args.token_latency) as server:
+            _use_server(server)
+            recorded, result["recorded"] = run("record")
+            result["recorded"]["requests"] = server.requests
+        result["cassette_bytes"] = os.path.getsize(path)
+
+        # The fake services are gone from here on
+        replayed, result["replay_original_speed"] = run("replay", "1")
+        instant, result["replay_instant"] = run("replay", "instant")
+        result["replay_instant"]["client_ms_per_question"] = result["replay_instant"]["seconds"] / args.questions * 1000
+        result["answers_identical"] = recorded == replayed == instant
+        result["replay_stats"] = cassette.get_cassette().stats
+        clients.close()
+        rg._initialized = False
+        for name in ("HTTP_CASSETTE", "HTTP_CASSETTE_MODE", "HTTP_REPLAY_SPEED"):
+            os.environ.pop(name)
+    return _report("replay", result)
+
+def bench_semantic_answers(args):
+    # Answer scores vary per question; the offline evaluation reports the short-circuit rate
+    # per threshold pair, then questions run with ANSWER_POLICY=generate and =extractive
+    import random
+    from . import semantic_answers
+    from . import retrieval_generation as rg
+    from .fakes import lognormal
+
+    def answer_score(request):
+        # The same question always gets the same score, spread like the service's
+        return round(random.Random(request.get("search")).betavariate(5, 1.5), 3)
+
+    def run(policy):
+        os.environ["ANSWER_POLICY"] = policy
+        latencies = []
+        for i in range(args.questions):
+            start = time.perf_counter()
+            rg.retrieval_generation(texts[i % len(texts)])
+            latencies.append(time.perf_counter() - start)
+        return {"p50_ms": _percentile(latencies, 50) * 1000, "p95_ms": _percentile(latencies, 95) * 1000,
+                "mean_ms": sum(latencies) / len(latencies) * 1000}
+
+    texts = QUESTIONS + [f"What does the {topic.lower()} policy say?" for topic in POLICY_TOPICS]
+    questions = [{"id": str(i), "question": question} for i, question in enumerate(texts)]
+    with FakeAzureServer(search_latency=lognormal(args.search_median, 0.3, seed=1), chat_latency=lognormal(args.chat_median, 0.3, seed=2),
+                         answer_score=answer_score) as server:
+        _use_server(server)
+        os.environ.update(SEMANTIC_ANSWER_MIN_SCORE=str(args.min_score), SEMANTIC_ANSWER_MIN_RERANKER=str(args.min_reranker))
+        result = {"evaluation": semantic_answers.evaluate(questions, workers=4), "generate": run("generate"), "extractive": run("extractive")}
+        for name in ("ANSWER_POLICY", "SEMANTIC_ANSWER_MIN_SCORE", "SEMANTIC_ANSWER_MIN_RERANKER"):
+            os.environ.pop(name)
+    result["latency_saved_p50_ms"] = result["generate"]["p50_ms"] - result["extractive"]["p50_ms"]
+    return _report("semantic-answers", result)
+
+def bench_prompt_cache(args):
+    # Prompt tokens served from the prompt cache with the old layout (one system message,
+    # context in score order, question inside it) and with build_messages(), for questions
+    # that retrieve the same chunks in a different order (paraphrases, follow-ups) and for
+    # distinct questions that retrieve distinct chunks. Distinct questions share only the
+    # system prompt, which is shorter than the 1024 tokens the service starts caching at
+    import random
+    import statistics
+    from . import clients, prompt_prefix, telemetry
+    from . import retrieval_generation as rg
+
+    def old_layout(query, context):
+        # The budget fits every chunk, so the old packing was the chunks in score order
+        ordered = sorted(context, key=lambda item: item["reranker_score"] or 0, reverse=True)
+        text = "\n\n".join(item["content"] for item in ordered)
+        return [{"role": "system", "content": REPR_PROMPT.format(context=text, query=query)}]
+
+    rng = random.Random(1)
+    words = ["employee", "leave", "policy", "manager", "days", "benefits", "ministry", "health", "salary", "review"]
+    documents = [{"parent_id": f"doc{d}", "chunk_id": f"doc{d}_pages_0", "title": f"Policy {d}.pdf",
+                  "chunk": " ".join(rng.choice(words) for _ in range(args.words))} for d in range(args.documents)]
+    questions = [f"{question} ({i})" for i in range(args.questions) for question in QUESTIONS][:args.questions]
+
+    result = {}
+    telemetry.configure("metrics")
+    for scenario, options in (("same_chunks", dict(documents=documents[:args.top], shuffle_results=True)),
+                              ("distinct_chunks", dict(documents=documents, sample_results=True))):
+        result[scenario] = {}
+        for layout in ("old", "new"):
+            prompt_prefix._tracker = None
+            with FakeAzureServer(chat_latency=args.chat_latency, prompt_token_latency=args.prompt_token_latency, prompt_cache=True, **options) as server:
+                _use_server(server)
+                # New clients for each server
+                clients.close()
+                rg._initialized = False
+                os.environ.update(SEARCH_TOP_K=str(args.top), CONTEXT_TOKEN_BUDGET="100000")
+                prompt_tokens, cached_tokens, latencies = [], [], []
+                for query in questions:
+                    context = rg.retrieve(query)
+                    messages = old_layout(query, context) if layout == "old" else rg.build_messages(query, context)
+                    if layout == "old":
+                        prompt_prefix.record(messages)
+                    start = time.perf_counter()
+                    response = rg.client.chat.completions.create(model=os.getenv("CHAT_COMPLETION_NAME"), messages=messages)
+                    latencies.append(time.perf_counter() - start)
+                    prompt_tokens.append(response.usage.prompt_tokens)
+                    cached_tokens.append(response.usage.prompt_tokens_details.cached_tokens)
+                for name in ("SEARCH_TOP_K", "CONTEXT_TOKEN_BUDGET"):
+                    os.environ.pop(name)
+            stats = prompt_prefix.get_tracker().stats
+            result[scenario][layout] = {"prompt_tokens": statistics.mean(prompt_tokens), "cached_tokens": statistics.mean(cached_tokens),
+                                        "cached_share": sum(cached_tokens) / sum(prompt_tokens),
+                                        "estimated_cacheable_share": stats["cacheable_tokens"] / stats["prompt_tokens"],
+                                        "completion_p50_ms": statistics.median(latencies) * 1000}
+    clients.close()
+    rg._initialized = False
+    telemetry.configure()
+    return _report("prompt-cache", result)
+
+# Started in a fresh interpreter: what main.py does up to the prompt, a pause for typing,
+# then two questions. Each line is printed as it happens so the parent can time it
+STARTUP_SCRIPT = """
+import sys, time
+from hrchatbot import startup
+from hrchatbot.conversation import Conversation
+starting = startup.start(provision=False)
+print("prompt", flush=True)
+time.sleep(float(sys.argv[1]))
+for question in sys.argv[2:4]:
+    start = time.perf_counter()
+    starting.wait()
+    from hrchatbot.retrieval_generation import retrieval_generation_stream
+    stream = retrieval_generation_stream(question, Conversation())
+    text = "".join(stream)
+    print("answer", time.perf_counter() - start, stream.time_to_first_token, flush=True)
+"""
+
+def _import_ms(modules):
+    # Cumulative import time of modules in a fresh interpreter, from -X importtime
+    import subprocess
+    import sys
+
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            times[parts[2].strip()] = int(parts[1]) / 1000
+    return {module: times.get(module) for module in modules}
+
+def bench_startup(args):
+    # Time from launch to the prompt and to the first answer, with start-up in the
+    # background (the default) and before the prompt, and the import time moved off the
+    # path to the prompt
+    import subprocess
+    import sys
+    from .fakes import lognormal
+
+    result = {
+        "prompt_imports_ms": _import_ms(["hrchatbot.startup", "hrchatbot.conversation", "hrchatbot.telemetry"]),
+        "background_imports_ms": _import_ms(["hrchatbot.retrieval_generation", "hrchatbot.load_data_create_index", "azure.search.documents",
+                                              "openai", "azure.identity", "azure.storage.blob"]),
+    }
+    with FakeAzureServer(search_latency=lognormal(args.search_median, 0.3, seed=1), chat_latency=lognormal(args.chat_median, 0.3, seed=2)) as server:
+        for mode in ("on", "off"):
+            runs = []
+            for _ in range(args.runs):
+                env = {**os.environ, **server.environ(), "ANSWER_CACHE": "off", "BACKGROUND_STARTUP": mode}
+                start = time.perf_counter()
+                process = subprocess.Popen([sys.executable, "-c", STARTUP_SCRIPT, str(args.think_time), QUESTIONS[0], QUESTIONS[1]],
+                                           stdout=subprocess.PIPE, text=True, env=env)
+                prompt = None
+                answers = []
+                for line in process.stdout:
+                    if line.startswith("prompt"):
+                        prompt = time.perf_counter() - start
+                    elif line.startswith("answer"):
+                        answers.append([float(value) for value in line.split()[1:]])
+                process.wait()
+                runs.append((prompt, answers))
+            result[f"background_{mode}"] = {
+                "time_to_prompt_ms": _percentile([prompt for prompt, _ in runs], 50) * 1000,
+                "first_answer_ms": _percentile([answers[0][0] for _, answers in runs], 50) * 1000,
+                "second_answer_ms": _percentile([answers[1][0] for _, answers in runs], 50) * 1000,
+            }
+    return _report("startup", result)
+
+def bench_telemetry(args):
+    # Cost of the instrumentation itself: one question's worth of stages and counters, per mode
+    from . import telemetry
+
+    result = {}
+    for mode in ("off", "metrics"):
+        telemetry.configure(mode)
+        telemetry.reset()
+        start = time.perf_counter()
+        for i in range(args.iterations):
+            with telemetry.question("How many vacation days do I get?"):
+                for name in ("embedding", "search", "result_iteration", "prompt", "completion"):
+                    with telemetry.stage(name):
+                        pass
+                telemetry.increment("hrchatbot_answer_cache_misses_total")
+                telemetry.observe("hrchatbot_reranker_score", 2.5)
+        result[mode] = {"us_per_question": (time.perf_counter() - start) / args.iterations * 1e6}
+    telemetry.configure()
+    result["added_us_per_question"] = result["metrics"]["us_per_question"] - result["off"]["us_per_question"]
+    return _report("telemetry", result)
+
+def bench_blob_sync(args):
+    # First sync uploads everything, the second touches nothing, the third only what changed
+    import tempfile
+    from .blob_sync import sync_documents
+    from .fakes import FakeContainerClient
+
+    container_client = FakeContainerClient(request_latency=args.latency, bytes_per_second=args.bandwidth)
+    manifest = {}
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.files):
+            with open(os.path.join(directory, f"policy-{i:04d}.pdf"), "wb") as f:
+                f.write(os.urandom(args.file_size))
+
+        result["initial"] = sync_documents(container_client, directory, manifest, max_workers=args.workers)
+        result["unchanged"] = sync_documents(container_client, directory, manifest, max_workers=args.workers)
+
+        for i in range(0, args.files, 10):
+            with open(os.path.join(directory, f"policy-{i:04d}.pdf"), "wb") as f:
+                f.write(os.urandom(args.file_size))
+        os.remove(os.path.join(directory, f"policy-{args.files - 1:04d}.pdf"))
+        result["changed_10_percent"] = sync_documents(container_client, directory, manifest, max_workers=args.workers)
+
+        serial_container_client = FakeContainerClient(request_latency=args.latency, bytes_per_second=args.bandwidth)
+        result["initial_serial"] = sync_documents(serial_container_client, directory, {}, max_workers=1)
+
+    return _report("blob-sync", result)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.benchmark")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    connections = subparsers.add_parser("connections", help="connection reuse and async throughput")
+    connections.add_argument("--questions", type=int, default=50)
+    connections.add_argument("--concurrency", type=int, default=16)
+    connections.add_argument("--latency", type=float, default=0.02, help="simulated service latency in seconds")
+    connections.set_defaults(func=bench_connections)
+
+    blob_sync = subparsers.add_parser("blob-sync", help="manifest-driven parallel blob sync against a fake container")
+    blob_sync.add_argument("--files", type=int, default=100)
+    blob_sync.add_argument("--file-size", type=int, default=256 * 1024)
+    blob_sync.add_argument("--workers", type=int, default=8)
+    blob_sync.add_argument("--latency", type=float, default=0.02, help="simulated per-request latency in seconds")
+    blob_sync.add_argument("--bandwidth", type=float, default=50e6, help="simulated bytes per second per upload")
+    blob_sync.set_defaults(func=bench_blob_sync)
+
+    cache = subparsers.add_parser("answer-cache", help="hit rate and latency saved by the answer cache")
+    cache.add_argument("--questions", type=int, default=200)
+    cache.add_argument("--repeat-ratio", type=float, default=0.7, help="share of questions that repeat a popular one")
+    cache.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    cache.add_argument("--latency", type=float, default=0.02, help="simulated search latency; the completion takes 10x")
+    cache.set_defaults(func=bench_answer_cache)
+
+    embedding_cache = subparsers.add_parser("embedding-cache", help="latency removed by the query embedding cache")
+    embedding_cache.add_argument("--questions", type=int, default=50)
+    embedding_cache.add_argument("--latency", type=float, default=0.05, help="simulated embeddings endpoint latency in seconds")
+    embedding_cache.set_defaults(func=bench_embedding_cache)
+
+    local_backend = subparsers.add_parser("local-backend", help="queries per second and p99 of the local retrieval backend")
+    local_backend.add_argument("--sizes", default="10000,100000", help="comma-separated chunk counts (1000000 at 1536 dimensions needs about 6 GB)")
+    local_backend.add_argument("--dimensions", type=int, default=1536)
+    local_backend.add_argument("--vocabulary", type=int, default=20000)
+    local_backend.add_argument("--queries", type=int, default=200)
+    local_backend.add_argument("--top", type=int, default=1)
+    local_backend.set_defaults(func=bench_local_backend)
+
+    bulk = subparsers.add_parser("bulk-embedding", help="batched, cached chunk embedding against a throttling fake endpoint")
+    bulk.add_argument("--chunks", type=int, default=2000)
+    bulk.add_argument("--dimensions", type=int, default=256)
+    bulk.add_argument("--workers", type=int, default=4)
+    bulk.add_argument("--batch-tokens", type=int, default=100000)
+    bulk.add_argument("--edited-percent", type=int, default=10)
+    bulk.add_argument("--latency", type=float, default=0.1, help="simulated embeddings request latency in seconds")
+    bulk.add_argument("--throttle-ratio", type=float, default=0.2, help="share of requests answered with a 429")
+    bulk.set_defaults(func=bench_bulk_embedding)
+
+    stages = subparsers.add_parser("stages", help="per-stage latency percentiles and throughput of retrieval_generation()")
+    stages.add_argument("--questions", type=int, default=200)
+    stages.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    stages.add_argument("--search-median", type=float, default=0.05, help="median search latency in seconds")
+    stages.add_argument("--chat-median", type=float, default=0.3, help="median completion latency in seconds")
+    stages.add_argument("--sigma", type=float, default=0.5, help="log-normal spread of both latencies")
+    stages.add_argument("--output", help="JSON results file (default .hrchatbot/benchmarks/stages-<commit>.json)")
+    stages.add_argument("--compare", help="earlier results file to report p50/p99 changes against")
+    stages.set_defaults(func=bench_stages)
+
+    packing = subparsers.add_parser("context-packing", help="prompt tokens and completion latency with packed context")
+    packing.add_argument("--questions", type=int, default=30)
+    packing.add_argument("--top", type=int, default=3)
+    packing.add_argument("--words", type=int, default=3000, help="words per synthetic document")
+    packing.add_argument("--chat-latency", type=float, default=0.02)
+    packing.add_argument("--prompt-token-latency", type=float, default=0.00005, help="seconds of chat latency per prompt token")
+    packing.set_defaults(func=bench_context_packing)
+
+    serve = subparsers.add_parser("serve", help="load test of the HTTP server with in-flight coalescing")
+    serve.add_argument("--requests", type=int, default=400)
+    serve.add_argument("--clients", type=int, default=64)
+    serve.add_argument("--distinct", type=int, default=10, help="distinct variants per question")
+    serve.add_argument("--server-concurrency", type=int, default=16)
+    serve.add_argument("--queue", type=int, default=64)
+    serve.add_argument("--search-latency", type=float, default=0.05)
+    serve.add_argument("--chat-latency", type=float, default=0.2)
+    serve.set_defaults(func=bench_serve)
+
+    conversation = subparsers.add_parser("conversation", help="prompt tokens per turn with summarized conversation history")
+    conversation.add_argument("--turns", type=int, default=12)
+    conversation.add_argument("--answer-sentences", type=int, default=8, help="length of the fake answer")
+    conversation.set_defaults(func=bench_conversation)
+
+    hedged = subparsers.add_parser("hedged-search", help="p99 retrieval latency with hedged semantic and plain hybrid queries")
+    hedged.add_argument("--questions", type=int, default=300)
+    hedged.add_argument("--deadline", type=float, default=0.15)
+    hedged.add_argument("--search-median", type=float, default=0.03)
+    hedged.add_argument("--semantic-median", type=float, default=0.05)
+    hedged.add_argument("--spike-probability", type=float, default=0.05)
+    hedged.add_argument("--spike", type=float, default=1.0, help="seconds added to a stalled semantic query")
+    hedged.set_defaults(func=bench_hedged_search)
+
+    profiles = subparsers.add_parser("index-profiles", help="recall@k and memory of the vector index profiles")
+    profiles.add_argument("--vectors", help="local index directory, index snapshot or .npy of chunk embeddings; synthetic when omitted")
+    profiles.add_argument("--profiles", default="full,scalar,binary,scalar-1024,binary-1024,high-recall")
+    profiles.add_argument("--m", type=int, help="override the HNSW m of every profile")
+    profiles.add_argument("--ef-search", type=int, help="override the HNSW ef_search of every profile")
+    profiles.add_argument("--count", type=int, default=20000)
+    profiles.add_argument("--dimensions", type=int, default=1536)
+    profiles.add_argument("--clusters", type=int, default=200)
+    profiles.add_argument("--queries", type=int, default=200)
+    profiles.add_argument("--k", type=int, default=10)
+    profiles.set_defaults(func=bench_index_profiles)
+
+    sched = subparsers.add_parser("scheduler", help="429s and interactive latency under a shared chat quota, with and without the scheduler")
+    sched.add_argument("--seconds", type=float, default=20)
+    sched.add_argument("--tpm", type=int, default=60000)
+    sched.add_argument("--rpm", type=int, default=600)
+    sched.add_argument("--interactive", type=int, default=4)
+    sched.add_argument("--think-time", type=float, default=0.5, help="seconds between one user's questions")
+    sched.add_argument("--batch", type=int, default=8)
+    sched.add_argument("--latency", type=float, default=0.05)
+    sched.set_defaults(func=bench_scheduler)
+
+    snap = subparsers.add_parser("snapshot", help="index snapshot export and parallel restore into a fresh index")
+    snap.add_argument("--documents", type=int, default=2000)
+    snap.add_argument("--dimensions", type=int, default=1536)
+    snap.add_argument("--page-size", type=int, default=1000)
+    snap.add_argument("--batch-size", type=int, default=500)
+    snap.add_argument("--workers", type=int, default=8)
+    snap.add_argument("--latency", type=float, default=0.2, help="seconds per upload batch, standing in for indexing time")
+    snap.set_defaults(func=bench_snapshot)
+
+    routing = subparsers.add_parser("document-routing", help="retrieval latency and router hit rate with parent_id pre-filtering")
+    routing.add_argument("--documents", type=int, default=len(POLICY_TOPICS))
+    routing.add_argument("--chunks", type=int, default=200, help="chunks per document")
+    routing.add_argument("--questions", type=int, default=200)
+    routing.add_argument("--search-latency", type=float, default=0.02)
+    routing.add_argument("--chunk-latency", type=float, default=0.00001, help="search seconds per chunk searched")
+    routing.set_defaults(func=bench_document_routing)
+
+    replay = subparsers.add_parser("replay", help="record questions into a cassette and replay them offline, at recorded speed and instantly")
+    replay.add_argument("--questions", type=int, default=30)
+    replay.add_argument("--search-median", type=float, default=0.05)
+    replay.add_argument("--chat-median", type=float, default=0.2, help="median time to the first token")
+    replay.add_argument("--token-latency", type=float, default=0.01)
+    replay.set_defaults(func=bench_replay)
+
+    semantic = subparsers.add_parser("semantic-answers", help="short-circuit rate and latency of extractive semantic answers")
+    semantic.add_argument("--questions", type=int, default=40)
+    semantic.add_argument("--search-median", type=float, default=0.05)
+    semantic.add_argument("--chat-median", type=float, default=0.8)
+    semantic.add_argument("--min-score", type=float, default=0.9)
+    semantic.add_argument("--min-reranker", type=float, default=3.0)
+    semantic.set_defaults(func=bench_semantic_answers)
+
+    prompt_cache = subparsers.add_parser("prompt-cache", help="prompt tokens served from the prompt cache with the old and the cache-friendly prompt layout")
+    prompt_cache.add_argument("--questions", type=int, default=60)
+    prompt_cache.add_argument("--top", type=int, default=5)
+    prompt_cache.add_argument("--documents", type=int, default=200, help="documents the distinct questions retrieve from")
+    prompt_cache.add_argument("--words", type=int, default=400, help="words per chunk")
+    prompt_cache.add_argument("--chat-latency", type=float, default=0.05)
+    prompt_cache.add_argument("--prompt-token-latency", type=float, default=0.0002)
+    prompt_cache.set_defaults(func=bench_prompt_cache)
+
+    start_up = subparsers.add_parser("startup", help="time to the REPL prompt and to the first answer, with start-up in the background and before the prompt")
+    start_up.add_argument("--runs", type=int, default=5)
+    start_up.add_argument("--think-time", type=float, default=1.0, help="seconds between the prompt and the first question")
+    start_up.add_argument("--search-median", type=float, default=0.05)
+    start_up.add_argument("--chat-median", type=float, default=0.2)
+    start_up.set_defaults(func=bench_startup)
+
+    telemetry = subparsers.add_parser("telemetry", help="per-question overhead of tracing and metrics, off and on")
+    telemetry.add_argument("--iterations", type=int, default=20000)
+    telemetry.set_defaults(func=bench_telemetry)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    main()
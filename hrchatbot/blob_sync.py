@@ -0,0 +1,85 @@
+## Sync a local documents folder into a blob container
+# The container is listed once and compared by MD5 against the local files; only new or
+# changed files are uploaded (in parallel, as chunked block uploads) and blobs whose source
+# file is gone are deleted. The manifest dict caches local digests between runs and
+# remembers what was last uploaded for blobs the service stored without a Content-MD5.
+# A missing documents folder is an error, and an empty one never deletes blobs, so a wrong
+# path cannot empty the container.
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .provision_state import file_md5
+
+logger = logging.getLogger(__name__)
+
+def documents_directory():
+    # DOCUMENTS_DIR, or data/documents next to the package, wherever the bot is started from
+    return os.getenv("DOCUMENTS_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "documents")
+
+def _remote_md5(blob):
+    content_settings = getattr(blob, "content_settings", None)
+    content_md5 = getattr(content_settings, "content_md5", None)
+    return bytes(content_md5).hex() if content_md5 else None
+
+def sync_documents(container_client, documents_directory, manifest=None, max_workers=8, max_concurrency=1, delete_missing=True):
+    from azure.storage.blob import ContentSettings
+
+    start = time.perf_counter()
+    manifest = manifest if manifest is not None else {}
+    file_cache = manifest.setdefault("files", {})
+    synced = manifest.setdefault("blobs", {})
+
+    if not os.path.isdir(documents_directory):
+        raise FileNotFoundError(f"Documents folder {documents_directory} does not exist")
+    local = {}
+    for path in glob.glob(os.path.join(documents_directory, '*')):
+        if os.path.isfile(path):
+            local[os.path.basename(path)] = (path, file_md5(path, file_cache))
+
+    remote = {blob.name: blob for blob in container_client.list_blobs()}
+
+    to_upload = []
+    for name, (path, md5) in local.items():
+        blob = remote.get(name)
+        if blob is None:
+            to_upload.append(name)
+            continue
+        # Block uploads do not get a service-computed MD5, so fall back to what we last pushed
+        remote_md5 = _remote_md5(blob) or (synced.get(name) if blob.size == os.path.getsize(path) else None)
+        if remote_md5 != md5:
+            to_upload.append(name)
+    to_delete = [name for name in remote if name not in local] if delete_missing else []
+    if to_delete and not local:
+        logger.warning("%s has no files; keeping the %d blobs in the container", documents_directory, len(to_delete))
+        to_delete = []
+
+    def upload(name):
+        path, md5 = local[name]
+        size = os.path.getsize(path)
+        with open(path, "rb") as data:
+            container_client.upload_blob(name=name, data=data, length=size, overwrite=True, max_concurrency=max_concurrency,
+                                         content_settings=ContentSettings(content_md5=bytearray.fromhex(md5)))
+        return name, md5, size
+
+    def delete(name):
+        container_client.delete_blob(name)
+        return name
+
+    bytes_uploaded = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for name, md5, size in executor.map(upload, to_upload):
+            synced[name] = md5
+            bytes_uploaded += size
+        for name in executor.map(delete, to_delete):
+            synced.pop(name, None)
+
+    return {
+        "uploaded": len(to_upload),
+        "deleted": len(to_delete),
+        "unchanged": len(local) - len(to_upload),
+        "bytes_uploaded": bytes_uploaded,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
@@ -0,0 +1,179 @@
+## Client-side bulk embedding of chunks
+# Replaces one-chunk-at-a-time embedding inside the indexer for re-index runs: chunks are
+# looked up in the content-addressed embedding cache first (text hash, model, dimensions),
+# only the misses are packed into embeddings requests up to a token budget, requests run
+# with bounded concurrency and back off on 429s, and the vectors can be pushed with batched
+# uploads. Local chunk keys are not the keys the indexer's projection generates, so --push
+# writes to its own index (BULK_EMBEDDING_INDEX_NAME, by default <index>-bulk, created with
+# the main index's definition) instead of adding a second copy of every chunk to the main
+# one; point AZURE_SEARCH_INDEX_NAME at it to serve from it.
+# python -m hrchatbot.bulk_embedding [--chunks chunks.jsonl] [--push] [--index NAME]
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import embeddings, scheduler, telemetry
+from .scheduler import retry_after
+from .tokens import count_tokens
+
+# Azure OpenAI accepts at most 2048 inputs per embeddings request
+MAX_BATCH_INPUTS = 2048
+
+def pack_batches(texts, max_batch_tokens, max_batch_inputs=MAX_BATCH_INPUTS, model=None):
+    batch = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text, model)
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_inputs):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+class BulkEmbedder:
+    def __init__(self, client=None, cache=None, max_workers=4, max_batch_tokens=100000, max_retries=8):
+        from . import clients
+
+        self.model, self.dimensions = embeddings.model_settings()
+        # Retries are handled here, so the SDK's own retry loop is switched off
+        self.client = (client or clients.get_openai_client()).with_options(max_retries=0)
+        self.cache = cache or embeddings.get_embedding_cache()
+        self.max_workers = max_workers
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self.stats = {"texts": 0, "cached": 0, "embedded": 0, "requests": 0, "retries": 0, "tokens": 0}
+
+    def _transport_retries(self, counter):
+        if counter["retries"]:
+            with self._lock:
+                self.stats["retries"] += counter["retries"]
+            telemetry.increment("hrchatbot_openai_retries_total", counter["retries"], operation="embeddings", error="RateLimitError")
+
+    def _embed_batch(self, batch):
+        import openai
+
+        # 429s are retried by the scheduler's transport and counted here; this loop covers
+        # connection errors, 5xx, and 429s with OPENAI_SCHEDULER=off
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Re-index runs must not hold up questions waiting on the same deployment
+                with scheduler.priority(scheduler.BATCH), scheduler.count_retries() as counter:
+                    response = self.client.embeddings.create(model=self.model, input=batch, dimensions=self.dimensions)
+                break
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as error:
+                self._transport_retries(counter)
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.stats["retries"] += 1
+                telemetry.increment("hrchatbot_openai_retries_total", operation="embeddings", error=type(error).__name__)
+                time.sleep(retry_after(error, attempt))
+
+        self._transport_retries(counter)
+
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        self.cache.set_many((embeddings.cache_key(text, self.model, self.dimensions), vector) for text, vector in zip(batch, vectors))
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["embedded"] += len(batch)
+            self.stats["tokens"] += response.usage.prompt_tokens if response.usage else 0
+        telemetry.record_usage(response.usage, operation="embeddings")
+        return dict(zip(batch, vectors))
+
+    def embed(self, texts):
+        # Returns one vector per text, in order; identical texts are embedded once
+        keys = [embeddings.cache_key(text, self.model, self.dimensions) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in cached))
+
+        vectors_by_text = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for result in executor.map(self._embed_batch, pack_batches(missing, self.max_batch_tokens, model=self.model)):
+                vectors_by_text.update(result)
+
+        with self._lock:
+            self.stats["texts"] += len(texts)
+            self.stats["cached"] += len(texts) - sum(1 for key in keys if key not in cached)
+        return [cached[key] if key in cached else vectors_by_text[text] for text, key in zip(texts, keys)]
+
+def upload_documents(search_client, documents, batch_size=500, max_workers=4):
+    # Batched, parallel merge-or-upload so re-pushing a chunk replaces it in place
+    documents = list(documents)
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+
+    def upload(batch):
+        results = search_client.merge_or_upload_documents(documents=batch)
+        failed = [result.key for result in results if not result.succeeded]
+        if failed:
+            raise Exception(f"Failed to upload {len(failed)} documents, e.g. {failed[:5]}")
+        return len(batch)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(upload, batches))
+
+def push_index_name(s):
+    return os.getenv("BULK_EMBEDDING_INDEX_NAME") or f"{s['index_name']}-bulk"
+
+def push_search_client(s, index_name):
+    # A SearchClient for index_name, created with the main index's fields, vector search and
+    # semantic configuration if it does not exist yet
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from . import clients
+
+    if index_name == s["index_name"]:
+        raise Exception(f"Pushing into the indexer's index '{index_name}' would duplicate every chunk; use another index name")
+    credential = clients.search_credential(s)
+    index_client = SearchIndexClient(endpoint=s["endpoint"], credential=credential, **clients.transport_options(s))
+    index = index_client.get_index(s["index_name"])
+    index.name = index_name
+    index.e_tag = None
+    index_client.create_or_update_index(index)
+    return SearchClient(s["endpoint"], index_name, credential, transport=clients.search_transport(s))
+
+def embed_chunks(chunks, embedder=None):
+    # Adds a "vector" field to each chunk dict produced by chunking.chunk_document()
+    embedder = embedder or BulkEmbedder()
+    chunks = list(chunks)
+    for chunk, vector in zip(chunks, embedder.embed([chunk["chunk"] for chunk in chunks])):
+        chunk["vector"] = vector
+    return chunks
+
+if __name__ == "__main__":
+    from . import chunking, clients
+    from .blob_sync import documents_directory
+
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.bulk_embedding")
+    parser.add_argument("--chunks", help="JSONL written by python -m hrchatbot.chunking; chunks data/documents when omitted")
+    parser.add_argument("--directory", default=documents_directory())
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EMBEDDING_WORKERS", 4)))
+    parser.add_argument("--batch-tokens", type=int, default=int(os.getenv("EMBEDDING_BATCH_TOKENS", 100000)))
+    parser.add_argument("--push", action="store_true", help="upload the embedded chunks into a separate search index")
+    parser.add_argument("--index", help="index to push to; defaults to BULK_EMBEDDING_INDEX_NAME or <AZURE_SEARCH_INDEX_NAME>-bulk")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.chunks:
+        with open(args.chunks, encoding="utf-8") as f:
+            chunks = [json.loads(line) for line in f]
+    else:
+        mode = chunking.default_mode()
+        chunks = [chunk for path in sorted(os.listdir(args.directory))
+                  for chunk in chunking.chunk_document(os.path.join(args.directory, path), mode)]
+
+    embedder = BulkEmbedder(max_workers=args.workers, max_batch_tokens=args.batch_tokens)
+    chunks = embed_chunks(chunks, embedder)
+    result = dict(embedder.stats)
+    if args.push:
+        s = clients.settings()
+        result["index"] = args.index or push_index_name(s)
+        result["uploaded"] = upload_documents(push_search_client(s, result["index"]), chunks)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    print(json.dumps(result, indent=2))
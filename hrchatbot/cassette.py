@@ -0,0 +1,299 @@
+## Record/replay of HTTP traffic
+# HTTP_CASSETTE=path.jsonl with HTTP_CASSETTE_MODE=record sends every Azure AI Search, Blob
+# Storage and Azure OpenAI request as usual and appends it to the cassette: the request key
+# (method, path and query, body hash), the response status, headers and body, and when each
+# part of the body arrived, so streamed completions keep their time to first token.
+# HTTP_CASSETTE_MODE=replay answers the same requests from the cassette without a network
+# (the endpoints only need placeholder values), at the recorded speed or faster:
+# HTTP_REPLAY_SPEED=1 waits as long as the service did, 0 (or "instant") not at all.
+# That makes a slow production question reproducible on a laptop, and leaves only the
+# client-side work (serialization, paging, prompt building) when profiling with speed 0.
+# Requests are matched on their body hash first and then on the path alone; repeated
+# requests get the recorded responses in order, the last one again once they run out.
+# The requests session (azure-core) and the httpx client (openai) each get an adapter here.
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+# Never written to a cassette, and recomputed on replay
+DROPPED_REQUEST_HEADERS = frozenset(["api-key", "authorization", "x-ms-date", "date", "cookie"])
+DROPPED_RESPONSE_HEADERS = frozenset(["content-length", "transfer-encoding", "connection", "keep-alive", "set-cookie"])
+
+# Query parameters that carry credentials (Blob SAS tokens, key query strings); their values
+# are replaced when recording and when matching, so expiring tokens still match on replay
+SCRUBBED_QUERY_PARAMETERS = frozenset(["sig", "se", "st", "sp", "sv", "sr", "spr", "sip", "ss", "srt", "skoid", "sktid",
+                                       "skt", "ske", "sks", "skv", "sduoid", "api-key", "code"])
+
+class CassetteMiss(Exception):
+    pass
+
+def _scrub_query(query):
+    parameters = []
+    for parameter in query.split("&"):
+        name, separator, _ = parameter.partition("=")
+        parameters.append(f"{name}=REDACTED" if separator and name.lower() in SCRUBBED_QUERY_PARAMETERS else parameter)
+    return "&".join(parameters)
+
+def _path(url):
+    parts = urlsplit(str(url))
+    return parts.path + ("?" + _scrub_query(parts.query) if parts.query else "")
+
+def _body_hash(body):
+    if body is None:
+        body = b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, (bytes, bytearray)):
+        # A file or generator body (blob uploads) is not hashed; those match on the path
+        return None
+    return hashlib.sha256(body).hexdigest()
+
+def _encode(data):
+    try:
+        return {"text": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(data).decode("ascii")}
+
+def _decode(part):
+    return part["text"].encode("utf-8") if "text" in part else base64.b64decode(part["base64"])
+
+def replay_speed():
+    speed = os.getenv("HTTP_REPLAY_SPEED", "1")
+    return 0.0 if speed == "instant" else 1.0 if speed == "original" else float(speed)
+
+class Cassette:
+    def __init__(self, path, mode="replay", speed=1.0):
+        if mode not in ("record", "replay"):
+            raise Exception(f"Unknown HTTP_CASSETTE_MODE '{mode}', expected record or replay")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "replayed": 0, "path_matches": 0}
+        self._by_body = defaultdict(deque)
+        self._by_path = defaultdict(deque)
+        if mode == "replay":
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._by_body[(entry["method"], entry["path"], entry["body_sha256"])].append(entry)
+                        self._by_path[(entry["method"], entry["path"])].append(entry)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def record(self, method, url, headers, body, status, response_headers, latency, parts, decoded=True):
+        # latency is the time to the response headers and parts a list of (seconds since the
+        # request was sent, bytes); a decoded body is stored without its Content-Encoding
+        dropped = DROPPED_RESPONSE_HEADERS | {"content-encoding"} if decoded else DROPPED_RESPONSE_HEADERS
+        entry = {
+            "method": method,
+            "path": _path(url),
+            "body_sha256": _body_hash(body),
+            "request_headers": {name: value for name, value in headers.items() if name.lower() not in DROPPED_REQUEST_HEADERS},
+            "status": status,
+            "headers": {name: value for name, value in response_headers.items() if name.lower() not in dropped},
+            "latency": round(latency, 6),
+            "parts": [{"at": round(at, 6), **_encode(data)} for at, data in parts if data],
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.stats["recorded"] += 1
+
+    def play(self, method, url, body):
+        path = _path(url)
+        with self._lock:
+            queue = self._by_body.get((method, path, _body_hash(body)))
+            if not queue:
+                queue = self._by_path.get((method, path))
+                if not queue:
+                    raise CassetteMiss(f"No recorded response for {method} {path} in {self.path}")
+                self.stats["path_matches"] += 1
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self.stats["replayed"] += 1
+        return entry
+
+    def parts(self, entry):
+        # The delay before the response headers, and (delay before the part, bytes) for each
+        # part of the body, scaled by the replay speed
+        parts = []
+        previous = entry["latency"]
+        for part in entry["parts"]:
+            parts.append((max(0.0, part["at"] - previous) * self.speed, _decode(part)))
+            previous = part["at"]
+        return entry["latency"] * self.speed, parts
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+def get_cassette():
+    # The cassette selected by the environment, or None to send requests straight through
+    path = os.getenv("HTTP_CASSETTE")
+    if not path:
+        return None
+    key = (path, os.getenv("HTTP_CASSETTE_MODE", "replay"), replay_speed())
+    with _cassettes_lock:
+        if key not in _cassettes:
+            _cassettes[key] = Cassette(*key)
+        return _cassettes[key]
+
+## azure-core (requests)
+def requests_adapter(cassette, **kwargs):
+    # An HTTPAdapter for the session under azure-core's RequestsTransport / AsyncioRequestsTransport
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    from requests.structures import CaseInsensitiveDict
+
+    class CassetteAdapter(HTTPAdapter):
+        def send(self, request, stream=False, **send_kwargs):
+            if cassette.mode == "record":
+                start = time.perf_counter()
+                response = super().send(request, stream=stream, **send_kwargs)
+                latency = time.perf_counter() - start
+                # Reading it here is what requests does without stream=True anyway
+                content = response.content
+                cassette.record(request.method, request.url, request.headers, request.body, response.status_code,
+                                response.headers, latency, [(time.perf_counter() - start, content)])
+                return response
+
+            entry = cassette.play(request.method, request.url, request.body)
+            delay, parts = cassette.parts(entry)
+            delay += sum(part_delay for part_delay, _ in parts)
+            if delay:
+                time.sleep(delay)
+            content = b"".join(data for _, data in parts)
+            response = requests.Response()
+            response.status_code = entry["status"]
+            response.reason = HTTPStatus(entry["status"]).phrase
+            response.headers = CaseInsensitiveDict(entry["headers"])
+            response.raw = urllib3.HTTPResponse(body=io.BytesIO(content), headers=entry["headers"], status=entry["status"], preload_content=False)
+            response._content = content
+            response._content_consumed = True
+            response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+            response.url = request.url
+            response.request = request
+            response.connection = self
+            return response
+
+    return CassetteAdapter(**kwargs)
+
+## openai (httpx)
+def _transports():
+    import httpx
+
+    class RecordingStream(httpx.SyncByteStream):
+        # Passes the body through as it arrives and records it, with timings, once it is read
+        def __init__(self, stream, start, on_close):
+            self.stream = stream
+            self.start = start
+            self.on_close = on_close
+            self.parts = []
+
+        def __iter__(self):
+            for data in self.stream:
+                self.parts.append((time.perf_counter() - self.start, data))
+                yield data
+
+        def close(self):
+            self.stream.close()
+            self.on_close(self.parts)
+
+    class AsyncRecordingStream(httpx.AsyncByteStream):
+        def __init__(self, stream, start, on_close):
+            self.stream = stream
+            self.start = start
+            self.on_close = on_close
+            self.parts = []
+
+        async def __aiter__(self):
+            async for data in self.stream:
+                self.parts.append((time.perf_counter() - self.start, data))
+                yield data
+
+        async def aclose(self):
+            await self.stream.aclose()
+            self.on_close(self.parts)
+
+    class ReplayStream(httpx.SyncByteStream):
+        def __init__(self, parts):
+            self.parts = parts
+
+        def __iter__(self):
+            for delay, data in self.parts:
+                if delay:
+                    time.sleep(delay)
+                yield data
+
+    class AsyncReplayStream(httpx.AsyncByteStream):
+        def __init__(self, parts):
+            self.parts = parts
+
+        async def __aiter__(self):
+            for delay, data in self.parts:
+                if delay:
+                    await asyncio.sleep(delay)
+                yield data
+
+    class CassetteTransport(httpx.BaseTransport):
+        def __init__(self, transport, cassette):
+            self.transport = transport
+            self.cassette = cassette
+
+        def handle_request(self, request):
+            body = request.read()
+            if self.cassette.mode == "record":
+                start = time.perf_counter()
+                response = self.transport.handle_request(request)
+                latency = time.perf_counter() - start
+                # The raw bytes are recorded, so Content-Encoding stays with them
+                stream = RecordingStream(response.stream, start, lambda parts: self.cassette.record(
+                    request.method, request.url, request.headers, body, response.status_code, response.headers, latency, parts, decoded=False))
+                return httpx.Response(response.status_code, headers=response.headers, stream=stream, extensions=response.extensions)
+            entry = self.cassette.play(request.method, request.url, body)
+            delay, parts = self.cassette.parts(entry)
+            if delay:
+                time.sleep(delay)
+            return httpx.Response(entry["status"], headers=entry["headers"], stream=ReplayStream(parts))
+
+        def close(self):
+            self.transport.close()
+
+    class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+        def __init__(self, transport, cassette):
+            self.transport = transport
+            self.cassette = cassette
+
+        async def handle_async_request(self, request):
+            body = await request.aread()
+            if self.cassette.mode == "record":
+                start = time.perf_counter()
+                response = await self.transport.handle_async_request(request)
+                latency = time.perf_counter() - start
+                stream = AsyncRecordingStream(response.stream, start, lambda parts: self.cassette.record(
+                    request.method, request.url, request.headers, body, response.status_code, response.headers, latency, parts, decoded=False))
+                return httpx.Response(response.status_code, headers=response.headers, stream=stream, extensions=response.extensions)
+            entry = self.cassette.play(request.method, request.url, body)
+            delay, parts = self.cassette.parts(entry)
+            if delay:
+                await asyncio.sleep(delay)
+            return httpx.Response(entry["status"], headers=entry["headers"], stream=AsyncReplayStream(parts))
+
+        async def aclose(self):
+            await self.transport.aclose()
+
+    return CassetteTransport, AsyncCassetteTransport
+
+def httpx_transport(transport, cassette, aio=False):
+    CassetteTransport, AsyncCassetteTransport = _transports()
+    return AsyncCassetteTransport(transport, cassette) if aio else CassetteTransport(transport, cassette)
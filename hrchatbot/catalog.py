@@ -0,0 +1,171 @@
+## Document catalog and query router
+# A local list of the indexed documents (parent_id, title and chunk count), built by faceting
+# the index on parent_id and looking up one title per document. With DOCUMENT_ROUTING=on,
+# route() matches each question against the titles, and retrieve() pre-filters the search to
+# the documents the question names ("Which policy covers occupational safety and health?"),
+# so the vector and semantic work only runs over their chunks. Questions that name no
+# document search everything as before.
+# The catalog is rebuilt in the background once an indexer run has finished since it was
+# built (see provision_state.index_version()) or after CATALOG_MAX_AGE seconds.
+# ROUTER_MIN_COVERAGE is the share of a title's distinctive words a question has to mention
+# and ROUTER_MAX_DOCUMENTS how many documents one question may be routed to.
+# python -m hrchatbot.catalog  rebuilds the catalog and prints it
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from . import local_index, provision_state, telemetry
+
+def catalog_path():
+    return os.getenv("DOCUMENT_CATALOG_PATH", os.path.join(".hrchatbot", "catalog.json"))
+
+def routing_enabled():
+    return os.getenv("DOCUMENT_ROUTING", "off") == "on"
+
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def build_catalog(search_client, max_documents=100000, workers=8):
+    # One faceted query lists every parent_id with its chunk count; the titles come from
+    # one single-chunk lookup per document (title is not facetable)
+    pages = search_client.search(search_text="*", facets=[f"parent_id,count:{max_documents}"], top=0).by_page()
+    next(pages)
+    facets = (pages.get_facets() or {}).get("parent_id", [])
+
+    def title(parent_id):
+        results = search_client.search(search_text="*", filter=f"parent_id eq {_quote(parent_id)}", select=["title"], top=1)
+        return next((result["title"] for result in results), None)
+
+    parent_ids = [facet["value"] for facet in facets]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        titles = list(executor.map(title, parent_ids))
+    return [{"parent_id": parent_id, "title": title, "chunks": facet["count"]}
+            for parent_id, title, facet in zip(parent_ids, titles, facets) if title]
+
+def catalog_from_chunks(chunks):
+    # The same catalog for the local backend, from the chunks it already holds
+    documents = {}
+    for chunk in chunks:
+        if chunk.get("title"):
+            entry = documents.setdefault(chunk["parent_id"], {"parent_id": chunk["parent_id"], "title": chunk["title"], "chunks": 0})
+            entry["chunks"] += 1
+    return list(documents.values())
+
+def refresh_catalog(search_client=None, path=None):
+    path = path or catalog_path()
+    start = time.perf_counter()
+    if local_index.local_backend():
+        documents = catalog_from_chunks(local_index.get_local_index().chunks)
+    else:
+        from . import clients
+        documents = build_catalog(search_client or clients.get_search_client())
+    catalog = {"index_version": provision_state.index_version(), "refreshed_at": time.time(), "documents": documents}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=2)
+    os.replace(path + ".tmp", path)
+    telemetry.observe("hrchatbot_catalog_refresh_seconds", time.perf_counter() - start)
+    return catalog
+
+def _terms(text):
+    # Plural and singular forms count as the same word
+    return [token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+            for token in local_index.tokenize(text)]
+
+class DocumentRouter:
+    def __init__(self, documents, min_coverage=None, max_documents=None):
+        self.min_coverage = float(os.getenv("ROUTER_MIN_COVERAGE", 0.5)) if min_coverage is None else min_coverage
+        self.max_documents = int(os.getenv("ROUTER_MAX_DOCUMENTS", 3)) if max_documents is None else max_documents
+        self.documents = documents
+        titles = [set(_terms(os.path.splitext(document["title"])[0])) for document in documents]
+        # Words found in every title ("human", "resource", "policy") weigh nothing
+        frequencies = Counter(term for terms in titles for term in terms)
+        self.idf = {term: math.log(len(documents) / count) for term, count in frequencies.items()}
+        self.titles = []
+        for document, terms in zip(documents, titles):
+            # Policy numbers count when a question mentions them, but are not needed to match
+            weight = sum(self.idf[term] for term in terms if not term.isdigit())
+            if weight:
+                self.titles.append((document["parent_id"], terms, weight))
+
+    def route(self, question):
+        # parent_ids of the documents the question names, best match first; empty for none
+        terms = set(_terms(question))
+        matches = []
+        for parent_id, title_terms, weight in self.titles:
+            matched = sum(self.idf[term] for term in terms & title_terms)
+            if matched and matched / weight >= self.min_coverage:
+                matches.append((matched / weight, parent_id))
+        matches.sort(key=lambda match: -match[0])
+        return [parent_id for _, parent_id in matches[:self.max_documents]]
+
+_router = None
+_loaded = None
+_refreshing = False
+_router_lock = threading.Lock()
+
+def _stale(catalog):
+    return (catalog["index_version"] != provision_state.index_version()
+            or time.time() - catalog["refreshed_at"] > float(os.getenv("CATALOG_MAX_AGE", 600)))
+
+def _refresh_in_background():
+    global _refreshing
+
+    with _router_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+
+    def run():
+        global _refreshing
+        try:
+            refresh_catalog()
+        except Exception as error:
+            telemetry.increment("hrchatbot_catalog_refresh_errors_total", error=type(error).__name__)
+        finally:
+            _refreshing = False
+
+    threading.Thread(target=run, name="catalog-refresh", daemon=True).start()
+
+def get_router():
+    # The router for the catalog on disk, reloaded when the file changes; a missing or stale
+    # catalog is rebuilt in the background while questions use what is there
+    global _router, _loaded
+
+    path = catalog_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        _refresh_in_background()
+        return None
+    if _loaded != (path, mtime):
+        with open(path, encoding="utf-8") as f:
+            catalog = json.load(f)
+        with _router_lock:
+            _router = (DocumentRouter(catalog["documents"]), catalog)
+            _loaded = (path, mtime)
+    router, catalog = _router
+    if _stale(catalog):
+        _refresh_in_background()
+    return router
+
+def route(query):
+    # parent_ids to pre-filter the search to, or None to search every document
+    if not routing_enabled():
+        return None
+    router = get_router()
+    parent_ids = router.route(query) if router is not None else []
+    telemetry.increment("hrchatbot_routed_queries_total", routed="yes" if parent_ids else "no")
+    if parent_ids:
+        telemetry.annotate(routed_documents=len(parent_ids))
+    return parent_ids or None
+
+if __name__ == "__main__":
+    catalog = refresh_catalog()
+    for document in catalog["documents"]:
+        print(f"{document['parent_id']}\t{document['chunks']}\t{document['title']}")
+    print(f"{len(catalog['documents'])} documents written to {catalog_path()}")
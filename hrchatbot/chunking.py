@@ -0,0 +1,196 @@
+## Local chunking that follows the SplitSkill settings used by the skillsets
+# Lets chunking be previewed and tuned without a full indexer run. Documents are read as a
+# stream of lines (or PDF pages) and split into pages of at most MAXIMUM_PAGE_LENGTH
+# characters with PAGE_OVERLAP_LENGTH characters carried over, preferring to break at the
+# end of a sentence, then at whitespace. Markdown is split into sections first so every
+# chunk carries header_1 to header_3, like the markdown parsing mode of the indexer.
+# python -m hrchatbot.chunking [--mode plain|markdown|ocr] [--output chunks.jsonl]
+import argparse
+import base64
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Shared with the SplitSkill definitions in load_data_create_index()
+MAXIMUM_PAGE_LENGTH = 2000
+PAGE_OVERLAP_LENGTH = 500
+
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s")
+HEADER = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+
+class PageSplitter:
+    # Incremental splitter: feed() text pieces as they are read and get back finished pages
+    def __init__(self, maximum_page_length=MAXIMUM_PAGE_LENGTH, page_overlap_length=PAGE_OVERLAP_LENGTH):
+        if page_overlap_length >= maximum_page_length:
+            raise Exception("page_overlap_length must be smaller than maximum_page_length")
+        self.maximum_page_length = maximum_page_length
+        self.page_overlap_length = page_overlap_length
+        self._buffer = ""
+        self._emitted = False
+
+    def _break_point(self, text):
+        limit = self.maximum_page_length
+        window = text[:limit + 1]
+        # Prefer the last sentence end in the second half of the page, then the last whitespace
+        sentence_ends = [match.end() for match in SENTENCE_END.finditer(window) if match.end() <= limit]
+        if sentence_ends and sentence_ends[-1] > limit // 2:
+            return sentence_ends[-1]
+        space = window.rfind(" ", limit // 2, limit)
+        return space + 1 if space > 0 else limit
+
+    def _overlap_start(self, text, cut):
+        start = max(cut - self.page_overlap_length, 1)
+        # Start the overlap on a word boundary so the next page does not open mid-word
+        space = text.find(" ", start, cut)
+        return space + 1 if 0 <= space < cut - 1 else start
+
+    def feed(self, piece):
+        self._buffer += piece
+        while len(self._buffer) > self.maximum_page_length:
+            cut = self._break_point(self._buffer)
+            page = self._buffer[:cut].strip()
+            if page:
+                self._emitted = True
+                yield page
+            self._buffer = self._buffer[self._overlap_start(self._buffer, cut):]
+
+    def flush(self):
+        # The tail is only worth a page of its own if it holds more than the overlap already emitted
+        tail = self._buffer.strip()
+        if tail and (not self._emitted or len(self._buffer) > self.page_overlap_length):
+            yield tail
+        self._buffer = ""
+        self._emitted = False
+
+def split_pages(pieces, maximum_page_length=MAXIMUM_PAGE_LENGTH, page_overlap_length=PAGE_OVERLAP_LENGTH):
+    splitter = PageSplitter(maximum_page_length, page_overlap_length)
+    for piece in pieces:
+        yield from splitter.feed(piece)
+    yield from splitter.flush()
+
+def split_markdown(lines, header_depth=3, maximum_page_length=MAXIMUM_PAGE_LENGTH, page_overlap_length=PAGE_OVERLAP_LENGTH):
+    # Yields (headers, page) where headers maps header_1..header_{depth} to the enclosing titles
+    headers = {}
+    splitter = PageSplitter(maximum_page_length, page_overlap_length)
+    for line in lines:
+        match = HEADER.match(line)
+        if match and len(match.group(1)) <= header_depth:
+            for page in splitter.flush():
+                yield dict(headers), page
+            level = len(match.group(1))
+            headers = {key: value for key, value in headers.items() if int(key.rsplit("_", 1)[1]) < level}
+            headers[f"header_{level}"] = match.group(2)
+            continue
+        for page in splitter.feed(line):
+            yield dict(headers), page
+    for page in splitter.flush():
+        yield dict(headers), page
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield line
+
+def read_pdf_pages(path):
+    # One page at a time; pypdf is only needed when PDFs are chunked locally
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield (page.extract_text() or "") + "\n"
+
+def document_key(title):
+    # Search keys only allow letters, digits, dashes, underscores and equal signs
+    return base64.urlsafe_b64encode(title.encode("utf-8")).decode("ascii").rstrip("=")
+
+def chunk_document(path, mode="plain", maximum_page_length=MAXIMUM_PAGE_LENGTH, page_overlap_length=PAGE_OVERLAP_LENGTH, header_depth=3):
+    # mode mirrors the skillset variant: plain (default skillset), markdown (USE_MARKDOWN or
+    # USE_LAYOUT, header tracking) or ocr (USE_OCR, split per page and keep page_number)
+    title = os.path.basename(path)
+    parent_id = document_key(title)
+    is_pdf = path.lower().endswith(".pdf")
+    pieces = read_pdf_pages(path) if is_pdf else read_lines(path)
+
+    if mode == "ocr":
+        number = 0
+        for page_number, page_text in enumerate(pieces if is_pdf else ["".join(pieces)], start=1):
+            for page in split_pages([page_text], maximum_page_length, page_overlap_length):
+                yield {"parent_id": parent_id, "chunk_id": f"{parent_id}_pages_{number}", "title": title, "chunk": page, "page_number": str(page_number)}
+                number += 1
+    elif mode == "markdown":
+        lines = (line + "\n" for piece in pieces for line in piece.split("\n")) if is_pdf else pieces
+        for number, (headers, page) in enumerate(split_markdown(lines, header_depth, maximum_page_length, page_overlap_length)):
+            yield {"parent_id": parent_id, "chunk_id": f"{parent_id}_pages_{number}", "title": title, "chunk": page,
+                   **{f"header_{level}": headers.get(f"header_{level}") for level in range(1, 4)}}
+    else:
+        for number, page in enumerate(split_pages(pieces, maximum_page_length, page_overlap_length)):
+            yield {"parent_id": parent_id, "chunk_id": f"{parent_id}_pages_{number}", "title": title, "chunk": page}
+
+def _chunk_file(job):
+    path, mode, maximum_page_length, page_overlap_length, output = job
+    count = 0
+    characters = 0
+    # Each worker writes its own part file so chunks never travel back through the pool
+    with open(output, "w", encoding="utf-8") if output else open(os.devnull, "w") as f:
+        for chunk in chunk_document(path, mode, maximum_page_length, page_overlap_length):
+            f.write(json.dumps(chunk) + "\n")
+            count += 1
+            characters += len(chunk["chunk"])
+    return path, count, characters
+
+def chunk_directory(directory, mode="plain", output=None, workers=None, maximum_page_length=MAXIMUM_PAGE_LENGTH, page_overlap_length=PAGE_OVERLAP_LENGTH):
+    start = time.perf_counter()
+    files = sorted(path for path in glob.glob(os.path.join(directory, '*')) if os.path.isfile(path))
+    parts = [f"{output}.part{i}" if output else None for i in range(len(files))]
+    jobs = [(path, mode, maximum_page_length, page_overlap_length, part) for path, part in zip(files, parts)]
+
+    chunks = 0
+    characters = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, count, size in executor.map(_chunk_file, jobs):
+            chunks += count
+            characters += size
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            for part in parts:
+                with open(part, "r", encoding="utf-8") as part_file:
+                    for line in part_file:
+                        f.write(line)
+                os.remove(part)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(files),
+        "chunks": chunks,
+        "characters": characters,
+        "average_chunk_length": characters / chunks if chunks else 0,
+        "seconds": round(elapsed, 3),
+        "files_per_second": len(files) / elapsed if elapsed else 0,
+    }
+
+def default_mode():
+    # Same switches as load_data_create_index()
+    if os.getenv("USE_OCR", "false") == "true":
+        return "ocr"
+    if any(os.getenv(name, "false") == "true" for name in ("USE_LAYOUT", "USE_MARKDOWN", "PRECONVERT_PDF")):
+        return "markdown"
+    return "plain"
+
+if __name__ == "__main__":
+    from .blob_sync import documents_directory
+
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.chunking")
+    parser.add_argument("--directory", default=documents_directory())
+    parser.add_argument("--mode", choices=["plain", "markdown", "ocr"], default=None)
+    parser.add_argument("--output", help="write chunks to this JSONL file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--maximum-page-length", type=int, default=MAXIMUM_PAGE_LENGTH)
+    parser.add_argument("--page-overlap-length", type=int, default=PAGE_OVERLAP_LENGTH)
+    args = parser.parse_args()
+
+    stats = chunk_directory(args.directory, args.mode or default_mode(), args.output, args.workers, args.maximum_page_length, args.page_overlap_length)
+    print(json.dumps(stats, indent=2))
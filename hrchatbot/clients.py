@@ -0,0 +1,183 @@
+## Long-lived Azure AI Search and Azure OpenAI clients
+# Every question used to build a new SearchClient, paying a fresh TCP/TLS handshake
+# before the search even started. The clients below are created once per process
+# (or once per event loop for the aio variants) and keep their connections alive.
+import os
+import threading
+import weakref
+from dotenv import load_dotenv
+
+_lock = threading.Lock()
+_search_client = None
+_openai_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+def settings():
+    load_dotenv()
+    return {
+        "endpoint": os.getenv("AZURE_COGNITIVE_SEARCH_ENDPOINT"),
+        "search_key": os.getenv("AZURE_COGNITIVE_SEARCH_KEY"),
+        "index_name": os.getenv("AZURE_SEARCH_INDEX_NAME", "int-vec"),
+        "azure_endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "api_key": os.getenv("AZURE_OPENAI_KEY"),
+        "api_version": os.getenv("AZURE_OPENAI_API_VERSION"),
+        # Size of the keep-alive pools and how long an idle connection is kept open
+        "pool_size": int(os.getenv("HTTP_POOL_SIZE", 32)),
+        "keepalive_seconds": float(os.getenv("HTTP_KEEPALIVE_SECONDS", 120)),
+    }
+
+def search_credential(s, aio=False):
+    from azure.core.credentials import AzureKeyCredential
+    if s["search_key"]:
+        return AzureKeyCredential(s["search_key"])
+    if aio:
+        from azure.identity.aio import DefaultAzureCredential
+    else:
+        from azure.identity import DefaultAzureCredential
+    return DefaultAzureCredential()
+
+def search_transport(s, aio=False):
+    # One requests session with a pool large enough for concurrent questions;
+    # azure-core would otherwise mount a default adapter that keeps only 10 sockets
+    # With HTTP_CASSETTE set the session records or replays its traffic (see cassette.py)
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    from azure.core.pipeline.transport import AsyncioRequestsTransport, RequestsTransport
+    from .cassette import get_cassette, requests_adapter
+
+    session = requests.Session()
+    options = dict(pool_connections=4, pool_maxsize=s["pool_size"], max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+    cassette = get_cassette()
+    adapter = requests_adapter(cassette, **options) if cassette else HTTPAdapter(**options)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if aio:
+        return AsyncioRequestsTransport(session=session, session_owner=False)
+    return RequestsTransport(session=session, session_owner=False)
+
+def async_search_transport(s):
+    # aiohttp session for the aio SearchClient with a sized keep-alive pool; azure-core's
+    # default aio transport has no pool size and opened a socket for most questions.
+    # Call it from the event loop the client will be used on
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+    from .cassette import get_cassette
+
+    # Cassettes hook into a requests session, so they need the asyncio requests transport
+    if get_cassette():
+        return search_transport(s, aio=True)
+    connector = aiohttp.TCPConnector(limit=s["pool_size"], keepalive_timeout=s["keepalive_seconds"])
+    return AioHttpTransport(session=aiohttp.ClientSession(connector=connector), session_owner=True)
+
+def transport_options(s):
+    # transport= for the other azure-core clients (Blob Storage, index management), which
+    # keep their default transports unless a cassette is recording or replaying
+    from .cassette import get_cassette
+
+    return {"transport": search_transport(s)} if get_cassette() else {}
+
+def openai_http_client(s, aio=False):
+    # Requests go through the quota scheduler (see scheduler.py) on their way to the pool
+    import httpx
+    from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
+    from .cassette import get_cassette, httpx_transport
+    from .scheduler import scheduled_transport
+
+    # httpcore closes any connection beyond max_keepalive_connections once it is idle, so a
+    # smaller keep-alive limit would open a new socket for most requests under load
+    connections = s["pool_size"] * 4
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections, keepalive_expiry=s["keepalive_seconds"])
+    transport = httpx.AsyncHTTPTransport(limits=limits) if aio else httpx.HTTPTransport(limits=limits)
+    cassette = get_cassette()
+    if cassette:
+        transport = httpx_transport(transport, cassette, aio=aio)
+    # The limits belong to the innermost transport; httpx ignores limits= once transport= is given
+    if aio:
+        return DefaultAsyncHttpxClient(transport=scheduled_transport(transport, aio=True))
+    return DefaultHttpxClient(transport=scheduled_transport(transport))
+
+def openai_max_retries():
+    # The scheduler's transport retries 429s itself; SDK retries on top of it would run its
+    # whole retry loop again for every SDK attempt
+    from . import scheduler
+
+    return 0 if scheduler.enabled() else 2
+
+def get_search_client():
+    global _search_client
+
+    if _search_client is None:
+        with _lock:
+            if _search_client is None:
+                from azure.search.documents import SearchClient
+                s = settings()
+                if not s["endpoint"]:
+                    raise KeyError("AZURE_COGNITIVE_SEARCH_ENDPOINT")
+                _search_client = SearchClient(s["endpoint"], s["index_name"], search_credential(s), transport=search_transport(s))
+    return _search_client
+
+def get_openai_client():
+    global _openai_client
+
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                from openai import AzureOpenAI
+                s = settings()
+                _openai_client = AzureOpenAI(
+                    azure_endpoint = s["azure_endpoint"],
+                    api_key = s["api_key"],
+                    api_version = s["api_version"],
+                    max_retries = openai_max_retries(),
+                    http_client = openai_http_client(s)
+                )
+    return _openai_client
+
+def _loop_clients():
+    # aio clients are bound to the loop that first used them, so keep one set per loop
+    import asyncio
+
+    return _async_clients.setdefault(asyncio.get_running_loop(), {})
+
+def get_async_search_client():
+    loop_clients = _loop_clients()
+    if "search" not in loop_clients:
+        from azure.search.documents.aio import SearchClient
+        s = settings()
+        if not s["endpoint"]:
+            raise KeyError("AZURE_COGNITIVE_SEARCH_ENDPOINT")
+        loop_clients["search"] = SearchClient(s["endpoint"], s["index_name"], search_credential(s, aio=True), transport=async_search_transport(s))
+    return loop_clients["search"]
+
+def get_async_openai_client():
+    loop_clients = _loop_clients()
+    if "openai" not in loop_clients:
+        from openai import AsyncAzureOpenAI
+        s = settings()
+        loop_clients["openai"] = AsyncAzureOpenAI(
+            azure_endpoint = s["azure_endpoint"],
+            api_key = s["api_key"],
+            api_version = s["api_version"],
+            max_retries = openai_max_retries(),
+            http_client = openai_http_client(s, aio=True)
+        )
+    return loop_clients["openai"]
+
+def close():
+    global _search_client, _openai_client
+
+    with _lock:
+        if _search_client is not None:
+            _search_client.close()
+        if _openai_client is not None:
+            _openai_client.close()
+        _search_client = None
+        _openai_client = None
+
+async def aclose():
+    import asyncio
+
+    loop_clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.close()
@@ -0,0 +1,91 @@
+## Token-budgeted context for the prompt
+# Search results used to go into the prompt as the repr of a list of dicts, so quotes,
+# braces, ids and scores were all paid for as prompt tokens. pack_context() orders the
+# chunks by reranker score, drops the text a chunk shares with the previous page of the
+# same document (the SplitSkill overlap), and fills CONTEXT_TOKEN_BUDGET tokens with
+# plain text separated by blank lines. The chunks that made it in are written in document
+# order (parent_id, then page), not score order, so the same results always give the same
+# text and an earlier prompt's prefix can be served from the prompt cache.
+# SEARCH_TOP_K sets how many chunks are retrieved.
+import os
+import re
+
+from .chunking import PAGE_OVERLAP_LENGTH
+from .tokens import count_tokens, truncate_tokens
+
+PAGE_NUMBER = re.compile(r"_pages_(\d+)$")
+SEPARATOR = "\n\n"
+# Overlaps shorter than this are treated as coincidence, not as a shared page boundary
+MIN_OVERLAP_LENGTH = 20
+# A chunk cut down to fewer tokens than this is left out rather than added as a fragment
+MIN_PARTIAL_TOKENS = 64
+
+def top_k():
+    return int(os.getenv("SEARCH_TOP_K", 3))
+
+def token_budget():
+    return int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+
+def page_position(chunk_id):
+    # chunk ids end in _pages_<n>, both from the index projections and from chunking.py
+    match = PAGE_NUMBER.search(chunk_id or "")
+    return int(match.group(1)) if match else None
+
+def overlap_length(previous, text, maximum=PAGE_OVERLAP_LENGTH):
+    # Length of the longest suffix of previous that text starts with
+    tail = previous[-(maximum + 1):]
+    for i in range(len(tail) - MIN_OVERLAP_LENGTH + 1):
+        if text.startswith(tail[i:]):
+            return len(tail) - i
+    return 0
+
+def document_order(item):
+    # Pages of a document in page order (doc_pages_10 after doc_pages_9), then by chunk_id
+    position = page_position(item["chunk_id"])
+    return (item.get("parent_id") or "", position if position is not None else -1, item["chunk_id"] or "")
+
+def remove_overlap(item, packed):
+    # Drops the text item shares with neighbouring pages of the same document that are already packed
+    content = item["content"]
+    position = page_position(item["chunk_id"])
+    if position is None:
+        return content
+    previous = packed.get((item["parent_id"], position - 1))
+    if previous:
+        content = content[overlap_length(previous, content):].lstrip()
+    following = packed.get((item["parent_id"], position + 1))
+    if following and content:
+        content = content[:len(content) - overlap_length(content, following)].rstrip()
+    return content
+
+def pack_context(context, budget=None, model=None):
+    # Returns the context text and the number of tokens it uses
+    budget = token_budget() if budget is None else budget
+    ordered = sorted(context, key=lambda item: item.get("reranker_score") or 0.0, reverse=True)
+
+    parts = []
+    packed = {}
+    used = 0
+    separator_tokens = count_tokens(SEPARATOR, model)
+    for item in ordered:
+        content = remove_overlap(item, packed)
+        if not content:
+            continue
+        remaining = budget - used - (separator_tokens if parts else 0)
+        tokens = count_tokens(content, model)
+        if tokens > remaining:
+            # The first chunk that does not fit is cut to the space left, then packing stops
+            if remaining >= MIN_PARTIAL_TOKENS or not parts:
+                content = truncate_tokens(content, max(remaining, 0), model)
+                if content:
+                    used += count_tokens(content, model) + (separator_tokens if parts else 0)
+                    parts.append((document_order(item), content))
+            break
+        used += tokens + (separator_tokens if parts else 0)
+        parts.append((document_order(item), content))
+        # Overlaps are matched against the full page text
+        position = page_position(item["chunk_id"])
+        if position is not None:
+            packed[(item["parent_id"], position)] = item["content"]
+    parts.sort(key=lambda part: part[0])
+    return SEPARATOR.join(content for _, content in parts), used
@@ -0,0 +1,142 @@
+## Multi-turn conversation memory
+# The REPL keeps one Conversation across turns. The last CONVERSATION_RECENT_TURNS turns
+# are sent verbatim (as long as they fit in CONVERSATION_HISTORY_TOKENS); older turns are
+# folded into a rolling summary capped at CONVERSATION_SUMMARY_TOKENS, so the prompt stops
+# growing after a few turns. Follow-up questions are rewritten into standalone search
+# queries first, so "and for part-time staff?" still finds the right policy.
+# Folding takes a chat completion, so it runs on a background worker while the user reads
+# the answer and types the next question. history_text(), history_messages(), add_turn()
+# and clear() wait for it; has_history() does not need to.
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import telemetry
+from .tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+rewrite_template = '''
+    Rewrite the follow-up question as a standalone search query for an HR policy search index.
+    Resolve pronouns and references using the conversation. Reply with the query only.
+
+    Conversation:
+    {history}
+
+    Follow-up question:
+    {question}
+    '''
+
+summary_template = '''
+    Update the summary of an HR chatbot conversation with the new exchange.
+    Keep facts, policy names and open questions. Stay under {tokens} tokens. Reply with the summary only.
+
+    Summary so far:
+    {summary}
+
+    New exchange:
+    {turn}
+    '''
+
+class Conversation:
+    def __init__(self, client=None, recent_turns=None, history_tokens=None, summary_tokens=None):
+        self._client = client
+        self.recent_turns = int(os.getenv("CONVERSATION_RECENT_TURNS", 3)) if recent_turns is None else recent_turns
+        self.history_tokens = int(os.getenv("CONVERSATION_HISTORY_TOKENS", 1000)) if history_tokens is None else history_tokens
+        self.summary_tokens = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", 300)) if summary_tokens is None else summary_tokens
+        self.turns = []
+        self.summary = ""
+        self._folding = None
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from . import clients
+            self._client = clients.get_openai_client()
+        return self._client
+
+    def has_history(self):
+        # Turns being folded are history already, so this never waits for the fold
+        with self._lock:
+            return bool(self.turns or self.summary or self._folding is not None)
+
+    def wait(self):
+        # Blocks until the turns handed to the background worker are in the summary
+        with self._lock:
+            folding = self._folding
+        if folding is not None:
+            folding.result()
+
+    def _complete(self, prompt, max_tokens, operation):
+        response = self.client.chat.completions.create(
+          model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
+          messages=[{"role": "user", "content": prompt}],
+          max_tokens=max_tokens,
+          temperature=0,
+        )
+        telemetry.record_usage(response.usage, operation=operation)
+        return (response.choices[0].message.content or "").strip()
+
+    def history_text(self):
+        self.wait()
+        lines = [f"Summary: {self.summary}"] if self.summary else []
+        for question, answer in self.turns:
+            lines += [f"User: {question}", f"Assistant: {answer}"]
+        return "\n".join(lines)
+
+    def standalone_query(self, question):
+        # The first question is already standalone
+        if not self.has_history():
+            return question
+        return self._complete(rewrite_template.format(history=self.history_text(), question=question), 64, "rewrite") or question
+
+    def history_messages(self):
+        # Goes between the system prompt and the context, so the prompt prefix grows turn by turn
+        self.wait()
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        for question, answer in self.turns:
+            messages += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        return messages
+
+    def _turn_tokens(self):
+        return sum(count_tokens(question) + count_tokens(answer) for question, answer in self.turns)
+
+    def add_turn(self, question, answer):
+        self.wait()
+        self.turns.append((question, answer))
+        folded = []
+        while self.turns and (len(self.turns) > self.recent_turns or self._turn_tokens() > self.history_tokens):
+            folded.append(self.turns.pop(0))
+        if folded:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation")
+                self._folding = self._executor.submit(self._fold_turns, folded)
+
+    def _fold_turns(self, turns):
+        for question, answer in turns:
+            try:
+                self._fold(question, answer)
+            except Exception as error:
+                # The turn drops out of the history rather than failing the next question
+                logger.warning("Could not fold a turn into the conversation summary: %s", error)
+                telemetry.increment("hrchatbot_summary_errors_total", error=type(error).__name__)
+
+    def _fold(self, question, answer):
+        turn = f"User: {question}\nAssistant: {answer}"
+        summary = self._complete(summary_template.format(tokens=self.summary_tokens, summary=self.summary or "(none)", turn=turn),
+                                 self.summary_tokens, "summary")
+        # max_tokens already bounds the reply; this also bounds the fallback token estimate
+        self.summary = truncate_tokens(summary, self.summary_tokens)
+
+    def clear(self):
+        self.wait()
+        self.turns = []
+        self.summary = ""
+        with self._lock:
+            self._folding = None
@@ -0,0 +1,127 @@
+## Client-side embeddings with a persistent cache
+# Embeds text with the same EMBEDDING_MODEL_NAME and AZURE_OPENAI_EMBEDDING_DIMENSIONS the
+# index vectorizer uses, so a question can be sent as a VectorizedQuery instead of asking
+# the search service to call Azure OpenAI for it. Vectors are cached in a memory LRU in
+# front of a SQLite store, keyed by text hash, model and dimensions.
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+from . import telemetry
+from .answer_cache import MemoryCache
+
+def model_settings():
+    return os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-3-large"), int(os.getenv("AZURE_OPENAI_EMBEDDING_DIMENSIONS", 1536))
+
+def cache_key(text, model, dimensions):
+    return f"{hashlib.sha256(text.encode('utf-8')).hexdigest()}:{model}:{dimensions}"
+
+class EmbeddingStore:
+    # float32 vectors stored as raw bytes, keyed by cache_key()
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._connection.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def set_many(self, items):
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                         [(key, array("f", vector).tobytes()) for key, vector in items])
+            self._connection.commit()
+
+class EmbeddingCache:
+    def __init__(self, store=None, maxsize=4096):
+        self.memory = MemoryCache(maxsize=maxsize, ttl=float("inf"))
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[key] = vector
+        missing = [key for key in keys if key not in found]
+        if missing and self.store is not None:
+            for key, vector in self.store.get_many(missing).items():
+                self.memory.set(key, vector)
+                found[key] = vector
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        telemetry.increment("hrchatbot_embedding_cache_hits_total", len(found))
+        telemetry.increment("hrchatbot_embedding_cache_misses_total", len(keys) - len(found))
+        return found
+
+    def set_many(self, items):
+        items = list(items)
+        for key, vector in items:
+            self.memory.set(key, vector)
+        if self.store is not None:
+            self.store.set_many(items)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".hrchatbot", "embeddings.sqlite3"))
+                _cache = EmbeddingCache(EmbeddingStore(path) if path else None, maxsize=int(os.getenv("EMBEDDING_CACHE_SIZE", 4096)))
+    return _cache
+
+def client_side_embedding():
+    # set CLIENT_SIDE_EMBEDDING to embed questions here instead of through the index vectorizer
+    return os.getenv("CLIENT_SIDE_EMBEDDING", "false") == "true"
+
+def embed_query(text):
+    from . import clients
+
+    model, dimensions = model_settings()
+    cache = get_embedding_cache()
+    key = cache_key(text, model, dimensions)
+    cached = cache.get_many([key])
+    if key in cached:
+        return cached[key]
+
+    response = clients.get_openai_client().embeddings.create(model=model, input=[text], dimensions=dimensions)
+    telemetry.record_usage(response.usage, operation="embeddings")
+    vector = response.data[0].embedding
+    cache.set_many([(key, vector)])
+    return vector
+
+async def aembed_query(text):
+    from . import clients
+
+    model, dimensions = model_settings()
+    cache = get_embedding_cache()
+    key = cache_key(text, model, dimensions)
+    cached = cache.get_many([key])
+    if key in cached:
+        return cached[key]
+
+    response = await clients.get_async_openai_client().embeddings.create(model=model, input=[text], dimensions=dimensions)
+    telemetry.record_usage(response.usage, operation="embeddings")
+    vector = response.data[0].embedding
+    cache.set_many([(key, vector)])
+    return vector
@@ -0,0 +1,491 @@
+## Local stand-ins for Azure AI Search and Azure OpenAI
+# A small threaded HTTP/1.1 server that answers the handful of REST calls the chatbot makes
+# (hybrid search, chat completions, embeddings). It keeps connections alive like the real
+# services and counts them, so benchmarks can run offline and show connection reuse.
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_CHUNKS = [
+    ("Human Resource Policy 01 - Employee Health.pdf", "An organization will make every reasonable effort to accommodate an employee who has health problems, including modified duties and gradual return to work."),
+    ("Human Resource Policy 09 - Occupational Safety and Health.pdf", "Ministries are responsible for providing a safe and healthy workplace and for the occupational safety and health program."),
+    ("Human Resource Policy 12 - Political Staff.pdf", "Political staff provide advice to ministers and are not public service employees under the Public Service Act."),
+    ("Human Resource Policy 04 - Sick Leave.pdf", "Employees who are ill may take sick leave in accordance with their collective agreement or terms and conditions of employment."),
+]
+
+def sample_documents():
+    documents = []
+    for i, (title, chunk) in enumerate(SAMPLE_CHUNKS):
+        parent_id = f"doc{i}"
+        documents.append({"parent_id": parent_id, "chunk_id": f"{parent_id}_pages_0", "title": title, "chunk": chunk})
+    return documents
+
+def lognormal(median, sigma=0.5, spike_probability=0.0, spike=0.0, seed=None):
+    # Latency distribution for the fakes: log-normal around a median, with optional rare spikes
+    import random
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def sample():
+        with lock:
+            seconds = rng.lognormvariate(0.0, sigma) * median
+            if spike_probability and rng.random() < spike_probability:
+                seconds += spike
+        return seconds
+    return sample
+
+def _delay(latency):
+    seconds = latency() if callable(latency) else latency
+    if seconds:
+        time.sleep(seconds)
+
+def _index_name(path):
+    match = re.search(r"/indexes\('([^']*)'\)", path)
+    return match.group(1) if match else None
+
+def _matches(document, expression):
+    # The handful of OData filters the chatbot sends: comparisons and search.in() joined by "and" / "or"
+    match = re.fullmatch(r"\s*search\.in\((\w+), '(.*)', '(.)'\)\s*", expression)
+    if match:
+        field, values, separator = match.groups()
+        return document.get(field) in values.replace("''", "'").split(separator)
+    if " or " in expression:
+        return any(_matches(document, part) for part in expression.split(" or "))
+    if " and " in expression:
+        return all(_matches(document, part) for part in expression.split(" and "))
+    field, operator, value = re.fullmatch(r"\(?\s*(\w+) (eq|ne|gt|ge|lt|le) '(.*)'\s*\)?", expression.strip()).groups()
+    value = value.replace("''", "'")
+    actual = document.get(field)
+    if operator in ("eq", "ne"):
+        return (actual == value) == (operator == "eq")
+    if actual is None:
+        return False
+    return {"gt": actual > value, "ge": actual >= value, "lt": actual < value, "le": actual <= value}[operator]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.server.lock:
+            self.server.requests += 1
+        return self.path.split("?")[0], json.loads(body) if body else {}
+
+    def do_GET(self):
+        path, _ = self._read()
+        # The cheap requests the REPL warms its connections with
+        if path.endswith("/docs/$count"):
+            return self._send_json(len(self.server.documents_for(_index_name(path))))
+        if path.endswith("/openai/models"):
+            return self._send_json({"object": "list", "data": []})
+        definition = self.server.index_definition(_index_name(path)) if path.endswith("')") else None
+        if definition is None:
+            self._send_json({"error": {"code": "ResourceNotFound", "message": path}}, status=404)
+        else:
+            self._send_json(definition)
+
+    def do_PUT(self):
+        path, request = self._read()
+        self._send_json(self.server.create_index(_index_name(path), request), status=201)
+
+    def do_POST(self):
+        path, request = self._read()
+        index_name = _index_name(path)
+
+        retry_after = self.server.throttle(path, request)
+        if retry_after is not None:
+            self._send_json({"error": {"code": "429", "message": "Rate limit is exceeded."}}, status=429,
+                            headers={"Retry-After": str(max(1, int(retry_after + 0.999))), "retry-after-ms": str(int(retry_after * 1000))})
+        elif path.endswith("/indexes"):
+            if request["name"] in self.server.indexes:
+                self._send_json({"error": {"code": "ResourceNameAlreadyInUse", "message": request["name"]}}, status=409)
+            else:
+                self._send_json(self.server.create_index(request["name"], request), status=201)
+        elif path.endswith("/docs/search.index"):
+            _delay(self.server.index_latency)
+            self._send_json(self.server.index_response(request, index_name))
+        elif path.endswith("/docs/search.post.search"):
+            _delay(self.server.search_latency)
+            if request.get("queryType") == "semantic":
+                _delay(self.server.semantic_latency)
+            self._send_json(self.server.search_response(request, index_name))
+        elif path.endswith("/chat/completions") and request.get("stream"):
+            cached = self.server.cached_tokens(request)
+            _delay(self.server.chat_latency)
+            _delay(self.server.prompt_latency(request, cached))
+            self._send_events(self.server.chat_stream(request, cached))
+        elif path.endswith("/chat/completions"):
+            cached = self.server.cached_tokens(request)
+            _delay(self.server.chat_latency)
+            _delay(self.server.prompt_latency(request, cached))
+            self._send_json(self.server.chat_response(request, cached))
+        elif path.endswith("/embeddings"):
+            _delay(self.server.embedding_latency)
+            self._send_json(self.server.embedding_response(request))
+        else:
+            self._send_json({"error": {"code": "NotFound", "message": path}}, status=404)
+
+    def _send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events):
+        # Server-sent events over chunked transfer encoding, so the connection stays reusable
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events:
+            data = f"data: {json.dumps(event) if isinstance(event, dict) else event}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+class FakeAzureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, documents=None, answer="According to the HR policy, please contact your supervisor.", dimensions=1536,
+                 search_latency=0.0, chat_latency=0.0, embedding_latency=0.0, token_latency=0.0, embedding_throttle_ratio=0.0, port=0,
+                 prompt_token_latency=0.0, semantic_latency=0.0, quotas=None, index_latency=0.0,
+                 search_chunk_latency=0.0, answer_score=0.9, prompt_cache=False, shuffle_results=False,
+                 sample_results=False):
+        super().__init__(("127.0.0.1", port), _Handler)
+        # Indexes created through the API get their own documents; any other index name
+        # reads and writes these
+        self.documents = documents if documents is not None else sample_documents()
+        self.indexes = {}
+        self.index_documents = {}
+        self.answer = answer
+        self.dimensions = dimensions
+        # Each latency is either a number of seconds or a callable returning one
+        self.search_latency = search_latency
+        self.index_latency = index_latency
+        # Extra search latency per chunk left after the filter, standing in for the vector and semantic work
+        self.search_chunk_latency = search_chunk_latency
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        # Delay between streamed tokens; chat_latency is then the time to the first token
+        self.token_latency = token_latency
+        # Extra chat latency per prompt token, standing in for prompt processing time
+        self.prompt_token_latency = prompt_token_latency
+        # Extra search latency for semantic queries, standing in for the semantic ranker
+        self.semantic_latency = semantic_latency
+        # Score of the semantic answer taken from the top result: a number or a callable given
+        # the search request, returning None for no answer
+        self.answer_score = answer_score
+        # Serve prompt prefixes sent before from a cache like the service does: 1024 tokens and
+        # up in 128-token steps; cached tokens skip prompt_token_latency
+        self.prompt_cache = prompt_cache
+        self._prefixes = set()
+        # Order each question's results differently, like a ranker seeing paraphrased questions
+        self.shuffle_results = shuffle_results
+        # Return a different sample of the documents for each question, so distinct questions
+        # retrieve distinct chunks
+        self.sample_results = sample_results
+        # Share of embeddings requests answered with a 429 and a short Retry-After
+        self.embedding_throttle_ratio = embedding_throttle_ratio
+        self.throttled = 0
+        # Per-minute quotas like a deployment's, e.g. {"chat": {"tpm": 60000, "rpm": 360}}; the
+        # service checks them over short windows, so bursts above a tenth of a minute get a 429
+        self.quotas = {kind: {"tpm": 0, "rpm": 0, **quota} for kind, quota in (quotas or {}).items()}
+        self._quota_levels = {kind: [quota["tpm"] / 6, quota["rpm"] / 6, time.monotonic()] for kind, quota in self.quotas.items()}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients that give up on a request (hedged or cancelled searches) just drop the connection
+        import sys
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def index_client(self):
+        # SearchIndexClient refuses plain-http endpoints, so it is given an https URL and a
+        # transport that sends its requests to this server over http
+        from azure.core.credentials import AzureKeyCredential
+        from azure.core.pipeline.transport import RequestsTransport
+        from azure.search.documents.indexes import SearchIndexClient
+
+        class PlainHttpTransport(RequestsTransport):
+            def send(self, request, **kwargs):
+                request.url = "http://" + request.url[len("https://"):]
+                return super().send(request, **kwargs)
+
+        return SearchIndexClient(f"https://127.0.0.1:{self.server_address[1]}", AzureKeyCredential("fake-key"), transport=PlainHttpTransport())
+
+    def environ(self, index_name="int-vec"):
+        # Environment variables that point the chatbot's clients at this server
+        return {
+            "AZURE_COGNITIVE_SEARCH_ENDPOINT": self.url,
+            "AZURE_COGNITIVE_SEARCH_KEY": "fake-key",
+            "AZURE_SEARCH_INDEX_NAME": index_name,
+            "AZURE_OPENAI_ENDPOINT": self.url,
+            "AZURE_OPENAI_KEY": "fake-key",
+            "AZURE_OPENAI_API_VERSION": "2024-10-21",
+            "CHAT_COMPLETION_NAME": "gpt-4.1",
+        }
+
+    def throttle(self, path, request):
+        # Returns the Retry-After in seconds when the request should be rejected with a 429
+        import random
+        if path.endswith("/embeddings") and random.random() < self.embedding_throttle_ratio:
+            with self.lock:
+                self.throttled += 1
+            return 0.05
+        kind = "chat" if path.endswith("/chat/completions") else "embeddings" if path.endswith("/embeddings") else None
+        if kind not in self.quotas:
+            return None
+        quota = self.quotas[kind]
+        # Azure charges the prompt plus max_tokens when the request comes in
+        if kind == "chat":
+            cost = self.prompt_tokens(request) + (request.get("max_tokens") or request.get("max_completion_tokens") or len(self.answer) // 4)
+        else:
+            inputs = request.get("input")
+            cost = sum(len(text) // 4 for text in ([inputs] if isinstance(inputs, str) else inputs or []))
+        with self.lock:
+            levels = self._quota_levels[kind]
+            now = time.monotonic()
+            for i, key in enumerate(("tpm", "rpm")):
+                if quota[key]:
+                    levels[i] = min(quota[key] / 6, levels[i] + (now - levels[2]) * quota[key] / 60)
+            levels[2] = now
+            waits = [(min(needed, quota[key] / 6) - levels[i]) * 60 / quota[key]
+                     for i, (key, needed) in enumerate((("tpm", cost), ("rpm", 1))) if quota[key]]
+            if any(wait > 0 for wait in waits):
+                self.throttled += 1
+                return max(waits)
+            levels[0] -= cost if quota["tpm"] else 0
+            levels[1] -= 1 if quota["rpm"] else 0
+        return None
+
+    def documents_for(self, index_name):
+        return self.index_documents.get(index_name, self.documents)
+
+    def index_definition(self, index_name):
+        if index_name in self.indexes:
+            return self.indexes[index_name]
+        # A minimal definition of the shared documents, as the indexer would have created it
+        sample = self.documents[0] if self.documents else {"chunk_id": "", "chunk": ""}
+        fields = []
+        for name, value in sample.items():
+            if isinstance(value, list):
+                fields.append({"name": name, "type": "Collection(Edm.Single)", "dimensions": len(value), "vectorSearchProfile": "myHnswProfile"})
+            else:
+                fields.append({"name": name, "type": "Edm.String", "key": name == "chunk_id", "filterable": True, "sortable": True})
+        return {"name": index_name, "fields": fields,
+                "vectorSearch": {"algorithms": [{"name": "myHnsw", "kind": "hnsw"}], "profiles": [{"name": "myHnswProfile", "algorithm": "myHnsw"}]}}
+
+    def create_index(self, index_name, definition):
+        with self.lock:
+            self.indexes[index_name] = {**definition, "name": index_name}
+            self.index_documents.setdefault(index_name, [])
+        return self.indexes[index_name]
+
+    def index_response(self, request, index_name=None):
+        # Merge-or-upload into the in-memory documents, keyed by chunk_id
+        with self.lock:
+            documents = self.documents_for(index_name)
+            positions = {document["chunk_id"]: i for i, document in enumerate(documents)}
+            for action in request.get("value", []):
+                document = {key: value for key, value in action.items() if not key.startswith("@search.")}
+                if document["chunk_id"] in positions:
+                    documents[positions[document["chunk_id"]]].update(document)
+                else:
+                    positions[document["chunk_id"]] = len(documents)
+                    documents.append(document)
+        return {"value": [{"key": action["chunk_id"], "status": True, "errorMessage": None, "statusCode": 201} for action in request.get("value", [])]}
+
+    def search_response(self, request, index_name=None):
+        top = 50 if request.get("top") is None else request["top"]
+        documents = self.documents_for(index_name)
+        if request.get("filter"):
+            documents = [document for document in documents if _matches(document, request["filter"])]
+        # Vector and semantic work grows with the chunks the filter leaves in
+        _delay(len(documents) * self.search_chunk_latency)
+        facets = {}
+        for facet in request.get("facets") or []:
+            field, _, options = facet.partition(",")
+            count = int(dict(option.split(":") for option in options.split(",") if ":" in option).get("count", 10))
+            counts = Counter(document.get(field) for document in documents if document.get(field) is not None)
+            facets[field] = [{"value": value, "count": n} for value, n in counts.most_common(count)]
+        for order in reversed((request.get("orderby") or "").split(",")):
+            if order.strip():
+                field, _, direction = order.strip().partition(" ")
+                documents = sorted(documents, key=lambda document: document.get(field) or "", reverse=direction == "desc")
+        if self.sample_results:
+            documents = random.Random(request.get("search")).sample(documents, min(top, len(documents)))
+        documents = documents[:top]
+        if self.shuffle_results:
+            documents = list(documents)
+            random.Random(request.get("search")).shuffle(documents)
+        if request.get("select"):
+            fields = [field.strip() for field in request["select"].split(",")]
+            documents = [{field: document.get(field) for field in fields} for document in documents]
+        response = {"value": []}
+        semantic = request.get("queryType") == "semantic"
+        for rank, document in enumerate(documents):
+            result = {"@search.score": 1.0 / (rank + 1)}
+            result.update(document)
+            if semantic:
+                result["@search.rerankerScore"] = 3.0 - rank * 0.5
+                result["@search.captions"] = [{"text": document["chunk"][:200], "highlights": None}]
+            response["value"].append(result)
+        if facets:
+            response["@search.facets"] = facets
+        score = self.answer_score(request) if callable(self.answer_score) else self.answer_score
+        if semantic and documents and request.get("answers") and score is not None:
+            response["@search.answers"] = [{"key": documents[0]["chunk_id"], "text": documents[0]["chunk"], "highlights": None, "score": score}]
+        return response
+
+    def prompt_tokens(self, request):
+        return sum(len(str(m.get("content", ""))) // 4 for m in request.get("messages", []))
+
+    def cached_tokens(self, request):
+        # Leading tokens of this prompt that an earlier prompt sent too, in cacheable steps;
+        # a prompt's own prefixes become cacheable once it has been processed
+        if not self.prompt_cache:
+            return 0
+        text = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in request.get("messages", []))
+        steps = [1024 + 128 * i for i in range(max(0, (len(text) // 4 - 1024) // 128 + 1))]
+        keys = [hashlib.sha256(text[:tokens * 4].encode("utf-8")).hexdigest() for tokens in steps]
+        with self.lock:
+            cached = max((tokens for tokens, key in zip(steps, keys) if key in self._prefixes), default=0)
+            self._prefixes.update(keys)
+        return min(cached, self.prompt_tokens(request))
+
+    def prompt_latency(self, request, cached_tokens=0):
+        return (self.prompt_tokens(request) - cached_tokens) * self.prompt_token_latency
+
+    def chat_response(self, request, cached_tokens=0):
+        prompt_tokens = self.prompt_tokens(request)
+        completion_tokens = len(self.answer) // 4
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or "gpt-4.1",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": self.answer}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+        }
+
+    def chat_stream(self, request, cached_tokens=0):
+        created = int(time.time())
+        model = request.get("model") or "gpt-4.1"
+        words = self.answer.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                _delay(self.token_latency)
+            token = word if i == 0 else " " + word
+            yield {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                   "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}]}
+        yield {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage = self.chat_response(request, cached_tokens)["usage"]
+            yield {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model, "choices": [], "usage": usage}
+        yield "[DONE]"
+
+    def embedding_response(self, request):
+        inputs = request.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or self.dimensions
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)} for i, text in enumerate(inputs)]
+        tokens = sum(len(text) // 4 for text in inputs)
+        return {"object": "list", "data": data, "model": request.get("model") or "text-embedding-3-large", "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+def fake_embedding(text, dimensions):
+    # Deterministic pseudo-embedding so the same text always maps to the same vector
+    import hashlib
+    import random
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+class FakeContainerClient:
+    # In-memory stand-in for azure.storage.blob.ContainerClient with per-request latency
+    # and a bandwidth cap, enough for the calls blob_sync.sync_documents() makes
+    def __init__(self, request_latency=0.0, bytes_per_second=None):
+        from types import SimpleNamespace
+        self._namespace = SimpleNamespace
+        self.request_latency = request_latency
+        self.bytes_per_second = bytes_per_second
+        self.blobs = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _request(self, size=0):
+        with self.lock:
+            self.requests += 1
+        _delay(self.request_latency)
+        if self.bytes_per_second and size:
+            time.sleep(size / self.bytes_per_second)
+
+    def exists(self):
+        self._request()
+        return True
+
+    def create_container(self):
+        self._request()
+
+    def list_blobs(self):
+        self._request()
+        with self.lock:
+            blobs = list(self.blobs.items())
+        for name, (data, content_settings) in blobs:
+            yield self._namespace(name=name, size=len(data), content_settings=content_settings)
+
+    def upload_blob(self, name, data, overwrite=False, content_settings=None, **kwargs):
+        content = data.read() if hasattr(data, "read") else bytes(data)
+        self._request(len(content))
+        with self.lock:
+            if name in self.blobs and not overwrite:
+                raise ValueError(f"Blob {name} already exists")
+            self.blobs[name] = (content, content_settings)
+
+    def delete_blob(self, name, **kwargs):
+        self._request()
+        with self.lock:
+            del self.blobs[name]
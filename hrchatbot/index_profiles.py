@@ -0,0 +1,212 @@
+## Vector index profiles
+# INDEX_PROFILE picks how the "vector" field is indexed: the HNSW parameters, an optional
+# scalar (int8) or binary quantization with oversampling and full-precision rescoring, and an
+# optional truncation of the stored embedding to fewer dimensions (text-embedding-3 models
+# keep most of their quality when truncated). Single values can be overridden with
+# INDEX_HNSW_M, INDEX_HNSW_EF_CONSTRUCTION, INDEX_HNSW_EF_SEARCH, INDEX_OVERSAMPLING and
+# INDEX_TRUNCATE_DIMENSIONS. Changing the compression of an existing field needs a new index.
+# Queries only use the graph (and the quantized vectors) when they are not exhaustive; the
+# full-precision baseline keeps the exact, brute-force search it always had, and
+# INDEX_EXHAUSTIVE=true|false overrides that per profile.
+# simulate() lets a profile be chosen offline from stored embeddings:
+# python -m hrchatbot.benchmark index-profiles
+# It models the compression, oversampling and rescoring, and the HNSW search over the
+# bottom layer of the graph: each vector linked to its 2*m nearest neighbours (under the
+# compressed scores) and a beam search of width ef_search from a sampled entry point.
+# ef_construction is not modelled; the graph is the one a very large ef_construction
+# would converge to, so recall for small values is optimistic.
+import heapq
+import math
+import os
+
+PROFILES = {
+    # The service defaults, over full float32 vectors, queried exhaustively
+    "full": {"compression": None, "exhaustive": True, "m": 4, "ef_construction": 400, "ef_search": 500},
+    "scalar": {"compression": "scalar", "oversampling": 4.0, "rescore": True, "m": 4, "ef_construction": 400, "ef_search": 500},
+    "binary": {"compression": "binary", "oversampling": 10.0, "rescore": True, "m": 4, "ef_construction": 400, "ef_search": 500},
+    "scalar-1024": {"compression": "scalar", "oversampling": 4.0, "rescore": True, "truncate_dimensions": 1024, "m": 4, "ef_construction": 400, "ef_search": 500},
+    "binary-1024": {"compression": "binary", "oversampling": 10.0, "rescore": True, "truncate_dimensions": 1024, "m": 4, "ef_construction": 400, "ef_search": 500},
+    # Denser graph and wider search for the largest document sets
+    "high-recall": {"compression": "scalar", "oversampling": 8.0, "rescore": True, "m": 8, "ef_construction": 600, "ef_search": 800},
+}
+
+def index_profile(name=None):
+    name = name or os.getenv("INDEX_PROFILE", "full")
+    if name not in PROFILES:
+        raise Exception(f"Unknown INDEX_PROFILE '{name}', expected one of {', '.join(PROFILES)}")
+    profile = {"name": name, "exhaustive": False, "oversampling": None, "rescore": False, "truncate_dimensions": None, **PROFILES[name]}
+    for key, variable, cast in (("m", "INDEX_HNSW_M", int), ("ef_construction", "INDEX_HNSW_EF_CONSTRUCTION", int),
+                                ("ef_search", "INDEX_HNSW_EF_SEARCH", int), ("oversampling", "INDEX_OVERSAMPLING", float),
+                                ("truncate_dimensions", "INDEX_TRUNCATE_DIMENSIONS", int),
+                                ("exhaustive", "INDEX_EXHAUSTIVE", lambda value: value == "true")):
+        if os.getenv(variable):
+            profile[key] = cast(os.getenv(variable))
+    if profile["truncate_dimensions"] and not profile["compression"]:
+        raise Exception("INDEX_TRUNCATE_DIMENSIONS needs a scalar or binary compression profile")
+    return profile
+
+def vector_search_settings(profile):
+    # Returns the HNSW algorithm configuration and the compressions list for VectorSearch,
+    # plus the compression name for the VectorSearchProfile (None without compression)
+    from azure.search.documents.indexes.models import (
+        BinaryQuantizationCompression,
+        HnswAlgorithmConfiguration,
+        HnswParameters,
+        RescoringOptions,
+        ScalarQuantizationCompression,
+        ScalarQuantizationParameters,
+    )
+
+    algorithm = HnswAlgorithmConfiguration(
+        name="myHnsw",
+        parameters=HnswParameters(m=profile["m"], ef_construction=profile["ef_construction"], ef_search=profile["ef_search"], metric="cosine"),
+    )
+    if not profile["compression"]:
+        return algorithm, [], None
+
+    compression_name = f"my{profile['compression'].capitalize()}Quantization"
+    options = dict(
+        compression_name=compression_name,
+        rescoring_options=RescoringOptions(
+            enable_rescoring=profile["rescore"],
+            default_oversampling=profile["oversampling"],
+            rescore_storage_method="preserveOriginals",
+        ),
+        truncation_dimension=profile["truncate_dimensions"],
+    )
+    if profile["compression"] == "scalar":
+        compression = ScalarQuantizationCompression(parameters=ScalarQuantizationParameters(quantized_data_type="int8"), **options)
+    else:
+        compression = BinaryQuantizationCompression(**options)
+    return algorithm, [compression], compression_name
+
+## Offline simulation
+def _normalize(vectors):
+    import numpy as np
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def compress(vectors, profile):
+    # Returns the query encoder, the compressed vectors as a float matrix (scores are dot
+    # products of the two) and their size in bytes
+    import numpy as np
+
+    dimensions = profile["truncate_dimensions"] or vectors.shape[1]
+    truncated = _normalize(vectors[:, :dimensions])
+    if profile["compression"] == "scalar":
+        # int8 per dimension over the observed range of each dimension
+        low, high = truncated.min(axis=0), truncated.max(axis=0)
+        scale = np.where(high > low, (high - low) / 255, 1)
+        codes = np.round((truncated - low) / scale - 128).astype(np.int8)
+        decoded = ((codes.astype(np.float32) + 128) * scale + low).astype(np.float32)
+        return (lambda queries: _normalize(queries[:, :dimensions])), decoded, codes.nbytes
+    if profile["compression"] == "binary":
+        bits = np.packbits(truncated > 0, axis=1)
+        signs = np.where(truncated > 0, 1.0, -1.0).astype(np.float32)
+        # The dot product of the signs ranks like the Hamming similarity of the packed bits
+        return (lambda queries: np.where(queries[:, :dimensions] > 0, 1.0, -1.0).astype(np.float32)), signs, bits.nbytes
+    truncated = truncated.astype(np.float32)
+    return (lambda queries: _normalize(queries[:, :dimensions])), truncated, truncated.nbytes
+
+def graph_bytes(count, profile):
+    # Dominated by the bottom HNSW layer: up to 2*m neighbours per vector as 4-byte ids
+    return count * profile["m"] * 2 * 4
+
+def build_graph(stored, m, batch=2048):
+    # Bottom HNSW layer: each vector's 2*m nearest neighbours, plus the links back to it
+    import numpy as np
+
+    degree = min(2 * m, len(stored) - 1)
+    neighbours = np.empty((len(stored), degree), dtype=np.int64)
+    for start in range(0, len(stored), batch):
+        scores = stored[start:start + batch] @ stored.T
+        rows = np.arange(scores.shape[0])
+        scores[rows, start + rows] = -np.inf
+        nearest = np.argpartition(-scores, degree - 1, axis=1)[:, :degree] if degree else np.empty((len(rows), 0), dtype=np.int64)
+        neighbours[start:start + batch] = nearest
+    graph = [set(row) for row in neighbours.tolist()]
+    for node, row in enumerate(neighbours.tolist()):
+        for neighbour in row:
+            graph[neighbour].add(node)
+    return [np.fromiter(links, dtype=np.int64) for links in graph]
+
+def graph_search(query, stored, graph, entry, ef):
+    # Beam search of width ef from entry; returns (score, node) pairs, best first
+    visited = {entry}
+    score = float(stored[entry] @ query)
+    candidates = [(-score, entry)]
+    results = [(score, entry)]
+    while candidates:
+        negative, node = heapq.heappop(candidates)
+        if len(results) >= ef and -negative < results[0][0]:
+            break
+        links = [link for link in graph[node].tolist() if link not in visited]
+        if not links:
+            continue
+        visited.update(links)
+        for link, link_score in zip(links, (stored[links] @ query).tolist()):
+            if len(results) < ef or link_score > results[0][0]:
+                heapq.heappush(candidates, (-link_score, link))
+                heapq.heappush(results, (link_score, link))
+                if len(results) > ef:
+                    heapq.heappop(results)
+    return sorted(results, reverse=True)
+
+def simulate(vectors, queries, profile, k=10, seed=0):
+    # recall@k against exact full-precision search, plus the memory the profile needs
+    import numpy as np
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    exact = _normalize(queries) @ _normalize(vectors).T
+    truth = np.argsort(-exact, axis=1)[:, :k]
+
+    encode, stored, vector_bytes = compress(vectors, profile)
+    candidates = k
+    if profile["compression"] and profile["oversampling"]:
+        candidates = min(len(vectors), int(math.ceil(k * profile["oversampling"])))
+    if profile["exhaustive"]:
+        # Every stored vector is scored; the graph is not used
+        found = np.argsort(-(encode(queries) @ stored.T), axis=1)[:, :candidates]
+    else:
+        graph = build_graph(stored, profile["m"])
+        # The upper layers only lead the search to a good starting point; a sample of the share of
+        # vectors HNSW puts on the first upper layer (1/m) stands in for them
+        sample = np.random.default_rng(seed).choice(len(stored), size=max(1, len(stored) // profile["m"]), replace=False)
+        found = []
+        for query in encode(queries):
+            entry = int(sample[np.argmax(stored[sample] @ query)])
+            results = graph_search(query, stored, graph, entry, max(profile["ef_search"], candidates))
+            nodes = [node for _, node in results[:candidates]]
+            found.append(nodes + [nodes[-1]] * (candidates - len(nodes)))
+        found = np.array(found, dtype=np.int64)
+    if profile["rescore"]:
+        # Full-precision rescoring of the oversampled candidates
+        rescored = np.take_along_axis(exact, found, axis=1)
+        found = np.take_along_axis(found, np.argsort(-rescored, axis=1), axis=1)
+    found = found[:, :k]
+
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(truth, found)])
+    return {
+        "recall_at_k": float(recall),
+        "vector_bytes": int(vector_bytes),
+        "graph_bytes": graph_bytes(len(vectors), profile),
+        # Rescoring reads the preserved originals from disk, outside the vector index quota
+        "original_bytes": int(vectors.nbytes) if profile["compression"] else 0,
+    }
+
+def load_vectors(path):
+    # .npy, an index snapshot (.npz), or the vectors.f32 of a local index directory (with its meta.json)
+    import json
+    import numpy as np
+
+    if path.endswith(".npy"):
+        return np.load(path)
+    if path.endswith(".npz"):
+        from .snapshot import Snapshot
+        snapshot = Snapshot(path)
+        return snapshot.vectors(next(field["name"] for field in snapshot.meta["fields"] if field["vector"]))
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+        dimensions = json.load(f)["dimensions"]
+    return np.fromfile(os.path.join(directory, "vectors.f32"), dtype=np.float32).reshape(-1, dimensions)
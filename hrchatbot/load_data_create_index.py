@@ -1,9 +1,47 @@
 from dotenv import load_dotenv
-from azure.identity import DefaultAzureCredential
-from azure.core.credentials import AzureKeyCredential
+import logging
 import os
+import time
+from . import answer_cache, clients, index_profiles, provision_state
+from .chunking import MAXIMUM_PAGE_LENGTH, PAGE_OVERLAP_LENGTH
+
+logger = logging.getLogger(__name__)
+
+def watch_indexer_run(indexer_client, indexer_name, pending):
+    # Bumps the index version (which invalidates cached answers and the document catalog)
+    # once the indexer run recorded in pending has finished; until then answers built from
+    # the previous index stay valid. Polls on a daemon thread every INDEXER_POLL_SECONDS.
+    import threading
+
+    def finished():
+        result = indexer_client.get_indexer_status(indexer_name).last_result
+        if result is None or result.status == "inProgress" or result.start_time is None:
+            return False
+        return result.start_time.isoformat() != pending["previous_start"]
+
+    def run():
+        deadline = time.monotonic() + float(os.getenv("INDEXER_WAIT_SECONDS", 3600))
+        while time.monotonic() < deadline:
+            try:
+                if finished():
+                    state = provision_state.load_state()
+                    if state.get("pending_index_run") == pending:
+                        del state["pending_index_run"]
+                        provision_state.bump_index_version(state)
+                        answer_cache.invalidate()
+                    logger.info("indexer %s finished; index version is now %d", indexer_name, provision_state.index_version())
+                    return
+            except Exception as error:
+                logger.warning("Could not read the status of indexer %s: %s", indexer_name, error)
+            time.sleep(float(os.getenv("INDEXER_POLL_SECONDS", 5)))
+        logger.warning("indexer %s did not finish within INDEXER_WAIT_SECONDS; cached answers were kept", indexer_name)
+
+    threading.Thread(target=run, name="indexer-watch", daemon=True).start()
 
 def load_data_create_index():
+    from azure.identity import DefaultAzureCredential
+    from azure.core.credentials import AzureKeyCredential
+
     load_dotenv(override=True) # take environment variables from .env.
     
     # Variables not used here do not need to be updated in your .env file
@@ -32,30 +70,54 @@ def load_data_create_index():
     use_document_layout = os.getenv("USE_LAYOUT", "false") == "true"
     # set USE_MARKDOWN to enable parsing markdown files in the blob container. It cannot be combined with the built-in OCR or document layout skill
     use_markdown = os.getenv("USE_MARKDOWN", "false") == "true"
+    # set PRECONVERT_PDF to convert the PDFs to markdown locally and index them with the markdown skillset
+    preconvert_pdf = os.getenv("PRECONVERT_PDF", "false") == "true"
     # Deepest nesting level in markdown that should be considered. See https://learn.microsoft.com/azure/search/cognitive-search-skill-document-intelligence-layout to learn more
     document_layout_depth = os.getenv("LAYOUT_MARKDOWN_HEADER_DEPTH", "h3")
     # OCR must be used to add page numbers
     add_page_numbers = use_ocr
+    # Parallelism and block size used when syncing documents into the blob container
+    blob_upload_workers = int(os.getenv("BLOB_UPLOAD_WORKERS", 8))
+    blob_block_concurrency = int(os.getenv("BLOB_BLOCK_CONCURRENCY", 2))
+    blob_block_size = int(os.getenv("BLOB_BLOCK_SIZE", 4 * 1024 * 1024))
     
-    count_enabled = sum([use_ocr, use_document_layout, use_markdown])
+    count_enabled = sum([use_ocr, use_document_layout, use_markdown or preconvert_pdf])
     if count_enabled >= 2:
         raise Exception(f"Please enable only one of OCR, Layout or Markdown.")
+    use_markdown = use_markdown or preconvert_pdf
     
     #print(f"blob_container_name is {blob_container_name}")
     #print(f"azure_openai_endpoint is {azure_openai_endpoint}")
     #print(f"endpoint is {endpoint}")
     #print(f"azure_ai_services_endpoint is {azure_ai_services_endpoint}")
     #print(f"add_page_numbers is {add_page_numbers}")
+    
+    ## Skip every step whose desired configuration matches what was last provisioned
+    # set FORCE_PROVISION to push every step again, e.g. after resources were deleted in the portal
+    force_provision = os.getenv("FORCE_PROVISION", "false") == "true"
+    state = provision_state.load_state()
+    timings = {}
+    
+    def run_step(name, fingerprint, action):
+        start = time.perf_counter()
+        changed = force_provision or state["steps"].get(name) != fingerprint
+        if changed:
+            action()
+            state["steps"][name] = fingerprint
+            provision_state.save_state(state)
+        timings[name] = {"seconds": round(time.perf_counter() - start, 3), "skipped": not changed}
+        return changed
        
     ## Connect to Blob Storage and load documents
     
     from azure.storage.blob import BlobServiceClient  
+    from .blob_sync import documents_directory, sync_documents
     import glob
     
-    sample_docs_directory = os.path.join( "data", "documents")
-    sample_ocr_docs_directory = os.path.join( "data", "documents")
-    sample_layout_docs_directory = os.path.join( "data", "documents")
-    sample_markdown_docs_directory = os.path.join( "data", "documents")
+    sample_docs_directory = documents_directory()
+    sample_ocr_docs_directory = documents_directory()
+    sample_layout_docs_directory = documents_directory()
+    sample_markdown_docs_directory = documents_directory()
     
     def upload_sample_documents(
             blob_connection_string: str,
@@ -66,17 +128,23 @@ def load_data_create_index():
             use_user_identity: bool = False
         ):
             # Connect to Blob Storage
-            blob_service_client = BlobServiceClient.from_connection_string(logging_enable=True, conn_str=blob_connection_string, credential=DefaultAzureCredential() if use_user_identity else None)
+            # Files larger than max_single_put_size go up as parallel blocks of max_block_size bytes
+            blob_service_client = BlobServiceClient.from_connection_string(
+                logging_enable=True,
+                conn_str=blob_connection_string,
+                credential=DefaultAzureCredential() if use_user_identity else None,
+                max_single_put_size=blob_block_size,
+                max_block_size=blob_block_size,
+                **clients.transport_options(clients.settings()))
             container_client = blob_service_client.get_container_client(blob_container_name)
             if not container_client.exists():
                 container_client.create_container()
     
-            files = glob.glob(os.path.join(documents_directory, '*'))
-            for file in files:
-                with open(file, "rb") as data:
-                    name = os.path.basename(file)
-                    if not container_client.get_blob_client(name).exists():
-                        container_client.upload_blob(name=name, data=data)
+            # Upload only new or changed files and delete blobs whose source file is gone
+            stats = sync_documents(container_client, documents_directory, manifest=state, max_workers=blob_upload_workers, max_concurrency=blob_block_concurrency)
+            logger.info("blob sync: %d uploaded, %d deleted, %d unchanged, %d bytes in %.3fs",
+                        stats["uploaded"], stats["deleted"], stats["unchanged"], stats["bytes_uploaded"], stats["seconds"])
+            return stats
     
     docs_directory = sample_docs_directory
     
@@ -87,10 +155,26 @@ def load_data_create_index():
     elif use_markdown:
         docs_directory = sample_markdown_docs_directory
     
-    upload_sample_documents(
+    if preconvert_pdf:
+        from . import pdf_markdown
+        start = time.perf_counter()
+        stats = pdf_markdown.convert_directory(docs_directory)
+        logger.info("pdf to markdown: %d converted, %d cached, %d pages at %.1f pages/s, %d bytes saved in upload",
+                    stats["converted"], stats["cached"], stats["pages"], stats["pages_per_second"], stats["bytes_saved"])
+        timings["convert_pdf"] = {"seconds": round(time.perf_counter() - start, 3), "skipped": stats["converted"] == 0}
+        docs_directory = pdf_markdown.output_directory()
+    
+    start = time.perf_counter()
+    documents_fingerprint = provision_state.fingerprint(
+        blob_container_name,
+        provision_state.fingerprint(blob_connection_string),
+        provision_state.documents_fingerprint(glob.glob(os.path.join(docs_directory, '*')), state["files"]))
+    timings["hash_documents"] = {"seconds": round(time.perf_counter() - start, 3), "skipped": False}
+    
+    documents_changed = run_step("documents", documents_fingerprint, lambda: upload_sample_documents(
         blob_connection_string=blob_connection_string,
         blob_container_name=blob_container_name,
-        documents_directory = docs_directory)
+        documents_directory = docs_directory))
     
     #print(f"Setup sample data in {blob_container_name}")
     
@@ -104,7 +188,7 @@ def load_data_create_index():
     from azure.search.documents.indexes.models import NativeBlobSoftDeleteDeletionDetectionPolicy
     
     # Create a data source 
-    indexer_client = SearchIndexerClient(endpoint, credential)
+    indexer_client = SearchIndexerClient(endpoint, credential, **clients.transport_options(clients.settings()))
     container = SearchIndexerDataContainer(name=blob_container_name)
     data_source_connection = SearchIndexerDataSourceConnection(
         name=f"{index_name}-blob",
@@ -113,7 +197,8 @@ def load_data_create_index():
         container=container,
         data_deletion_detection_policy=NativeBlobSoftDeleteDeletionDetectionPolicy() if not use_markdown else None
     )
-    data_source = indexer_client.create_or_update_data_source_connection(data_source_connection)
+    run_step("data_source", provision_state.fingerprint(data_source_connection),
+             lambda: indexer_client.create_or_update_data_source_connection(data_source_connection))
     
     #print(f"Data source '{data_source.name}' created or updated")
     
@@ -123,7 +208,6 @@ def load_data_create_index():
         SearchField,
         SearchFieldDataType,
         VectorSearch,
-        HnswAlgorithmConfiguration,
         VectorSearchProfile,
         AzureOpenAIVectorizer,
         AzureOpenAIVectorizerParameters,
@@ -135,7 +219,7 @@ def load_data_create_index():
     )
     
     # Create a search index  
-    index_client = SearchIndexClient(endpoint=endpoint, credential=credential)  
+    index_client = SearchIndexClient(endpoint=endpoint, credential=credential, **clients.transport_options(clients.settings()))
     fields = [  
         SearchField(name="parent_id", type=SearchFieldDataType.String, sortable=True, filterable=True, facetable=True),  
         SearchField(name="title", type=SearchFieldDataType.String),  
@@ -157,15 +241,19 @@ def load_data_create_index():
         ])
       
     # Configure the vector search configuration  
+    # INDEX_PROFILE selects the HNSW parameters, quantization and truncated dimensions
+    algorithm, compressions, compression_name = index_profiles.vector_search_settings(index_profiles.index_profile())
     vector_search = VectorSearch(  
         algorithms=[  
-            HnswAlgorithmConfiguration(name="myHnsw"),
+            algorithm,
         ],  
+        compressions=compressions,
         profiles=[  
             VectorSearchProfile(  
                 name="myHnswProfile",  
                 algorithm_configuration_name="myHnsw",  
                 vectorizer_name="myOpenAI",  
+                compression_name=compression_name,
             )
         ],  
         vectorizers=[  
@@ -195,7 +283,7 @@ def load_data_create_index():
       
     # Create the search index
     index = SearchIndex(name=index_name, fields=fields, vector_search=vector_search, semantic_search=semantic_search)  
-    result = index_client.create_or_update_index(index)  
+    run_step("index", provision_state.fingerprint(index), lambda: index_client.create_or_update_index(index))
     #print(f"{result.name} created")  
     
     
@@ -239,8 +327,8 @@ def load_data_create_index():
             description="Split skill to chunk documents",  
             text_split_mode="pages",  
             context="/document/normalized_images/*",  
-            maximum_page_length=2000,  
-            page_overlap_length=500,  
+            maximum_page_length=MAXIMUM_PAGE_LENGTH,  
+            page_overlap_length=PAGE_OVERLAP_LENGTH,  
             inputs=[  
                 InputFieldMappingEntry(name="text", source="/document/normalized_images/*/text"),  
             ],  
@@ -312,8 +400,8 @@ def load_data_create_index():
             description="Split skill to chunk documents",  
             text_split_mode="pages",  
             context="/document/markdownDocument/*",  
-            maximum_page_length=2000,  
-            page_overlap_length=500,  
+            maximum_page_length=MAXIMUM_PAGE_LENGTH,  
+            page_overlap_length=PAGE_OVERLAP_LENGTH,  
             inputs=[  
                 InputFieldMappingEntry(name="text", source="/document/markdownDocument/*/content"),  
             ],  
@@ -374,8 +462,8 @@ def load_data_create_index():
             description="Split skill to chunk documents",  
             text_split_mode="pages",  
             context="/document",  
-            maximum_page_length=2000,  
-            page_overlap_length=500,  
+            maximum_page_length=MAXIMUM_PAGE_LENGTH,  
+            page_overlap_length=PAGE_OVERLAP_LENGTH,  
             inputs=[  
                 InputFieldMappingEntry(name="text", source="/document/content"),  
             ],  
@@ -436,8 +524,8 @@ def load_data_create_index():
             description="Split skill to chunk documents",  
             text_split_mode="pages",  
             context="/document",  
-            maximum_page_length=2000,  
-            page_overlap_length=500,  
+            maximum_page_length=MAXIMUM_PAGE_LENGTH,  
+            page_overlap_length=PAGE_OVERLAP_LENGTH,  
             inputs=[  
                 InputFieldMappingEntry(name="text", source="/document/content"),  
             ],  
@@ -491,8 +579,7 @@ def load_data_create_index():
     
     skillset = create_ocr_skillset() if use_ocr else create_layout_skillset() if use_document_layout else create_markdown_skillset() if use_markdown else create_skillset()
       
-    client = SearchIndexerClient(endpoint, credential)  
-    client.create_or_update_skillset(skillset)  
+    skillset_changed = run_step("skillset", provision_state.fingerprint(skillset), lambda: indexer_client.create_or_update_skillset(skillset))
     #print(f"{skillset.name} created")  
     
     ## Create an Indexer
@@ -530,14 +617,28 @@ def load_data_create_index():
         description="Indexer to index documents and generate embeddings",  
         skillset_name=skillset_name,  
         target_index_name=index_name,  
-        data_source_name=data_source.name,
+        data_source_name=data_source_connection.name,
         parameters=indexer_parameters
     )  
     
-    indexer_client = SearchIndexerClient(endpoint, credential)  
-    indexer_result = indexer_client.create_or_update_indexer(indexer)  
+    run_step("indexer", provision_state.fingerprint(indexer), lambda: indexer_client.create_or_update_indexer(indexer))
       
-    # Run the indexer  
-    indexer_client.run_indexer(indexer_name)  
-    #print(f'Indexer {indexer_name} is created and running. If queries return no results, please wait a bit and try again.')  
+    # Run the indexer only when there is something new for it to process
+    start = time.perf_counter()
+    if force_provision or documents_changed or skillset_changed:
+        last_result = indexer_client.get_indexer_status(indexer_name).last_result
+        indexer_client.run_indexer(indexer_name)  
+        #print(f'Indexer {indexer_name} is created and running. If queries return no results, please wait a bit and try again.')  
+        # The run is asynchronous; cached answers are invalidated once it has finished
+        state["pending_index_run"] = {"previous_start": last_result.start_time.isoformat() if last_result and last_result.start_time else None}
+        provision_state.save_state(state)
+    if state.get("pending_index_run"):
+        # Also picks up a run an earlier process started but did not see finish
+        watch_indexer_run(indexer_client, indexer_name, state["pending_index_run"])
+    timings["run_indexer"] = {"seconds": round(time.perf_counter() - start, 3), "skipped": not (force_provision or documents_changed or skillset_changed)}
+    
+    for name, timing in timings.items():
+        logger.info("%s: %.3fs%s", name, timing["seconds"], " (unchanged, skipped)" if timing["skipped"] else "")
+    
+    return timings
 
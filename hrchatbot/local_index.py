@@ -0,0 +1,210 @@
+## Embedded local retrieval backend
+# Mirrors the Azure AI Search index (parent_id/chunk_id/title/chunk/vector) on disk so the bot
+# and its benchmarks can run without a network hop per query:
+#   vectors.f32   chunk vectors as one contiguous float32 matrix, memory-mapped at query time
+#   norms.f32     precomputed vector norms for cosine similarity
+#   chunks.jsonl  one JSON object per chunk, in the same order as the matrix rows
+#   meta.json     row count and dimensions
+# Queries score vectors with a blockwise NumPy top-k and keywords with BM25 over an in-memory
+# inverted index, then fuse both rankings with reciprocal-rank fusion like the hybrid query.
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOP_WORDS = frozenset("a an and are as at be by for from has have if in is it of on or that the their this to was what which who will with".split())
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+def index_directory():
+    return os.getenv("LOCAL_INDEX_DIR", os.path.join(".hrchatbot", "local_index"))
+
+def build_local_index(directory, documents, vectors=None, dimensions=None):
+    # documents is an iterable of dicts with parent_id, chunk_id, title and chunk;
+    # vectors is a matching iterable of embeddings (omit it for a keyword-only index)
+    import numpy as np
+
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    vector_iter = iter(vectors) if vectors is not None else None
+    with open(os.path.join(directory, "chunks.jsonl"), "w", encoding="utf-8") as chunks_file, \
+         open(os.path.join(directory, "vectors.f32"), "wb") as vectors_file, \
+         open(os.path.join(directory, "norms.f32"), "wb") as norms_file:
+        for document in documents:
+            chunks_file.write(json.dumps({key: document.get(key) for key in ("parent_id", "chunk_id", "title", "chunk")}) + "\n")
+            if vector_iter is not None:
+                vector = np.asarray(next(vector_iter), dtype=np.float32)
+                dimensions = dimensions or vector.shape[0]
+                vectors_file.write(vector.tobytes())
+                norms_file.write(np.float32(np.linalg.norm(vector) or 1.0).tobytes())
+            count += 1
+
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": count, "dimensions": dimensions if vector_iter is not None else 0}, f)
+    return count
+
+class LocalIndex:
+    def __init__(self, directory, k1=1.2, b=0.75, rrf_k=60):
+        import numpy as np
+
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.rrf_k = rrf_k
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.dimensions = meta["dimensions"]
+
+        self.vectors = None
+        if self.dimensions and self.count:
+            self.vectors = np.memmap(os.path.join(directory, "vectors.f32"), dtype=np.float32, mode="r", shape=(self.count, self.dimensions))
+            self.norms = np.fromfile(os.path.join(directory, "norms.f32"), dtype=np.float32)
+
+        with open(os.path.join(directory, "chunks.jsonl"), encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in f]
+        self._build_keyword_index()
+
+    def _build_keyword_index(self):
+        # Postings are stored as parallel row/term-frequency arrays per term
+        import numpy as np
+
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(self.count, dtype=np.float32)
+        for row, chunk in enumerate(self.chunks):
+            tokens = tokenize(f"{chunk.get('title') or ''} {chunk.get('chunk') or ''}")
+            lengths[row] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                rows, frequencies = postings[term]
+                rows.append(row)
+                frequencies.append(frequency)
+
+        self.postings = {term: (np.asarray(rows, dtype=np.int32), np.asarray(frequencies, dtype=np.float32))
+                         for term, (rows, frequencies) in postings.items()}
+        self.length_norm = self.k1 * (1 - self.b + self.b * lengths / (lengths.mean() if self.count else 1.0))
+
+    def rows_of(self, parent_ids):
+        # Boolean mask of the chunks that belong to those documents
+        import numpy as np
+
+        if not hasattr(self, "_parent_ids"):
+            self._parent_ids = np.array([chunk["parent_id"] for chunk in self.chunks])
+        return np.isin(self._parent_ids, list(parent_ids))
+
+    def keyword_search(self, query, k, mask=None):
+        import numpy as np
+
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, frequencies = posting
+            idf = math.log(1 + (self.count - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + self.length_norm[rows])
+        if mask is not None:
+            scores[~mask] = 0.0
+        return self._top_k(scores, k, minimum=0.0)
+
+    def vector_search(self, vector, k, block_size=65536, mask=None):
+        # Cosine similarity computed block by block so a large memory-mapped matrix never
+        # has to be resident at once; each block contributes its own top-k candidates
+        import numpy as np
+
+        if self.vectors is None:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        candidate_rows = []
+        candidate_scores = []
+        for start in range(0, self.count, block_size):
+            block = self.vectors[start:start + block_size]
+            scores = block @ query / self.norms[start:start + block_size]
+            if mask is not None:
+                scores[~mask[start:start + block_size]] = -np.inf
+            top = min(k, len(scores))
+            rows = np.argpartition(-scores, top - 1)[:top]
+            candidate_rows.append(rows + start)
+            candidate_scores.append(scores[rows])
+        rows = np.concatenate(candidate_rows)
+        scores = np.concatenate(candidate_scores)
+        order = np.argsort(-scores)[:k]
+        order = order[np.isfinite(scores[order])]
+        return list(zip(rows[order].tolist(), scores[order].tolist()))
+
+    def _top_k(self, scores, k, minimum=None):
+        import numpy as np
+
+        if minimum is not None:
+            candidates = np.flatnonzero(scores > minimum)
+            if len(candidates) == 0:
+                return []
+        else:
+            candidates = np.arange(len(scores))
+        top = min(k, len(candidates))
+        best = candidates[np.argpartition(-scores[candidates], top - 1)[:top]]
+        best = best[np.argsort(-scores[best])]
+        return list(zip(best.tolist(), scores[best].tolist()))
+
+    def search(self, query, vector=None, top=1, candidates=50, parent_ids=None):
+        # Reciprocal-rank fusion of the keyword and vector rankings, over the chunks of
+        # parent_ids only when it is given
+        mask = self.rows_of(parent_ids) if parent_ids else None
+        fused = defaultdict(float)
+        rankings = [self.keyword_search(query, candidates, mask)]
+        if vector is not None:
+            rankings.append(self.vector_search(vector, candidates, mask=mask))
+        for ranking in rankings:
+            for rank, (row, score) in enumerate(ranking):
+                fused[row] += 1.0 / (self.rrf_k + rank + 1)
+
+        results = []
+        for row, score in sorted(fused.items(), key=lambda item: -item[1])[:top]:
+            chunk = self.chunks[row]
+            results.append({
+                "parent_id": chunk["parent_id"],
+                "chunk_id": chunk["chunk_id"],
+                # No semantic ranker runs here; results come back in fusion order
+                "reranker_score": None,
+                "fusion_score": score,
+                "content": chunk["chunk"]
+            })
+        return results
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_local_index():
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LocalIndex(index_directory())
+    return _index
+
+def local_backend():
+    # RETRIEVAL_BACKEND is azure (default) or local
+    return os.getenv("RETRIEVAL_BACKEND", "azure") == "local"
+
+def export_from_search(search_client, directory):
+    # Copies every chunk and vector out of the Azure AI Search index into a local index.
+    # Answers cached from the previous local index are keyed by the old index version
+    from . import answer_cache, provision_state
+
+    results = search_client.search(search_text="*", select=["parent_id", "chunk_id", "title", "chunk", "vector"])
+    documents = list(results)
+    count = build_local_index(directory, documents, [document["vector"] for document in documents])
+    provision_state.bump_index_version()
+    answer_cache.invalidate()
+    return count
+
+if __name__ == "__main__":
+    # python -m hrchatbot.local_index  builds the local index from the Azure AI Search index
+    from . import clients
+    count = export_from_search(clients.get_search_client(), index_directory())
+    print(f"Exported {count} chunks to {index_directory()}")
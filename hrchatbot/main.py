@@ -1,16 +1,53 @@
-from .load_data_create_index import load_data_create_index
-from .retrieval_generation import retrieval_generation
+from dotenv import load_dotenv
 
-print("Just a second... HR CHatbot is preparing to answer your questions.\n")
+# Settings in .env apply to everything below, not only to the background start-up
+load_dotenv(override=True) # take environment variables from .env.
 
-load_data_create_index();
+from . import startup
+from .conversation import Conversation
+from . import telemetry
+import os
+
+# Provisioning, client set-up and connection warm-up run in the background (see startup.py)
+starting = startup.start()
+if not starting.ready():
+    print("HR Chatbot is getting ready in the background; you can type your first question now.\n")
+
+# set METRICS_PORT to serve Prometheus metrics while the chatbot runs (needs TELEMETRY=metrics);
+# they are served on 127.0.0.1 unless METRICS_HOST says otherwise
+if os.getenv("METRICS_PORT"):
+    telemetry.start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+# set SHOW_TIMINGS to print time to first token and total time after each answer
+show_timings = os.getenv("SHOW_TIMINGS", "false") == "true"
+
+# Follow-up questions are answered with the earlier turns of this conversation in mind
+conversation = Conversation()
 
 while True:
     user_input = input("Question: ")
     if user_input.lower() == 'exit':
         print("Goodbye!")
         break
-    response = retrieval_generation(user_input)
-    
-    print(f"Answer:{response}\n")
+    if user_input.lower() == 'new':
+        conversation.clear()
+        print("Starting a new conversation.\n")
+        continue
+    if not starting.ready():
+        print("Just a second... HR Chatbot is preparing to answer your questions.")
+    starting.wait()
+    from .retrieval_generation import retrieval_generation_stream
+    response = retrieval_generation_stream(user_input, conversation)
+
+    # Print tokens as they arrive instead of waiting for the whole completion
+    print("Answer:", end="", flush=True)
+    for token in response:
+        print(token, end="", flush=True)
+    print("\n")
+
+    # An answer quoted straight from a policy document says which one
+    if response.source:
+        print(f"(quoted from {response.source})\n")
 
+    if show_timings:
+        print(f"(first token {response.time_to_first_token or 0:.2f}s, total {response.total_time:.2f}s)\n")
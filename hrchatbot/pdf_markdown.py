@@ -0,0 +1,173 @@
+## Local PDF to markdown pre-conversion
+# Cracking PDFs in the indexer, or running OcrSkill or DocumentIntelligenceLayoutSkill on
+# them, is the slowest and most expensive part of an indexer run. With PRECONVERT_PDF=true,
+# load_data_create_index() converts the PDFs locally first and uploads the markdown for the
+# USE_MARKDOWN skillset instead. Lines set in a larger font than the body text become
+# headings (the three largest sizes map to #, ## and ###), and every page starts with a
+# "[Page n]" line so page numbers stay in the chunk text. Conversions run on a process
+# pool and are cached by file hash, so unchanged PDFs are not parsed again.
+# python -m hrchatbot.pdf_markdown [--directory data/documents] [--output DIR] [--workers N]
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Bump when the output format changes so cached conversions are redone
+CONVERTER_VERSION = 1
+# A line counts as a heading when its font is this much larger than the body text
+HEADING_SCALE = 1.15
+MAXIMUM_HEADING_LENGTH = 120
+
+def cache_directory():
+    return os.getenv("MARKDOWN_CACHE_DIR", os.path.join(".hrchatbot", "markdown_cache"))
+
+def output_directory():
+    return os.getenv("MARKDOWN_DOCUMENTS_DIR", os.path.join(".hrchatbot", "markdown_documents"))
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _font_sizes(page):
+    # Effective font size of every text line on the page, from the text and current matrices
+    sizes = {}
+
+    def visit(text, cm, tm, font_dict, font_size):
+        line = " ".join(text.split())
+        if not line:
+            return
+        scale = math.hypot(tm[0] * cm[0] + tm[1] * cm[2], tm[0] * cm[1] + tm[1] * cm[3]) or 1.0
+        sizes[line] = max(sizes.get(line, 0.0), round(font_size * scale, 1))
+
+    text = page.extract_text(visitor_text=visit) or ""
+    return text, sizes
+
+def convert_pdf(path):
+    # Returns the markdown and the number of pages
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = [_font_sizes(page) for page in reader.pages]
+
+    # The body size is the one most of the characters are set in
+    weights = Counter()
+    for _, sizes in pages:
+        for line, size in sizes.items():
+            weights[size] += len(line)
+    body = weights.most_common(1)[0][0] if weights else 0.0
+    heading_sizes = sorted({size for size in weights if body and size >= body * HEADING_SCALE}, reverse=True)[:3]
+    levels = {size: level for level, size in enumerate(heading_sizes, start=1)}
+
+    lines = [f"# {os.path.splitext(os.path.basename(path))[0]}", ""]
+    for number, (text, sizes) in enumerate(pages, start=1):
+        lines += [f"[Page {number}]", ""]
+        for line in text.splitlines():
+            line = " ".join(line.split())
+            if not line:
+                continue
+            level = levels.get(sizes.get(line))
+            if level and len(line) <= MAXIMUM_HEADING_LENGTH:
+                # Leave room for the document title as the only level-1 heading
+                if lines[-1]:
+                    lines.append("")
+                lines += ["#" * min(level + 1, 3) + " " + line, ""]
+            else:
+                lines.append(line)
+        lines.append("")
+    return "\n".join(lines), len(reader.pages)
+
+def _write_atomic(path, text):
+    # Readers see the old file or the whole new one, never a partial write
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+def _convert_file(job):
+    path, cached = job
+    markdown, pages = convert_pdf(path)
+    # The sidecar goes first, so an interrupted run never leaves a cached .md without it
+    _write_atomic(cached + ".json", json.dumps({"source": os.path.basename(path), "pages": pages}))
+    _write_atomic(cached, markdown)
+    return path, pages
+
+def convert_directory(directory, output=None, workers=None):
+    # Writes one .md per PDF (other files are copied as they are) and removes outputs whose
+    # source is gone, so syncing the output directory mirrors the source directory
+    start = time.perf_counter()
+    output = output or output_directory()
+    cache = cache_directory()
+    os.makedirs(output, exist_ok=True)
+    os.makedirs(cache, exist_ok=True)
+
+    files = sorted(path for path in glob.glob(os.path.join(directory, "*")) if os.path.isfile(path))
+    pdfs = [path for path in files if path.lower().endswith(".pdf")]
+    cached_paths = {}
+    jobs = []
+    for path in pdfs:
+        cached = cached_paths[path] = os.path.join(cache, f"{file_sha256(path)}-v{CONVERTER_VERSION}.md")
+        if not (os.path.exists(cached) and os.path.exists(cached + ".json")):
+            jobs.append((path, cached))
+
+    converted_pages = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            converted_pages = sum(count for _, count in executor.map(_convert_file, jobs))
+
+    expected = set()
+    pages = 0
+    source_bytes = 0
+    output_bytes = 0
+    for path in files:
+        name = os.path.basename(path)
+        if path in cached_paths:
+            name = os.path.splitext(name)[0] + ".md"
+            with open(cached_paths[path] + ".json", encoding="utf-8") as f:
+                pages += json.load(f)["pages"]
+            source = cached_paths[path]
+        else:
+            source = path
+        target = os.path.join(output, name)
+        if not os.path.exists(target) or os.path.getsize(target) != os.path.getsize(source) or os.path.getmtime(target) < os.path.getmtime(source):
+            shutil.copyfile(source, target)
+        expected.add(name)
+        source_bytes += os.path.getsize(path)
+        output_bytes += os.path.getsize(target)
+
+    for name in os.listdir(output):
+        if name not in expected and os.path.isfile(os.path.join(output, name)):
+            os.remove(os.path.join(output, name))
+
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(files),
+        "pdfs": len(pdfs),
+        "converted": len(jobs),
+        "cached": len(pdfs) - len(jobs),
+        "pages": pages,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": converted_pages / elapsed if jobs and elapsed else 0,
+        "source_bytes": source_bytes,
+        "upload_bytes": output_bytes,
+        "bytes_saved": source_bytes - output_bytes,
+    }
+
+if __name__ == "__main__":
+    from .blob_sync import documents_directory
+
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.pdf_markdown")
+    parser.add_argument("--directory", default=documents_directory())
+    parser.add_argument("--output", default=None, help="defaults to MARKDOWN_DOCUMENTS_DIR or .hrchatbot/markdown_documents")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    print(json.dumps(convert_directory(args.directory, args.output, args.workers), indent=2))
@@ -0,0 +1,94 @@
+## Prompt prefix reuse
+# Azure OpenAI caches prompt prefixes of 1024 tokens and more, in 128-token steps, for a
+# few minutes; the cached part of a later prompt is processed faster and billed at a
+# discount, and is reported as usage.prompt_tokens_details.cached_tokens. build_messages()
+# lays the prompt out so that what questions share comes first: the system prompt, the
+# conversation so far, the context (in document order), and the question last.
+# PrefixTracker remembers hashes of the message prefixes sent in the last PROMPT_CACHE_TTL
+# seconds and reports, per prompt, how many leading tokens an earlier prompt already sent
+# and how many of those the service could have served from its cache, to compare with
+# cached_tokens. It only runs with TELEMETRY on.
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import telemetry
+from .tokens import count_tokens
+
+# Prefixes shorter than this are never cached; longer ones in steps of CACHE_INCREMENT
+MIN_CACHED_TOKENS = 1024
+CACHE_INCREMENT = 128
+# Tokens the service adds around each message for the role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+TOKEN_BUCKETS = (0, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+
+def cacheable(tokens):
+    # The part of a shared prefix the service can serve from its cache
+    if tokens < MIN_CACHED_TOKENS:
+        return 0
+    return MIN_CACHED_TOKENS + (tokens - MIN_CACHED_TOKENS) // CACHE_INCREMENT * CACHE_INCREMENT
+
+class PrefixTracker:
+    def __init__(self, ttl=None, max_prefixes=4096):
+        self.ttl = float(os.getenv("PROMPT_CACHE_TTL", 300)) if ttl is None else ttl
+        self.max_prefixes = max_prefixes
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"prompts": 0, "prompt_tokens": 0, "shared_tokens": 0, "cacheable_tokens": 0}
+
+    def record(self, messages):
+        # Returns the prompt's tokens, the leading tokens an earlier prompt already sent
+        # (whole messages only) and the cacheable part of those
+        now = time.monotonic()
+        digest = hashlib.sha256()
+        boundaries = []
+        tokens = 0
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message.get("content")]).encode("utf-8"))
+            tokens += count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+            boundaries.append((digest.copy().hexdigest(), tokens))
+
+        shared = 0
+        with self._lock:
+            while self._seen and next(iter(self._seen.values())) < now - self.ttl:
+                self._seen.popitem(last=False)
+            for key, prefix_tokens in boundaries:
+                if key not in self._seen:
+                    break
+                shared = prefix_tokens
+            for key, _ in boundaries:
+                self._seen[key] = now
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_prefixes:
+                self._seen.popitem(last=False)
+            result = {"prompt_tokens": tokens, "shared_tokens": shared, "cacheable_tokens": cacheable(shared)}
+            self.stats["prompts"] += 1
+            for name, value in result.items():
+                self.stats[name] += value
+        return result
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+def get_tracker():
+    global _tracker
+
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = PrefixTracker()
+    return _tracker
+
+def record(messages):
+    # Prefix reuse of a prompt about to be sent, as metrics and on the question's JSON line
+    if not telemetry.enabled():
+        return None
+    result = get_tracker().record(messages)
+    telemetry.observe("hrchatbot_prompt_shared_prefix_tokens", result["shared_tokens"], buckets=TOKEN_BUCKETS)
+    telemetry.increment("hrchatbot_prompt_cacheable_tokens_total", result["cacheable_tokens"])
+    telemetry.annotate(prefix_shared_tokens=result["shared_tokens"], prefix_cacheable_tokens=result["cacheable_tokens"])
+    return result
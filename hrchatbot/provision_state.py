@@ -0,0 +1,83 @@
+## Local record of what load_data_create_index() last provisioned
+# Each provisioning step stores a fingerprint of its desired configuration, so a launch
+# where nothing changed can skip the round trips to Blob Storage and Azure AI Search.
+import hashlib
+import json
+import os
+
+def state_path():
+    return os.getenv("PROVISION_STATE_PATH", os.path.join(".hrchatbot", "provision_state.json"))
+
+def load_state(path=None):
+    path = path or state_path()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+    state.setdefault("steps", {})
+    state.setdefault("files", {})
+    return state
+
+def save_state(state, path=None):
+    path = path or state_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def fingerprint(*parts):
+    # Azure SDK models are hashed through their REST serialization so any field change counts
+    def default(value):
+        if hasattr(value, "serialize"):
+            return value.serialize()
+        return str(value)
+    payload = json.dumps(parts, sort_keys=True, default=default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def file_md5(path, cache=None):
+    # cache maps a path to its last known size, mtime and digest so unchanged files are not re-read
+    stat = os.stat(path)
+    entry = cache.get(path) if cache is not None else None
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["md5"]
+
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    md5 = digest.hexdigest()
+    if cache is not None:
+        cache[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5}
+    return md5
+
+def documents_fingerprint(files, cache=None):
+    digests = sorted((os.path.basename(file), file_md5(file, cache)) for file in files)
+    if cache is not None:
+        for path in set(cache) - set(files):
+            del cache[path]
+    return fingerprint(digests)
+
+_index_version = (None, 0)
+
+def bump_index_version(state=None):
+    # Saves state (or the current state) with the next index version and returns that version
+    state = load_state() if state is None else state
+    state["index_version"] = state.get("index_version", 0) + 1
+    save_state(state)
+    return state["index_version"]
+
+def index_version():
+    # Bumped each time an indexer run finishes or the local index is rebuilt; re-read only
+    # when the state file changes
+    global _index_version
+
+    path = state_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+    if _index_version[0] != (path, mtime):
+        _index_version = ((path, mtime), load_state(path).get("index_version", 0))
+    return _index_version[1]
@@ -1,49 +1,86 @@
 ## Retrieve
-from azure.search.documents import SearchClient
-from azure.search.documents.models import VectorizableTextQuery
+# The Azure SDKs are imported where they are first used, so importing this module (and
+# showing the REPL prompt) does not wait for them; see startup.py
+import asyncio
+import itertools
+import logging
 import os
-from dotenv import load_dotenv
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents.models import (
-    QueryType,
-    QueryCaptionType,
-    QueryAnswerType
-)
-from openai import AzureOpenAI
-    
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from . import answer_cache, catalog, clients, context_packing, embeddings, index_profiles, local_index, prompt_prefix, telemetry
+from .telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+# Reranker scores run from 0 to 4
+RERANKER_BUCKETS = (0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0)
+CONTEXT_TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 8000)
+
+## Generation
+# The prompt is laid out for the prompt cache (see prompt_prefix.py): the fixed system prompt,
+# the conversation so far, the context, and the question as the only user message.
+# The prompt cache keys on the text that is sent, so it needs no version. PROMPT_VERSION is
+# only for the answer cache: bump it with any change to the instructions or the layout, so
+# answers cached under an older prompt are not served.
+PROMPT_VERSION = 2
+system_prompt = '''You are a helpful assistant that answers questions about the HR policies of an organization.
+Use only the context in the following system message to answer the user's question.'''
+context_template = '''Context:
+{context}'''
+prompt_template = f"v{PROMPT_VERSION}\n{system_prompt}\n{context_template}"
+
 _initialized = False
 
 def init():
-    global _initialized, endpoint, credential, index_name, client
-    
+    global _initialized, search_client, client
+
     if not _initialized:
-        load_dotenv()
-        endpoint = os.environ["AZURE_COGNITIVE_SEARCH_ENDPOINT"]
-        credential = AzureKeyCredential(os.getenv("AZURE_COGNITIVE_SEARCH_KEY")) if os.getenv("AZURE_COGNITIVE_SEARCH_KEY") else DefaultAzureCredential()
-        index_name = os.getenv("AZURE_SEARCH_INDEX_NAME", "int-vec")
-        
-        ## For Generation
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT") 
-        api_key=os.getenv("AZURE_OPENAI_KEY")
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION")
-        
-        client = AzureOpenAI(
-            azure_endpoint = azure_endpoint, 
-            api_key = api_key,  
-            api_version = api_version
-        )
-    
+        with stage("init"):
+            # Both clients are long-lived and pooled, so every question reuses warm connections
+            # The local backend answers searches from disk and needs no search client
+            with stage("search_client"):
+                search_client = None if local_index.local_backend() else clients.get_search_client()
+
+            ## For Generation
+            client = clients.get_openai_client()
+
         _initialized = True
-        
-def retrieval_generation(query):
-    
-    init()
-    
-    # Semantic Hybrid Search
-    search_client = SearchClient(endpoint, index_name, credential)
-    vector_query = VectorizableTextQuery(text=query, k_nearest_neighbors=1, fields="vector", exhaustive=True)
-    
-    results = search_client.search(  
+
+def search_kwargs(query, vector=None, semantic=True, parent_ids=None):
+    # Semantic Hybrid Search, or plain hybrid (keyword + vector) without the semantic ranker
+    # With a client-side embedding the search service does not need to call the vectorizer
+    # parent_ids limits both the keyword and the vector search to those documents' chunks
+    from azure.search.documents.models import (
+        QueryType,
+        QueryCaptionType,
+        QueryAnswerType,
+        VectorFilterMode,
+        VectorizableTextQuery,
+        VectorizedQuery
+    )
+
+    top = context_packing.top_k()
+    # Exhaustive queries skip the HNSW graph and the quantized vectors of INDEX_PROFILE
+    exhaustive = index_profiles.index_profile()["exhaustive"]
+    scope = {}
+    if parent_ids:
+        values = ",".join(parent_ids).replace("'", "''")
+        scope = dict(filter=f"search.in(parent_id, '{values}', ',')", vector_filter_mode=VectorFilterMode.PRE_FILTER)
+    if vector is not None:
+        vector_query = VectorizedQuery(vector=vector, k_nearest_neighbors=top, fields="vector", exhaustive=exhaustive)
+    else:
+        vector_query = VectorizableTextQuery(text=query, k_nearest_neighbors=top, fields="vector", exhaustive=exhaustive)
+
+    if not semantic:
+        return dict(
+            search_text=query,
+            vector_queries=[vector_query],
+            select=["parent_id", "chunk_id", "chunk"],
+            top=top,
+            **scope
+        )
+
+    return dict(
         search_text=query,
         vector_queries=[vector_query],
         select=["parent_id", "chunk_id", "chunk"],
@@ -51,60 +88,433 @@ def retrieval_generation(query):
         semantic_configuration_name='my-semantic-config',
         query_caption=QueryCaptionType.EXTRACTIVE,
         query_answer=QueryAnswerType.EXTRACTIVE,
-        top=1
-    )
-    
-    semantic_answers = results.get_answers()
-    #if semantic_answers:
-    #    for answer in semantic_answers:
-            #if answer.highlights:
-                #print(f"Semantic Answer: {answer.highlights}")
-            #else:
-                #print(f"Semantic Answer: {answer.text}")
-            #print(f"Semantic Answer Score: {answer.score}\n")
-    
-    context = []
-    for result in results:
-        context.append({
-            "parent_id": result['parent_id'],
-            "chunk_id": result['chunk_id'],
-            "reranker_score": result['@search.reranker_score'],
-            "content": result['chunk']
-        })
-    
-        captions = result["@search.captions"]
-        if captions:
-            caption = captions[0]
-            #if caption.highlights:
-                #print(f"Caption: {caption.highlights}\n")
-            #else:
-                #print(f"Caption: {caption.text}\n")
-    
-    
-    ## Generation
-    # Prompt template for injecting content and query
-    prompt_template = '''
-    You are a helpful assistant. Use the following context to answer the user's question.
-    
-    Context:
-    {context}
-    
-    Question:
-    {query}
-    
-    Answer:
-    '''
-    
-    # Format the prompt
-    prompt = prompt_template.format(context=context, query=query)
-    #print('Prompt used for completion:')
-    #print(prompt)
-    
-    message_text = [{"role":"system","content":prompt}]
-    
-    response = client.chat.completions.create(
-      model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
-      messages = message_text,
+        top=top,
+        **scope
     )
-    
-    return response.choices[0].message.content 
+
+def search_deadline():
+    # SEARCH_DEADLINE in seconds turns on hedged retrieval; unset or 0 sends the semantic query alone
+    return float(os.getenv("SEARCH_DEADLINE") or 0)
+
+def record_search_path(path):
+    telemetry.increment("hrchatbot_search_path_total", path=path)
+    telemetry.annotate(search_path=path)
+
+def answer_policy():
+    # ANSWER_POLICY=extractive answers with the top semantic answer, without a completion,
+    # when it is confident enough; generate (the default) always asks the model
+    return os.getenv("ANSWER_POLICY", "generate")
+
+def extractive_answer(answers, context, min_score=None, min_reranker=None):
+    # The top semantic answer and the search result it was extracted from, when the answer
+    # score (0-1) and that result's reranker score (0-4) clear SEMANTIC_ANSWER_MIN_SCORE and
+    # SEMANTIC_ANSWER_MIN_RERANKER; None otherwise
+    min_score = float(os.getenv("SEMANTIC_ANSWER_MIN_SCORE", 0.9)) if min_score is None else min_score
+    min_reranker = float(os.getenv("SEMANTIC_ANSWER_MIN_RERANKER", 3.0)) if min_reranker is None else min_reranker
+    if not answers:
+        return None
+    answer = max(answers, key=lambda answer: answer.score or 0)
+    source = next((item for item in context if item["chunk_id"] == answer.key), None)
+    if source is None or (answer.score or 0) < min_score or (source["reranker_score"] or 0) < min_reranker:
+        return None
+    return answer.text, source
+
+def short_circuit(answers, context):
+    # The extractive answer to return instead of generating one, if the policy allows it
+    if answer_policy() != "extractive":
+        return None
+    extracted = extractive_answer(answers, context)
+    telemetry.increment("hrchatbot_answers_total", source="extractive" if extracted else "generated")
+    if extracted is not None:
+        telemetry.annotate(answer_source="extractive", answer_parent_id=extracted[1]["parent_id"])
+        logger.debug("Extractive answer from %s: %s", extracted[1]["chunk_id"], extracted[0])
+    return extracted
+
+def context_item(result):
+    # Plain hybrid results have no captions and no reranker score
+    captions = result.get("@search.captions")
+    if captions:
+        caption = captions[0]
+        logger.debug("Caption: %s", caption.highlights or caption.text)
+    if result.get('@search.reranker_score') is not None:
+        telemetry.observe("hrchatbot_reranker_score", result['@search.reranker_score'], buckets=RERANKER_BUCKETS)
+
+    return {
+        "parent_id": result['parent_id'],
+        "chunk_id": result['chunk_id'],
+        "reranker_score": result.get('@search.reranker_score'),
+        "content": result['chunk']
+    }
+
+def build_messages(query, context, history=None):
+    # Format the prompt with the packed chunk text rather than the repr of the result dicts
+    packed, tokens = context_packing.pack_context(context)
+    telemetry.observe("hrchatbot_context_tokens", tokens, buckets=CONTEXT_TOKEN_BUCKETS)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *(history or []),
+        {"role": "system", "content": context_template.format(context=packed)},
+        {"role": "user", "content": query},
+    ]
+    logger.debug("Prompt used for completion:\n%s", messages)
+    prompt_prefix.record(messages)
+
+    return messages
+
+def completion_tokens(chunks):
+    for chunk in chunks:
+        # Only sent when stream_options asks for it, on a final chunk without choices
+        if getattr(chunk, "usage", None) is not None:
+            telemetry.record_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+class AnswerStream:
+    # Yields answer tokens as the chat completion streams them and records
+    # time to first token and total time, both measured from when the question was asked
+    def __init__(self, tokens, start, on_complete=None):
+        self._tokens = tokens
+        self._start = start
+        self._on_complete = on_complete
+        self._parts = []
+        # parent_id of the document an extractive answer was taken from
+        self.source = None
+        self.time_to_first_token = None
+        self.total_time = None
+
+    def __iter__(self):
+        for token in self._tokens:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self._start
+            self._parts.append(token)
+            yield token
+        self.total_time = time.perf_counter() - self._start
+        if self.time_to_first_token is not None:
+            telemetry.observe("hrchatbot_time_to_first_token_seconds", self.time_to_first_token)
+        telemetry.observe("hrchatbot_answer_seconds", self.total_time)
+        if self._on_complete is not None:
+            self._on_complete(self.text, self.total_time)
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+def retrieve(query):
+    return retrieve_with_answers(query)[0]
+
+def retrieve_with_answers(query):
+    # The search results and the semantic answers that came with them (none from the local
+    # backend or a plain hybrid query)
+
+    init()
+
+    # Questions that name a policy document only search that document's chunks
+    with stage("route"):
+        parent_ids = catalog.route(query)
+    context, answers = _retrieve(query, parent_ids)
+    if parent_ids and not context:
+        # The catalog is behind the index; search every document instead
+        telemetry.increment("hrchatbot_routed_queries_total", routed="fallback")
+        context, answers = _retrieve(query, None)
+    return context, answers
+
+def _retrieve(query, parent_ids):
+    if local_index.local_backend():
+        # There is no vectorizer behind the local index, so the question is always embedded here
+        index = local_index.get_local_index()
+        with stage("embedding"):
+            vector = embeddings.embed_query(query) if index.vectors is not None else None
+        with stage("search"):
+            return index.search(query, vector, top=context_packing.top_k(), parent_ids=parent_ids), []
+
+    with stage("embedding"):
+        vector = embeddings.embed_query(query) if embeddings.client_side_embedding() else None
+
+    if search_deadline():
+        with stage("search"):
+            return hedged_search(query, vector, search_deadline(), parent_ids)
+
+    # Fetch the first page explicitly and read the answers from it: calling get_answers()
+    # on the item iterator before iterating it makes the SDK send the search request twice
+    with stage("search"):
+        pages = search_client.search(**search_kwargs(query, vector, parent_ids=parent_ids)).by_page()
+        first_page = next(pages)
+        semantic_answers = pages.get_answers()
+    for answer in semantic_answers or []:
+        logger.debug("Semantic Answer: %s (score %s)", answer.highlights or answer.text, answer.score)
+
+    with stage("result_iteration"):
+        return [context_item(result) for page in itertools.chain([first_page], pages) for result in page], semantic_answers or []
+
+def run_search(kwargs):
+    # One search request read to the end, for the hedged paths
+    pages = search_client.search(**kwargs).by_page()
+    first_page = next(pages)
+    semantic_answers = pages.get_answers() or []
+    for answer in semantic_answers:
+        logger.debug("Semantic Answer: %s (score %s)", answer.highlights or answer.text, answer.score)
+    return [context_item(result) for page in itertools.chain([first_page], pages) for result in page], semantic_answers
+
+_hedge_executor = None
+
+def hedged_search(query, vector, deadline, parent_ids=None):
+    # Sends the semantic hybrid query and a plain hybrid query together. The semantic result
+    # is used if it arrives within the deadline, otherwise whichever finishes first after it;
+    # a late semantic query is left to finish in the background and its result dropped.
+    global _hedge_executor
+
+    if _hedge_executor is None:
+        _hedge_executor = ThreadPoolExecutor(max_workers=clients.settings()["pool_size"], thread_name_prefix="hedged-search")
+    semantic = _hedge_executor.submit(run_search, search_kwargs(query, vector, parent_ids=parent_ids))
+    plain = _hedge_executor.submit(run_search, search_kwargs(query, vector, semantic=False, parent_ids=parent_ids))
+
+    done, _ = wait([semantic], timeout=deadline)
+    if semantic in done and semantic.exception() is None:
+        record_search_path("semantic")
+        return semantic.result()
+    done, _ = wait([semantic, plain], return_when=FIRST_COMPLETED)
+    for path, future in (("plain", plain), ("semantic", semantic)):
+        if future in done and future.exception() is None:
+            record_search_path(path)
+            return future.result()
+    # The first one to finish failed, so the answer rests on the other
+    other = semantic if plain in done else plain
+    record_search_path("semantic" if other is semantic else "plain")
+    return other.result()
+
+def retrieval_generation(query):
+    return answer_with_context(query)[0]
+
+def answer_with_context(query):
+    # Returns the answer and the search results it was generated from (None for a cached answer)
+    with telemetry.question(query):
+        return _answer_with_context(query)
+
+def _answer_with_context(query):
+
+    # A cached answer skips both the search and the completion
+    start = time.perf_counter()
+    cache = answer_cache.get_answer_cache()
+    if cache is not None:
+        cached = cache.lookup(query, prompt_template)
+        if cached is not None:
+            return cached, None
+
+    context, answers = retrieve_with_answers(query)
+
+    # A confident extractive answer is returned with the one result it came from
+    extracted = short_circuit(answers, context)
+    if extracted is not None:
+        return extracted[0], [extracted[1]]
+
+    with stage("prompt"):
+        message_text = build_messages(query, context)
+
+    with stage("completion"):
+        response = client.chat.completions.create(
+          model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
+          messages = message_text,
+        )
+    telemetry.record_usage(response.usage)
+
+    answer = response.choices[0].message.content
+    if cache is not None:
+        cache.store(query, prompt_template, answer, time.perf_counter() - start)
+    return answer, context
+
+def retrieval_generation_stream(query, conversation=None):
+    # The question scope ends once the stream is open; AnswerStream records the token timings
+    with telemetry.question(query, kind="stream"):
+        return _retrieval_generation_stream(query, conversation)
+
+def _retrieval_generation_stream(query, conversation=None):
+    # Streaming variant: search runs up front, then tokens are yielded as they arrive
+    # With a conversation that has history the answer depends on it, so the cache is skipped
+    start = time.perf_counter()
+    history = conversation is not None and conversation.has_history()
+    cache = answer_cache.get_answer_cache() if not history else None
+    if cache is not None:
+        cached = cache.lookup(query, prompt_template)
+        if cached is not None:
+            on_complete = (lambda answer, latency: conversation.add_turn(query, answer)) if conversation is not None else None
+            return AnswerStream([cached], start, on_complete)
+
+    search_query = query
+    if history:
+        with stage("rewrite"):
+            search_query = conversation.standalone_query(query)
+
+    context, answers = retrieve_with_answers(search_query)
+
+    extracted = short_circuit(answers, context)
+    if extracted is not None:
+        on_complete = (lambda answer, latency: conversation.add_turn(query, answer)) if conversation is not None else None
+        stream = AnswerStream([extracted[0]], start, on_complete)
+        stream.source = extracted[1]["parent_id"]
+        return stream
+
+    with stage("prompt"):
+        message_text = build_messages(query, context, conversation.history_messages() if history else None)
+
+    # Only covers opening the stream; the tokens are timed by AnswerStream
+    with stage("completion"):
+        chunks = client.chat.completions.create(
+          model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
+          messages = message_text,
+          stream=True,
+          # Token usage arrives on an extra final chunk, so it is only requested when it is recorded
+          **({"stream_options": {"include_usage": True}} if telemetry.enabled() else {}),
+        )
+
+    def on_complete(answer, latency):
+        if cache is not None:
+            cache.store(query, prompt_template, answer, latency)
+        if conversation is not None:
+            conversation.add_turn(query, answer)
+    return AnswerStream(completion_tokens(chunks), start, on_complete)
+
+async def aretrieve(query):
+    return (await aretrieve_with_answers(query))[0]
+
+async def aretrieve_with_answers(query):
+    # retrieve_with_answers() on the aio clients
+    with stage("route"):
+        parent_ids = catalog.route(query)
+    context, answers = await _aretrieve(query, parent_ids)
+    if parent_ids and not context:
+        telemetry.increment("hrchatbot_routed_queries_total", routed="fallback")
+        context, answers = await _aretrieve(query, None)
+    return context, answers
+
+async def _aretrieve(query, parent_ids):
+    if local_index.local_backend():
+        index = local_index.get_local_index()
+        with stage("embedding"):
+            vector = await embeddings.aembed_query(query) if index.vectors is not None else None
+        with stage("search"):
+            return await asyncio.to_thread(index.search, query, vector, context_packing.top_k(), parent_ids=parent_ids), []
+
+    with stage("embedding"):
+        vector = await embeddings.aembed_query(query) if embeddings.client_side_embedding() else None
+
+    if search_deadline():
+        with stage("search"):
+            return await ahedged_search(query, vector, search_deadline(), parent_ids)
+
+    with stage("search"):
+        results = await clients.get_async_search_client().search(**search_kwargs(query, vector, parent_ids=parent_ids))
+        pages = results.by_page()
+        first_page = await pages.__anext__()
+        semantic_answers = await pages.get_answers()
+    for answer in semantic_answers or []:
+        logger.debug("Semantic Answer: %s (score %s)", answer.highlights or answer.text, answer.score)
+
+    with stage("result_iteration"):
+        context = [context_item(result) async for result in first_page]
+        context += [context_item(result) async for page in pages async for result in page]
+    return context, semantic_answers or []
+
+async def arun_search(kwargs):
+    results = await clients.get_async_search_client().search(**kwargs)
+    pages = results.by_page()
+    first_page = await pages.__anext__()
+    semantic_answers = await pages.get_answers() or []
+    for answer in semantic_answers:
+        logger.debug("Semantic Answer: %s (score %s)", answer.highlights or answer.text, answer.score)
+    context = [context_item(result) async for result in first_page]
+    context += [context_item(result) async for page in pages async for result in page]
+    return context, semantic_answers
+
+async def ahedged_search(query, vector, deadline, parent_ids=None):
+    # hedged_search() on the aio client; the losing request is cancelled instead of left running
+    semantic = asyncio.ensure_future(arun_search(search_kwargs(query, vector, parent_ids=parent_ids)))
+    plain = asyncio.ensure_future(arun_search(search_kwargs(query, vector, semantic=False, parent_ids=parent_ids)))
+    try:
+        done, _ = await asyncio.wait([semantic], timeout=deadline)
+        if semantic in done and semantic.exception() is None:
+            record_search_path("semantic")
+            return semantic.result()
+        done, _ = await asyncio.wait([semantic, plain], return_when=asyncio.FIRST_COMPLETED)
+        for path, task in (("plain", plain), ("semantic", semantic)):
+            if task in done and task.exception() is None:
+                record_search_path(path)
+                return task.result()
+        other = semantic if plain in done else plain
+        record_search_path("semantic" if other is semantic else "plain")
+        return await other
+    finally:
+        for task in (semantic, plain):
+            task.cancel()
+
+async def aretrieval_generation(query):
+    with telemetry.question(query):
+        return await _aretrieval_generation(query)
+
+async def _aretrieval_generation(query):
+    # Same pipeline on the aio clients, so one process can keep many questions in flight
+    start = time.perf_counter()
+    cache = answer_cache.get_answer_cache()
+    if cache is not None:
+        cached = cache.lookup(query, prompt_template)
+        if cached is not None:
+            return cached
+
+    context, answers = await aretrieve_with_answers(query)
+
+    extracted = short_circuit(answers, context)
+    if extracted is not None:
+        return extracted[0]
+
+    with stage("prompt"):
+        message_text = build_messages(query, context)
+
+    with stage("completion"):
+        response = await clients.get_async_openai_client().chat.completions.create(
+          model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
+          messages = message_text,
+        )
+    telemetry.record_usage(response.usage)
+
+    answer = response.choices[0].message.content
+    if cache is not None:
+        cache.store(query, prompt_template, answer, time.perf_counter() - start)
+    return answer
+
+async def aretrieval_generation_stream(query):
+    # Async generator of answer tokens, used by the HTTP server
+    start = time.perf_counter()
+    cache = answer_cache.get_answer_cache()
+    if cache is not None:
+        cached = cache.lookup(query, prompt_template)
+        if cached is not None:
+            yield cached
+            return
+
+    context, answers = await aretrieve_with_answers(query)
+
+    extracted = short_circuit(answers, context)
+    if extracted is not None:
+        yield extracted[0]
+        return
+
+    with stage("prompt"):
+        message_text = build_messages(query, context)
+
+    with stage("completion"):
+        chunks = await clients.get_async_openai_client().chat.completions.create(
+          model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
+          messages = message_text,
+          stream=True,
+          **({"stream_options": {"include_usage": True}} if telemetry.enabled() else {}),
+        )
+
+    parts = []
+    async for chunk in chunks:
+        if getattr(chunk, "usage", None) is not None:
+            telemetry.record_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+
+    if cache is not None:
+        cache.store(query, prompt_template, "".join(parts), time.perf_counter() - start)
@@ -0,0 +1,315 @@
+## Quota-aware scheduling of Azure OpenAI calls
+# Every chat and embeddings request goes through an httpx transport that admits it through
+# the deployment's token buckets before it is sent. The token cost is estimated from the
+# request body (prompt text plus max_tokens, or the embedding inputs) and corrected with
+# response.usage afterwards. A 429 pauses the whole deployment for its Retry-After and the
+# request is retried here, so SDK retries do not pile up on a throttled deployment.
+# Waiting requests are admitted by priority class: INTERACTIVE (the default) before BATCH;
+# wrap batch work in `with scheduler.priority(scheduler.BATCH):`.
+# CHAT_TPM / CHAT_RPM and EMBEDDING_TPM / EMBEDDING_RPM set the quotas (unset: unlimited);
+# SCHEDULER_BURST_SECONDS is how much of the quota may be spent at once (default 10s).
+# Set OPENAI_SCHEDULER=off to send requests straight through.
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+from . import telemetry
+from .tokens import count_tokens
+
+INTERACTIVE = 0
+BATCH = 1
+
+_priority = contextvars.ContextVar("hrchatbot_priority", default=INTERACTIVE)
+_retries = contextvars.ContextVar("hrchatbot_retries", default=None)
+
+@contextlib.contextmanager
+def priority(value):
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+@contextlib.contextmanager
+def count_retries():
+    # Counts the 429s the transport retried for requests sent inside the block
+    counter = {"retries": 0}
+    token = _retries.set(counter)
+    try:
+        yield counter
+    finally:
+        _retries.reset(token)
+
+def _retried():
+    counter = _retries.get()
+    if counter is not None:
+        counter["retries"] += 1
+
+def retry_after(error, attempt, base_delay=1.0, max_delay=60.0):
+    # Honour the service's Retry-After when it sends one, otherwise back off exponentially with jitter
+    response = getattr(error, "response", error)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+class TokenBucket:
+    # Refills continuously at rate per second up to capacity; a rate of 0 means unlimited
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until amount is available (amounts above capacity only need a full bucket)
+        if not self.rate:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        if self.rate:
+            self.level = min(self.capacity, self.level + amount)
+
+class Scheduler:
+    def __init__(self, name, tokens_per_minute=0, requests_per_minute=0, burst_seconds=10.0):
+        self.name = name
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60 * burst_seconds)
+        self.requests = TokenBucket(requests_per_minute / 60, max(requests_per_minute / 60 * burst_seconds, 1))
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self.stats = {"admitted": 0, "throttled": 0, "waited_seconds": 0.0}
+
+    def _try_admit(self, ticket, cost):
+        # Returns 0 when the request was admitted, otherwise how long to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            if self._waiting[0] != ticket:
+                return 0.005
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens.refill(now)
+            self.requests.refill(now)
+            wait = max(self.tokens.wait_time(cost), self.requests.wait_time(1))
+            if wait > 0:
+                return wait
+            self.tokens.take(cost)
+            self.requests.take(1)
+            heapq.heappop(self._waiting)
+            self.stats["admitted"] += 1
+            return 0.0
+
+    def _admit_unlimited(self):
+        # Without a quota there is nothing to queue for, unless a 429 paused the deployment
+        if self.tokens.rate or self.requests.rate or time.monotonic() < self.paused_until:
+            return False
+        with self._lock:
+            self.stats["admitted"] += 1
+        return True
+
+    def _enqueue(self):
+        ticket = (_priority.get(), next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _dequeue(self, ticket):
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+
+    def acquire(self, cost):
+        if self._admit_unlimited():
+            return
+        ticket = self._enqueue()
+        start = time.monotonic()
+        try:
+            while True:
+                wait = self._try_admit(ticket, cost)
+                if not wait:
+                    break
+                time.sleep(min(wait, 0.05))
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+        self._waited(time.monotonic() - start)
+
+    async def aacquire(self, cost):
+        if self._admit_unlimited():
+            return
+        ticket = self._enqueue()
+        start = time.monotonic()
+        try:
+            while True:
+                wait = self._try_admit(ticket, cost)
+                if not wait:
+                    break
+                await asyncio.sleep(min(wait, 0.05))
+        except BaseException:
+            self._dequeue(ticket)
+            raise
+        self._waited(time.monotonic() - start)
+
+    def _waited(self, seconds):
+        with self._lock:
+            self.stats["waited_seconds"] += seconds
+        telemetry.observe("hrchatbot_scheduler_wait_seconds", seconds, deployment=self.name)
+
+    def settle(self, estimate, actual):
+        # Gives back what the estimate overcharged, or takes what it missed
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            if actual < estimate:
+                self.tokens.give(estimate - actual)
+            else:
+                self.tokens.take(actual - estimate)
+
+    def throttled(self, seconds):
+        # A 429 means the service's view of the quota is ahead of ours: stop everyone
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.stats["throttled"] += 1
+        telemetry.increment("hrchatbot_openai_throttled_total", deployment=self.name)
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(kind):
+    # kind is "chat" or "embeddings"; each deployment has its own quota
+    if kind not in _schedulers:
+        with _schedulers_lock:
+            if kind not in _schedulers:
+                prefix = "CHAT" if kind == "chat" else "EMBEDDING"
+                _schedulers[kind] = Scheduler(kind, float(os.getenv(f"{prefix}_TPM") or 0), float(os.getenv(f"{prefix}_RPM") or 0),
+                                              float(os.getenv("SCHEDULER_BURST_SECONDS", 10)))
+    return _schedulers[kind]
+
+def reset():
+    with _schedulers_lock:
+        _schedulers.clear()
+
+def enabled():
+    return os.getenv("OPENAI_SCHEDULER", "on") != "off"
+
+def request_kind(request):
+    path = request.url.path
+    if path.endswith("/chat/completions"):
+        return "chat"
+    if path.endswith("/embeddings"):
+        return "embeddings"
+    return None
+
+def estimate_tokens(kind, body):
+    # Azure counts max_tokens against the TPM quota when the request is admitted
+    if kind == "embeddings":
+        inputs = body.get("input") or []
+        return sum(count_tokens(text) for text in ([inputs] if isinstance(inputs, str) else inputs) if isinstance(text, str))
+    prompt = sum(count_tokens(message["content"]) for message in body.get("messages", []) if isinstance(message.get("content"), str))
+    completion = body.get("max_tokens") or body.get("max_completion_tokens") or int(os.getenv("COMPLETION_TOKEN_ESTIMATE", 500))
+    return prompt + completion
+
+def _usage_tokens(response):
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        usage = json.loads(response.content).get("usage") or {}
+    except ValueError:
+        return None
+    return usage.get("total_tokens")
+
+def _transports():
+    import httpx
+
+    class ScheduledTransport(httpx.BaseTransport):
+        def __init__(self, transport, max_retries=8):
+            self.transport = transport
+            self.max_retries = max_retries
+
+        def handle_request(self, request):
+            kind = request_kind(request)
+            if kind is None or not enabled():
+                return self.transport.handle_request(request)
+            scheduler = get_scheduler(kind)
+            body = json.loads(request.read() or b"{}")
+            estimate = estimate_tokens(kind, body)
+            for attempt in range(self.max_retries + 1):
+                scheduler.acquire(estimate)
+                response = self.transport.handle_request(request)
+                if response.status_code != 429 or attempt == self.max_retries:
+                    break
+                response.read()
+                response.close()
+                scheduler.throttled(retry_after(response, attempt))
+                _retried()
+            # A streamed completion is handed over unread; only its estimate is charged
+            if response.status_code == 200 and not body.get("stream"):
+                response.read()
+                actual = _usage_tokens(response)
+                if actual is not None:
+                    scheduler.settle(estimate, actual)
+            return response
+
+        def close(self):
+            self.transport.close()
+
+    class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+        def __init__(self, transport, max_retries=8):
+            self.transport = transport
+            self.max_retries = max_retries
+
+        async def handle_async_request(self, request):
+            kind = request_kind(request)
+            if kind is None or not enabled():
+                return await self.transport.handle_async_request(request)
+            scheduler = get_scheduler(kind)
+            body = json.loads(await request.aread() or b"{}")
+            estimate = estimate_tokens(kind, body)
+            for attempt in range(self.max_retries + 1):
+                await scheduler.aacquire(estimate)
+                response = await self.transport.handle_async_request(request)
+                if response.status_code != 429 or attempt == self.max_retries:
+                    break
+                await response.aread()
+                await response.aclose()
+                scheduler.throttled(retry_after(response, attempt))
+                _retried()
+            if response.status_code == 200 and not body.get("stream"):
+                await response.aread()
+                actual = _usage_tokens(response)
+                if actual is not None:
+                    scheduler.settle(estimate, actual)
+            return response
+
+        async def aclose(self):
+            await self.transport.aclose()
+
+    return ScheduledTransport, AsyncScheduledTransport
+
+def scheduled_transport(transport, aio=False):
+    ScheduledTransport, AsyncScheduledTransport = _transports()
+    return AsyncScheduledTransport(transport) if aio else ScheduledTransport(transport)
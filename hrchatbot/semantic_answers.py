@@ -0,0 +1,108 @@
+## Offline evaluation of extractive answers
+# With ANSWER_POLICY=extractive a question whose top semantic answer is confident enough is
+# answered with that passage, without a chat completion. This runs a question set through
+# retrieval and generation both ways and reports, for each pair of thresholds, how many
+# questions would skip the model, how much latency that saves, and how well the extracted
+# passages agree with the generated answers (token F1), so the thresholds can be set from
+# data before the policy is turned on.
+# python -m hrchatbot.semantic_answers questions.txt [--output eval.jsonl] [--workers 8]
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .batch import read_questions
+
+# (SEMANTIC_ANSWER_MIN_SCORE, SEMANTIC_ANSWER_MIN_RERANKER) pairs to report on
+THRESHOLDS = [(0.7, 2.0), (0.8, 2.5), (0.9, 2.5), (0.9, 3.0), (0.95, 3.0), (0.95, 3.5)]
+
+def _words(text):
+    return re.findall(r"\w+", (text or "").lower())
+
+def token_f1(candidate, reference):
+    candidate, reference = _words(candidate), _words(reference)
+    common = sum((Counter(candidate) & Counter(reference)).values())
+    if not common:
+        return 0.0
+    precision, recall = common / len(candidate), common / len(reference)
+    return 2 * precision * recall / (precision + recall)
+
+def evaluate_one(item):
+    from . import retrieval_generation as rg
+
+    result = {"id": item["id"], "question": item["question"]}
+    try:
+        start = time.perf_counter()
+        context, answers = rg.retrieve_with_answers(item["question"])
+        result["retrieval_seconds"] = round(time.perf_counter() - start, 4)
+
+        completion_start = time.perf_counter()
+        response = rg.client.chat.completions.create(
+          model=os.getenv("CHAT_COMPLETION_NAME"), # model = "deployment_name"
+          messages = rg.build_messages(item["question"], context),
+        )
+        result["completion_seconds"] = round(time.perf_counter() - completion_start, 4)
+        result["generated"] = response.choices[0].message.content
+
+        # Every candidate is kept with its scores; the thresholds are applied in summarize()
+        best = rg.extractive_answer(answers, context, min_score=0.0, min_reranker=0.0)
+        if best is not None:
+            text, source = best
+            answer = max(answers, key=lambda answer: answer.score or 0)
+            result["extractive"] = text
+            result["answer_score"] = answer.score
+            result["reranker_score"] = source["reranker_score"]
+            result["agreement"] = round(token_f1(text, result["generated"]), 4)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    return result
+
+def summarize(results, thresholds=THRESHOLDS):
+    answered = [result for result in results if "error" not in result]
+    rows = []
+    for min_score, min_reranker in thresholds:
+        selected = [result for result in answered if "extractive" in result
+                    and result["answer_score"] >= min_score and (result["reranker_score"] or 0) >= min_reranker]
+        rows.append({
+            "min_score": min_score,
+            "min_reranker": min_reranker,
+            "short_circuit_rate": round(len(selected) / len(answered), 4) if answered else 0,
+            "completion_seconds_saved": round(sum(result["completion_seconds"] for result in selected), 3),
+            "mean_agreement": round(sum(result["agreement"] for result in selected) / len(selected), 4) if selected else None,
+            "min_agreement": min((result["agreement"] for result in selected), default=None),
+        })
+    return {
+        "questions": len(results),
+        "failed": len(results) - len(answered),
+        "with_semantic_answer": sum("extractive" in result for result in answered),
+        "mean_completion_seconds": round(sum(result["completion_seconds"] for result in answered) / len(answered), 4) if answered else None,
+        "thresholds": rows,
+    }
+
+def evaluate(questions, output=None, workers=8):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(evaluate_one, questions))
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return summarize(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.semantic_answers")
+    parser.add_argument("input", nargs="?", default="-", help="questions file, or - for stdin")
+    parser.add_argument("--output", help="write each question's answers and scores as JSONL")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.input == "-":
+        questions = read_questions(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            questions = read_questions(f)
+
+    print(json.dumps(evaluate(questions, args.output, args.workers), indent=2))
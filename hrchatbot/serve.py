@@ -0,0 +1,262 @@
+## HTTP serving mode
+# Serves many users from one process on asyncio and the aio clients:
+#   POST /ask          {"question": "..."} -> {"answer": "..."}
+#   POST /ask/stream   same body, answer tokens as server-sent events
+#   GET  /healthz      readiness and in-flight counts
+#   GET  /metrics      Prometheus text (with TELEMETRY=metrics)
+# Provisioning and init() run once at boot. At most SERVE_CONCURRENCY questions run the
+# pipeline at a time and at most SERVE_QUEUE more may wait; beyond that the server answers
+# 503 with Retry-After instead of queueing without bound. Identical questions (after
+# normalization) that arrive while one is being answered share its search and completion.
+# python -m hrchatbot.serve [--host 127.0.0.1] [--port 8000] [--skip-provisioning]
+import argparse
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import parse_qs, urlsplit
+
+from . import answer_cache, clients, local_index, telemetry
+from . import retrieval_generation as rg
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 64 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Content Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class BadRequest(Exception):
+    # A request that cannot be read; answered with this status and the connection closed
+    def __init__(self, status, error):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+class Flight:
+    # One pipeline run whose tokens are replayed to every request asking the same question
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def push(self, token):
+        self.tokens.append(token)
+        self._changed.set()
+
+    def finish(self, error=None):
+        self.error = error
+        self.done = True
+        self._changed.set()
+
+    async def stream(self):
+        sent = 0
+        while True:
+            while sent < len(self.tokens):
+                sent += 1
+                yield self.tokens[sent - 1]
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def answer(self):
+        return "".join([token async for token in self.stream()])
+
+class AnswerServer:
+    def __init__(self, concurrency=16, queue=64):
+        self.concurrency = concurrency
+        self.queue = queue
+        self._semaphore = None
+        self._flights = {}
+        self.stats = {"requests": 0, "pipelines": 0, "coalesced": 0, "rejected": 0, "errors": 0}
+
+    async def warm_up(self):
+        # Clients and the first connections are set up before the first question arrives
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        rg.init()
+        clients.get_async_openai_client()
+        if not local_index.local_backend():
+            clients.get_async_search_client()
+
+    def in_flight(self):
+        return len(self._flights)
+
+    def flight(self, question):
+        # Joins the pending run for this question or starts one; None when the server is full
+        key = answer_cache.normalize_question(question)
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            telemetry.increment("hrchatbot_serve_coalesced_total")
+            return flight
+        if len(self._flights) >= self.concurrency + self.queue:
+            self.stats["rejected"] += 1
+            telemetry.increment("hrchatbot_serve_rejected_total")
+            return None
+        flight = self._flights[key] = Flight()
+        asyncio.ensure_future(self._run(key, question, flight))
+        return flight
+
+    async def _run(self, key, question, flight):
+        try:
+            async with self._semaphore:
+                self.stats["pipelines"] += 1
+                # One JSON line and one hrchatbot_question_seconds sample per pipeline run
+                with telemetry.question(question, kind="serve"):
+                    async for token in rg.aretrieval_generation_stream(question):
+                        flight.push(token)
+            flight.finish()
+        except Exception as error:
+            self.stats["errors"] += 1
+            logger.exception("Failed to answer a question")
+            flight.finish(error)
+        finally:
+            self._flights.pop(key, None)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._dispatch(writer, method, target, body, keep_alive)
+                if not keep_alive:
+                    break
+        except BadRequest as error:
+            try:
+                await self._send_json(writer, error.status, {"error": error.error}, False)
+            except ConnectionError:
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise BadRequest(400, "malformed request line")
+        method, target, _ = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise BadRequest(400, "invalid Content-Length") from None
+        if length < 0:
+            raise BadRequest(400, "invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise BadRequest(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    async def _dispatch(self, writer, method, target, body, keep_alive):
+        url = urlsplit(target)
+        self.stats["requests"] += 1
+        if url.path == "/healthz":
+            return await self._send_json(writer, 200, {"status": "ok", "in_flight": self.in_flight(), **self.stats}, keep_alive)
+        if url.path == "/metrics":
+            return await self._send(writer, 200, telemetry.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4", keep_alive)
+        if url.path not in ("/ask", "/ask/stream"):
+            return await self._send_json(writer, 404, {"error": "not found"}, keep_alive)
+
+        question = None
+        if method == "POST":
+            try:
+                question = json.loads(body or b"{}").get("question")
+            except (ValueError, AttributeError):
+                pass
+        elif method == "GET":
+            question = (parse_qs(url.query).get("question") or [None])[0]
+        else:
+            return await self._send_json(writer, 405, {"error": "use GET or POST"}, keep_alive)
+        if not isinstance(question, str) or not question.strip():
+            return await self._send_json(writer, 400, {"error": "question is required"}, keep_alive)
+
+        flight = self.flight(question)
+        if flight is None:
+            return await self._send_json(writer, 503, {"error": "too many questions in flight"}, keep_alive, {"Retry-After": "1"})
+
+        if url.path == "/ask":
+            try:
+                answer = await flight.answer()
+            except Exception:
+                return await self._send_json(writer, 500, {"error": "failed to answer the question"}, keep_alive)
+            return await self._send_json(writer, 200, {"answer": answer}, keep_alive)
+        await self._send_events(writer, flight, keep_alive)
+
+    def _head(self, status, content_type, keep_alive, headers=None):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        return ("\r\n".join(lines) + "\r\n").encode("latin-1")
+
+    async def _send(self, writer, status, data, content_type, keep_alive, headers=None):
+        writer.write(self._head(status, content_type, keep_alive, headers) + f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, keep_alive, headers=None):
+        await self._send(writer, status, json.dumps(payload).encode("utf-8"), "application/json", keep_alive, headers)
+
+    async def _send_events(self, writer, flight, keep_alive):
+        # drain() after every event is the backpressure: a slow client only holds up its own copy
+        writer.write(self._head(200, "text/event-stream", keep_alive) + b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        async def event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            await writer.drain()
+
+        try:
+            async for token in flight.stream():
+                await event(json.dumps({"token": token}))
+            await event("[DONE]")
+        except ConnectionError:
+            raise
+        except Exception:
+            await event(json.dumps({"error": "failed to answer the question"}))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+async def serve(host="127.0.0.1", port=8000, concurrency=16, queue=64, provision=True, ready=None):
+    # ready, when given, is called with the listening asyncio server once it accepts connections
+    if provision:
+        from .load_data_create_index import load_data_create_index
+        await asyncio.to_thread(load_data_create_index)
+    app = AnswerServer(concurrency, queue)
+    await app.warm_up()
+    server = await asyncio.start_server(app.handle, host, port, backlog=1024)
+    server.app = app
+    logger.info("Serving on http://%s:%s", host, server.sockets[0].getsockname()[1])
+    if ready is not None:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await clients.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.serve")
+    parser.add_argument("--host", default=os.getenv("SERVE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVE_PORT", 8000)))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("SERVE_CONCURRENCY", 16)))
+    parser.add_argument("--queue", type=int, default=int(os.getenv("SERVE_QUEUE", 64)))
+    parser.add_argument("--skip-provisioning", action="store_true", help="do not run load_data_create_index() at boot")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(serve(args.host, args.port, args.concurrency, args.queue, not args.skip_provisioning))
@@ -0,0 +1,217 @@
+## Index snapshots for fast warm starts
+# export_index() pages through every document of the search index in key order (keyset
+# paging on chunk_id, so the 100,000 $skip limit does not apply) and writes one .npz file:
+# each vector field as a contiguous float32 matrix, each other field as UTF-8 bytes plus
+# row offsets, and the index definition. import_index() creates a fresh index from that
+# definition and uploads the documents in parallel batches, so a new environment comes up
+# without the blob upload, the indexer run or any re-embedding.
+# python -m hrchatbot.snapshot export snapshot.npz [--index NAME]
+# python -m hrchatbot.snapshot import snapshot.npz [--index NAME] [--batch-size 500] [--workers 8]
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Bump when the file layout changes
+SNAPSHOT_VERSION = 1
+VECTOR_TYPES = ("Collection(Edm.Single)", "Collection(Edm.Half)")
+
+def _search_client(s, index_name):
+    # Its own client: the index is usually not the one the chatbot queries
+    from azure.search.documents import SearchClient
+    from .clients import search_credential, search_transport
+
+    return SearchClient(s["endpoint"], index_name, search_credential(s), transport=search_transport(s))
+
+def _index_client(s):
+    from azure.search.documents.indexes import SearchIndexClient
+    from .clients import search_credential, transport_options
+
+    return SearchIndexClient(s["endpoint"], search_credential(s), **transport_options(s))
+
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def iterate_documents(search_client, key, select, page_size=1000):
+    # Yields pages of documents ordered by key; each page starts after the last key seen
+    last = None
+    while True:
+        results = search_client.search(
+            search_text="*",
+            filter=f"{key} gt {_quote(last)}" if last is not None else None,
+            order_by=[f"{key} asc"],
+            select=select,
+            top=page_size,
+        )
+        page = [{field: result.get(field) for field in select} for result in results]
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last = page[-1][key]
+
+def _pack_strings(values):
+    import numpy as np
+
+    encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, np.array([value is None for value in values], dtype=bool)
+
+def _unpack_string(data, offsets, row):
+    return bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+def export_index(path, index_name=None, page_size=1000, index_client=None):
+    import numpy as np
+    from .clients import settings
+
+    start = time.perf_counter()
+    s = settings()
+    index_name = index_name or s["index_name"]
+    definition = (index_client or _index_client(s)).get_index(index_name).serialize()
+    for name in ("@odata.context", "@odata.etag"):
+        definition.pop(name, None)
+
+    fields = []
+    for field in definition["fields"]:
+        if field.get("fields"):
+            raise Exception(f"Complex field '{field['name']}' is not supported in snapshots")
+        if field.get("retrievable") is False or field.get("stored") is False:
+            if field["type"] in VECTOR_TYPES:
+                raise Exception(f"Vector field '{field['name']}' is not retrievable, the snapshot could not be restored without re-embedding")
+            continue
+        fields.append({"name": field["name"], "type": field["type"], "vector": field["type"] in VECTOR_TYPES, "dimensions": field.get("dimensions")})
+    key = next(field["name"] for field in definition["fields"] if field.get("key"))
+
+    columns = {field["name"]: [] for field in fields}
+    search_client = _search_client(s, index_name)
+    pages = 0
+    with search_client:
+        for page in iterate_documents(search_client, key, [field["name"] for field in fields], page_size):
+            pages += 1
+            for field in fields:
+                values = [document[field["name"]] for document in page]
+                if field["vector"]:
+                    missing = np.array([value is None for value in values], dtype=bool)
+                    matrix = np.zeros((len(values), field["dimensions"]), dtype=np.float32)
+                    for row, value in enumerate(values):
+                        if value is not None:
+                            matrix[row] = value
+                    columns[field["name"]].append((matrix, missing))
+                else:
+                    if field["type"] != "Edm.String":
+                        values = [json.dumps(value) if value is not None else None for value in values]
+                    columns[field["name"]].extend(values)
+
+    count = len(columns[key])
+    arrays = {}
+    for field in fields:
+        name = field["name"]
+        if field["vector"]:
+            parts = columns[name]
+            arrays[name] = np.ascontiguousarray(np.concatenate([matrix for matrix, _ in parts]) if parts else np.zeros((0, field["dimensions"]), dtype=np.float32))
+            arrays[f"{name}.null"] = np.concatenate([missing for _, missing in parts]) if parts else np.zeros(0, dtype=bool)
+        else:
+            arrays[f"{name}.data"], arrays[f"{name}.offsets"], arrays[f"{name}.null"] = _pack_strings(columns[name])
+    meta = {"version": SNAPSHOT_VERSION, "index_name": index_name, "count": count, "key": key, "fields": fields,
+            "definition": definition, "exported_at": time.time()}
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(path + ".tmp", path)
+    return {"index": index_name, "documents": count, "pages": pages, "bytes": os.path.getsize(path),
+            "seconds": round(time.perf_counter() - start, 3)}
+
+class Snapshot:
+    # Read side of a snapshot file; documents are rebuilt row by row, on demand
+    def __init__(self, path):
+        import numpy as np
+
+        self._arrays = np.load(path, allow_pickle=False)
+        self.meta = json.loads(bytes(self._arrays["meta"]).decode("utf-8"))
+        if self.meta["version"] != SNAPSHOT_VERSION:
+            raise Exception(f"Snapshot version {self.meta['version']} is not supported, expected {SNAPSHOT_VERSION}")
+        self.count = self.meta["count"]
+        self.definition = self.meta["definition"]
+        # np.load reads members lazily; keep each one once
+        self._columns = {name: self._arrays[name] for name in self._arrays.files if name != "meta"}
+
+    def vectors(self, name="vector"):
+        return self._columns[name]
+
+    def documents(self, start=0, stop=None):
+        stop = self.count if stop is None else min(stop, self.count)
+        columns = self._columns
+        for row in range(start, stop):
+            document = {}
+            for field in self.meta["fields"]:
+                name = field["name"]
+                if columns[f"{name}.null"][row]:
+                    document[name] = None
+                elif field["vector"]:
+                    document[name] = columns[name][row].tolist()
+                else:
+                    value = _unpack_string(columns[f"{name}.data"], columns[f"{name}.offsets"], row)
+                    document[name] = value if field["type"] == "Edm.String" else json.loads(value)
+            yield document
+
+def _restore_definition(definition, index_name):
+    # The service never returns secrets, so the vectorizer gets its key from this environment
+    from azure.search.documents.indexes.models import SearchIndex
+
+    definition = json.loads(json.dumps(definition))
+    definition["name"] = index_name
+    for vectorizer in (definition.get("vectorSearch") or {}).get("vectorizers") or []:
+        parameters = vectorizer.get("azureOpenAIParameters")
+        if parameters is not None and parameters.get("apiKey") in (None, "", "<redacted>") and os.getenv("AZURE_OPENAI_KEY"):
+            parameters["apiKey"] = os.getenv("AZURE_OPENAI_KEY")
+    return SearchIndex.deserialize(definition)
+
+def import_index(path, index_name=None, batch_size=500, workers=8, index_client=None):
+    from .clients import settings
+
+    start = time.perf_counter()
+    s = settings()
+    snapshot = Snapshot(path)
+    index_name = index_name or s["index_name"]
+    # create_index fails when the index exists, so a snapshot never lands on top of live data
+    (index_client or _index_client(s)).create_index(_restore_definition(snapshot.definition, index_name))
+    created = time.perf_counter()
+
+    search_client = _search_client(s, index_name)
+
+    def upload(offset):
+        # Each worker builds its own batch, so only `workers` batches are in memory at once
+        batch = list(snapshot.documents(offset, offset + batch_size))
+        results = search_client.upload_documents(documents=batch)
+        failed = [result.key for result in results if not result.succeeded]
+        if failed:
+            raise Exception(f"Failed to upload {len(failed)} documents, e.g. {failed[:5]}")
+        return len(batch)
+
+    with search_client, ThreadPoolExecutor(max_workers=workers) as executor:
+        uploaded = sum(executor.map(upload, range(0, snapshot.count, batch_size)))
+    elapsed = time.perf_counter() - start
+    return {"index": index_name, "documents": uploaded, "create_seconds": round(created - start, 3),
+            "seconds": round(elapsed, 3), "documents_per_second": uploaded / elapsed if elapsed else 0}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m hrchatbot.snapshot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="write every document of the index to a snapshot file")
+    export.add_argument("path")
+    export.add_argument("--index", help="defaults to AZURE_SEARCH_INDEX_NAME")
+    export.add_argument("--page-size", type=int, default=1000)
+    restore = subparsers.add_parser("import", help="create a new index from a snapshot file")
+    restore.add_argument("path")
+    restore.add_argument("--index", help="defaults to AZURE_SEARCH_INDEX_NAME; must not exist yet")
+    restore.add_argument("--batch-size", type=int, default=500)
+    restore.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(json.dumps(export_index(args.path, args.index, args.page_size), indent=2))
+    else:
+        print(json.dumps(import_index(args.path, args.index, args.batch_size, args.workers), indent=2))
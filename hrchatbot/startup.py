@@ -0,0 +1,97 @@
+## Background start-up for the REPL
+# main.py used to import the Azure SDKs, run load_data_create_index() and create the clients
+# before it showed the prompt. Startup runs all of that on a background thread while the
+# user types the first question: provisioning (which only checks what changed when nothing
+# did), retrieval_generation.init(), and then one cheap request per service, so the TCP and
+# TLS handshakes, the credential and the tiktoken encoding are ready before the question is.
+# wait() blocks until it has finished and raises what went wrong there.
+# Set BACKGROUND_STARTUP=off to do it all before the prompt is shown instead.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+def background_startup():
+    return os.getenv("BACKGROUND_STARTUP", "on") != "off"
+
+def prewarm():
+    # Best effort: a failure here only means the first question pays for the connection
+    from . import local_index
+    from . import retrieval_generation as rg
+    from .tokens import count_tokens
+
+    def search():
+        if local_index.local_backend():
+            local_index.get_local_index()
+        else:
+            rg.search_client.get_document_count()
+
+    def openai():
+        rg.client.models.list()
+
+    def tokens():
+        count_tokens("")
+
+    def run(name, warm):
+        start = time.perf_counter()
+        try:
+            warm()
+        except Exception as error:
+            logger.debug("Pre-warming %s failed: %s", name, error)
+            telemetry.increment("hrchatbot_prewarm_errors_total", target=name, error=type(error).__name__)
+        return name, round(time.perf_counter() - start, 3)
+
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="prewarm") as executor:
+        return dict(executor.map(lambda target: run(*target), [("search", search), ("openai", openai), ("tokens", tokens)]))
+
+class Startup:
+    def __init__(self, provision=True):
+        self.provision = provision
+        self.error = None
+        self.timings = {}
+        self._done = threading.Event()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            if self.provision:
+                from .load_data_create_index import load_data_create_index
+                load_data_create_index()
+                self.timings["provision"] = round(time.perf_counter() - start, 3)
+
+            from . import retrieval_generation as rg
+            init_start = time.perf_counter()
+            rg.init()
+            self.timings["init"] = round(time.perf_counter() - init_start, 3)
+            self.timings["prewarm"] = prewarm()
+        except BaseException as error:
+            self.error = error
+        finally:
+            self.timings["seconds"] = round(time.perf_counter() - start, 3)
+            telemetry.observe("hrchatbot_startup_seconds", self.timings["seconds"])
+            self._done.set()
+
+    def start(self):
+        if background_startup():
+            threading.Thread(target=self._run, name="startup", daemon=True).start()
+        else:
+            self._run()
+        return self
+
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        # True once start-up has finished; raises its error, if any
+        finished = self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return finished
+
+def start(provision=True):
+    return Startup(provision).start()
@@ -0,0 +1,259 @@
+## Tracing and metrics for the question hot path
+# retrieval_generation() wraps each stage in stage(name) and each question in question(query).
+# TELEMETRY selects what happens with them (comma-separated, default off):
+#   metrics     keep counters and latency histograms, readable as Prometheus text
+#   json        also log one JSON line per question (stages, tokens, scores, cache events)
+#   otel        also open an OpenTelemetry span per stage (needs opentelemetry-api)
+# With TELEMETRY off, stage() returns a shared no-op object unless a caller opened
+# collect_stages() (as the benchmarks do), so the hot path pays one lookup per stage.
+# Set METRICS_PORT to serve the Prometheus text on http://127.0.0.1:<port>/metrics (set
+# METRICS_HOST, e.g. to 0.0.0.0, to let a scraper on another host reach it) and
+# TELEMETRY_LOG to append the JSON lines to a file instead of stderr.
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_stages = contextvars.ContextVar("hrchatbot_stages", default=None)
+_record = contextvars.ContextVar("hrchatbot_question", default=None)
+
+_configured = False
+_enabled = False
+_exporters = frozenset()
+_tracer = None
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+# Upper bounds in seconds, also used for token and score histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def configure(exporters=None):
+    global _configured, _enabled, _exporters, _tracer
+
+    if exporters is None:
+        exporters = os.getenv("TELEMETRY", "off")
+    if isinstance(exporters, str):
+        exporters = [name.strip() for name in exporters.split(",") if name.strip() and name.strip() != "off"]
+    _exporters = frozenset(exporters)
+    _enabled = bool(_exporters)
+    if "json" in _exporters and not logger.handlers:
+        # One JSON object per line on stderr, or appended to TELEMETRY_LOG
+        path = os.getenv("TELEMETRY_LOG")
+        handler = logging.FileHandler(path) if path else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    _tracer = None
+    if "otel" in _exporters:
+        try:
+            from opentelemetry import trace
+            _tracer = trace.get_tracer("hrchatbot")
+        except ImportError:
+            logger.warning("TELEMETRY=otel needs the opentelemetry-api package; spans are disabled")
+    _configured = True
+
+def enabled():
+    if not _configured:
+        configure()
+    return _enabled
+
+## Metrics registry
+def increment(name, value=1, **labels):
+    if not enabled():
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    record = _record.get()
+    if record is not None:
+        record["counters"][name] = record["counters"].get(name, 0) + value
+
+def observe(name, value, buckets=BUCKETS, **labels):
+    if not enabled():
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+        histogram["count"] += 1
+        histogram["sum"] += value
+        for i, bound in enumerate(histogram["buckets"]):
+            if value <= bound:
+                histogram["counts"][i] += 1
+
+def annotate(**attributes):
+    # Adds attributes to the JSON line of the question being answered
+    record = _record.get()
+    if record is not None:
+        record.update(attributes)
+
+def record_usage(usage, operation="chat"):
+    # Token counters from response.usage
+    if usage is None or not enabled():
+        return
+    increment("hrchatbot_prompt_tokens_total", usage.prompt_tokens or 0, operation=operation)
+    increment("hrchatbot_completion_tokens_total", getattr(usage, "completion_tokens", 0) or 0, operation=operation)
+    # Prompt tokens served from the service's prompt cache (see prompt_prefix.py)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    increment("hrchatbot_cached_prompt_tokens_total", cached, operation=operation)
+    if operation == "chat":
+        annotate(prompt_tokens=usage.prompt_tokens, cached_tokens=cached)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        # observe() already counts every bucket a value falls under, so the counts are cumulative
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    # Plain-dict view of every counter and histogram, used by the benchmarks
+    with _lock:
+        return {
+            "counters": {f"{name}{_labels(labels)}": value for (name, labels), value in _counters.items()},
+            "histograms": {f"{name}{_labels(labels)}": {"count": h["count"], "sum": h["sum"]} for (name, labels), h in _histograms.items()},
+        }
+
+def start_metrics_server(port, host=None):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    host = os.getenv("METRICS_HOST", "127.0.0.1") if host is None else host
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+## Spans
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+        self._span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._span = _tracer.start_as_current_span(self.name)
+            self._span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        if self.stages is not None:
+            self.stages[self.name] = self.stages.get(self.name, 0.0) + elapsed
+        if _enabled:
+            observe("hrchatbot_stage_seconds", elapsed, stage=self.name)
+        if self._span is not None:
+            self._span.__exit__(*args)
+        return False
+
+def stage(name):
+    stages = _stages.get()
+    if stages is None and not enabled():
+        return _NULL_STAGE
+    return _Stage(stages, name)
+
+class collect_stages:
+    def __enter__(self):
+        self.stages = {}
+        self._token = _stages.set(self.stages)
+        return self.stages
+
+    def __exit__(self, *args):
+        _stages.reset(self._token)
+        return False
+
+class question:
+    # Scope of one question: times it end to end and, with TELEMETRY=json, logs one line for it
+    def __init__(self, query, kind="question"):
+        self.query = query
+        self.kind = kind
+
+    def __enter__(self):
+        if not enabled():
+            self._active = False
+            return self
+        self._active = True
+        stages = _stages.get()
+        self.record = {"event": self.kind, "query_sha1": hashlib.sha1(self.query.encode("utf-8")).hexdigest()[:12],
+                       "stages": stages if stages is not None else {}, "counters": {}}
+        self._stages_token = _stages.set(self.record["stages"]) if stages is None else None
+        self._record_token = _record.set(self.record)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if not self._active:
+            return False
+        elapsed = time.perf_counter() - self.start
+        _record.reset(self._record_token)
+        if self._stages_token is not None:
+            _stages.reset(self._stages_token)
+        observe("hrchatbot_question_seconds", elapsed, kind=self.kind)
+        increment("hrchatbot_questions_total", kind=self.kind, outcome="error" if exc_type else "ok")
+        if "json" in _exporters:
+            self.record["seconds"] = round(elapsed, 4)
+            self.record["stages"] = {name: round(seconds, 4) for name, seconds in self.record["stages"].items()}
+            if exc_type:
+                self.record["error"] = exc_type.__name__
+            logger.info(json.dumps(self.record, default=str))
+        return False
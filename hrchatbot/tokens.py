@@ -0,0 +1,32 @@
+## Token counting for prompt and batch budgets
+# Uses tiktoken when it is installed and falls back to a characters-per-token estimate.
+import functools
+import os
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Azure deployment names are not always model names
+        return tiktoken.get_encoding("o200k_base" if model.startswith(("gpt-4o", "gpt-4.1", "o")) else "cl100k_base")
+
+def count_tokens(text, model=None):
+    model = model or os.getenv("CHAT_COMPLETION_NAME") or "gpt-4.1"
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text, max_tokens, model=None):
+    # Cuts text down to at most max_tokens, on a token boundary when tiktoken is available
+    model = model or os.getenv("CHAT_COMPLETION_NAME") or "gpt-4.1"
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max(max_tokens - 1, 0) * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,17 @@
+from hrchatbot import provision_state
+from hrchatbot.answer_cache import AnswerCache, MemoryCache
+
+QUESTION = "How many sick days do I get?"
+
+def test_key_changes_with_the_backend_and_the_index_version(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROVISION_STATE_PATH", str(tmp_path / "provision_state.json"))
+    cache = AnswerCache([MemoryCache()])
+    cache.store(QUESTION, "prompt", "Ten days.", 1.0)
+    assert cache.lookup(QUESTION, "prompt") == "Ten days."
+
+    monkeypatch.setenv("RETRIEVAL_BACKEND", "local")
+    assert cache.lookup(QUESTION, "prompt") is None
+    cache.store(QUESTION, "prompt", "Twelve days.", 1.0)
+
+    provision_state.bump_index_version()
+    assert cache.lookup(QUESTION, "prompt") is None
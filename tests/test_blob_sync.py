@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from hrchatbot.blob_sync import documents_directory, sync_documents
+from hrchatbot.fakes import FakeContainerClient
+
+@pytest.fixture
+def container(tmp_path):
+    source = tmp_path / "documents"
+    source.mkdir()
+    (source / "leave.pdf").write_bytes(b"%PDF leave policy")
+    container = FakeContainerClient()
+    sync_documents(container, str(source), {})
+    assert set(container.blobs) == {"leave.pdf"}
+    return container
+
+def test_missing_directory_raises_and_keeps_blobs(container, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        sync_documents(container, str(tmp_path / "missing"), {})
+    assert set(container.blobs) == {"leave.pdf"}
+
+def test_empty_directory_keeps_blobs(container, tmp_path):
+    (tmp_path / "empty").mkdir()
+    stats = sync_documents(container, str(tmp_path / "empty"), {})
+    assert stats["deleted"] == 0
+    assert set(container.blobs) == {"leave.pdf"}
+
+def test_documents_directory_does_not_depend_on_the_working_directory(monkeypatch, tmp_path):
+    monkeypatch.delenv("DOCUMENTS_DIR", raising=False)
+    expected = documents_directory()
+    monkeypatch.chdir(tmp_path)
+    assert documents_directory() == expected
+    assert os.path.isabs(expected)
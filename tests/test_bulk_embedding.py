@@ -0,0 +1,39 @@
+import types
+
+import pytest
+
+from hrchatbot import clients
+from hrchatbot.bulk_embedding import push_index_name, push_search_client, upload_documents
+from hrchatbot.fakes import FakeAzureServer
+
+def test_push_goes_to_a_separate_index(monkeypatch):
+    import azure.search.documents.indexes as indexes
+
+    indexed = [{"parent_id": "aGFzaA", "chunk_id": "aGFzaA_bGVhdmUucGRm_pages_0", "title": "leave.pdf", "chunk": "Ten sick days."}]
+    with FakeAzureServer(documents=indexed) as server:
+        # SearchIndexClient refuses plain-http endpoints, so index management goes straight to the fake
+        class IndexClient:
+            def __init__(self, endpoint, credential, **kwargs):
+                pass
+
+            def get_index(self, name):
+                return types.SimpleNamespace(**server.index_definition(name), e_tag="etag")
+
+            def create_or_update_index(self, index):
+                server.create_index(index.name, {"fields": index.fields})
+
+        monkeypatch.setattr(indexes, "SearchIndexClient", IndexClient)
+        for name, value in server.environ().items():
+            monkeypatch.setenv(name, value)
+        s = clients.settings()
+        chunks = [{"parent_id": "bGVhdmUucGRm", "chunk_id": "bGVhdmUucGRm_pages_0", "title": "leave.pdf", "chunk": "Ten sick days."}]
+
+        assert upload_documents(push_search_client(s, push_index_name(s)), chunks) == 1
+
+        # The indexer's chunks are left alone; the local ones are in int-vec-bulk, created from its definition
+        assert server.documents == indexed
+        assert server.index_documents["int-vec-bulk"] == chunks
+        assert {field["name"] for field in server.indexes["int-vec-bulk"]["fields"]} >= {"parent_id", "chunk_id", "chunk"}
+
+        with pytest.raises(Exception, match="duplicate"):
+            push_search_client(s, s["index_name"])
@@ -0,0 +1,19 @@
+import json
+
+from hrchatbot.cassette import Cassette
+
+SAS = "restype=container&comp=list&sv=2024-08-04&se=2026-10-19T00%3A00%3A00Z&sr=c&sp=rl&sig=c2VjcmV0"
+
+def test_sas_tokens_are_not_recorded_and_still_match(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    Cassette(path, "record").record("GET", f"https://account.blob.core.windows.net/documents?{SAS}", {}, b"", 200, {}, 0.01, [(0.01, b"<xml/>")])
+
+    with open(path, encoding="utf-8") as f:
+        recorded = f.read()
+    assert "c2VjcmV0" not in recorded and "2026-10-19" not in recorded
+    assert json.loads(recorded)["path"] == "/documents?restype=container&comp=list&sv=REDACTED&se=REDACTED&sr=REDACTED&sp=REDACTED&sig=REDACTED"
+
+    # A later SAS token with another expiry and signature replays the same response
+    later = SAS.replace("2026-10-19", "2026-10-20").replace("c2VjcmV0", "b3RoZXI")
+    entry = Cassette(path, "replay").play("GET", f"https://account.blob.core.windows.net/documents?{later}", b"")
+    assert entry["status"] == 200
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import pytest
+
+from hrchatbot import clients
+from hrchatbot import retrieval_generation as rg
+from hrchatbot.fakes import FakeAzureServer
+
+QUESTIONS = [
+    "What will an organization of the Government of British Columbia do if an employee got health problems?",
+    "Which HR policy document talks about occupational safety and health?",
+    "What is the role of political staff?",
+]
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    with FakeAzureServer() as server:
+        for name, value in server.environ().items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setenv("ANSWER_CACHE", "off")
+        monkeypatch.chdir(tmp_path)
+        clients.close()
+        monkeypatch.setattr(rg, "_initialized", False)
+        yield server
+        clients.close()
+
+def test_pooled_clients_reuse_connections(server):
+    for i in range(10):
+        rg.retrieval_generation(QUESTIONS[i % len(QUESTIONS)])
+
+    # One keep-alive connection to the search service and one to Azure OpenAI
+    assert server.requests >= 20
+    assert server.connections <= 2
+
+def test_concurrent_questions_share_a_bounded_pool(server, monkeypatch):
+    # Chat completions go to a second server, so each pool's connections are counted apart
+    with FakeAzureServer(chat_latency=0.05) as openai_server:
+        server.search_latency = 0.05
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", openai_server.url)
+        monkeypatch.setenv("HTTP_POOL_SIZE", "4")
+
+        async def ask_all():
+            semaphore = asyncio.Semaphore(16)
+
+            async def ask(i):
+                async with semaphore:
+                    return await rg.aretrieval_generation(f"{QUESTIONS[i % len(QUESTIONS)]} ({i})")
+            try:
+                return await asyncio.gather(*(ask(i) for i in range(64)))
+            finally:
+                await clients.aclose()
+
+        start = time.perf_counter()
+        answers = asyncio.run(ask_all())
+        elapsed = time.perf_counter() - start
+
+    assert all(answers)
+    # 64 questions at 0.1s each take 6.4s one after another
+    assert elapsed < 3.0
+    # The search pool never holds more than HTTP_POOL_SIZE sockets, however many questions are in flight
+    assert server.requests == 64
+    assert server.connections <= 4
+    # Chat keeps at most one connection per question in flight
+    assert openai_server.requests == 64
+    assert openai_server.connections <= 16
+
+def test_throttled_requests_are_retried_once_by_the_scheduler(server):
+    import openai
+
+    server.embedding_throttle_ratio = 1.0
+    with pytest.raises(openai.RateLimitError):
+        clients.get_openai_client().embeddings.create(model="text-embedding-3-large", input=["sick leave"])
+    # The scheduler's attempts only; the SDK does not start them over
+    assert server.requests == 9
@@ -0,0 +1,35 @@
+import time
+
+import pytest
+
+from hrchatbot import clients
+from hrchatbot.conversation import Conversation
+from hrchatbot.fakes import FakeAzureServer
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeAzureServer(answer="The employee asked about sick leave.", chat_latency=0.3) as server:
+        for name, value in server.environ().items():
+            monkeypatch.setenv(name, value)
+        clients.close()
+        yield server
+        clients.close()
+
+def test_fold_runs_in_the_background(server):
+    conversation = Conversation(recent_turns=1)
+    conversation.add_turn("How many sick days do I get?", "Ten days a year.")
+
+    start = time.perf_counter()
+    conversation.add_turn("And for part-time staff?", "They are prorated.")
+    assert conversation.has_history()
+    assert time.perf_counter() - start < 0.2
+
+    # Reading the history waits for the summary
+    messages = conversation.history_messages()
+    assert messages[0] == {"role": "system", "content": "Summary of the earlier conversation: The employee asked about sick leave."}
+    assert messages[1:] == [{"role": "user", "content": "And for part-time staff?"}, {"role": "assistant", "content": "They are prorated."}]
+
+def test_new_conversation_has_no_history():
+    conversation = Conversation(client=object())
+    assert not conversation.has_history()
+    assert conversation.standalone_query("How many sick days do I get?") == "How many sick days do I get?"
@@ -0,0 +1,16 @@
+import numpy as np
+
+from hrchatbot.local_index import LocalIndex, build_local_index
+
+def test_search_reports_the_fusion_score_separately(tmp_path):
+    chunks = ["sick leave for part-time staff", "occupational safety and health", "role of political staff"]
+    documents = [{"parent_id": f"doc{i}", "chunk_id": f"doc{i}_pages_0", "title": f"doc{i}.pdf", "chunk": chunk}
+                 for i, chunk in enumerate(chunks)]
+    vectors = np.eye(3, 8, dtype=np.float32)
+    build_local_index(str(tmp_path), documents, vectors, 8)
+
+    results = LocalIndex(str(tmp_path)).search("sick leave", vectors[0], top=2)
+
+    assert results[0]["chunk_id"] == "doc0_pages_0"
+    assert all(result["reranker_score"] is None for result in results)
+    assert results[0]["fusion_score"] > results[1]["fusion_score"] > 0
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from hrchatbot import telemetry
+from hrchatbot import retrieval_generation as rg
+from hrchatbot.serve import MAX_BODY_SIZE, AnswerServer
+
+async def exchange(request, app=None):
+    app = app or AnswerServer()
+    server = await asyncio.start_server(app.handle, "127.0.0.1", 0)
+    async with server:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(request)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    return response
+
+@pytest.mark.parametrize("request_line", [b"GARBAGE\r\n", b"GET /healthz\r\n", b"GET /a b HTTP/1.1\r\n"])
+def test_malformed_request_line_is_answered_with_400(request_line):
+    response = asyncio.run(exchange(request_line + b"\r\n"))
+    assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert b"Connection: close" in response
+
+def test_oversized_body_is_answered_with_413():
+    request = f"POST /ask HTTP/1.1\r\nContent-Length: {MAX_BODY_SIZE + 1}\r\n\r\n".encode("latin-1")
+    response = asyncio.run(exchange(request))
+    assert response.startswith(b"HTTP/1.1 413 Content Too Large\r\n")
+    assert response.endswith(b'{"error": "request body too large"}')
+
+@pytest.mark.parametrize("body", [b'{"question": 5}', b'{"question": ["a"]}', b'{"question": " "}', b'[]'])
+def test_question_that_is_not_a_string_is_answered_with_400(body):
+    request = b"POST /ask HTTP/1.1\r\nConnection: close\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    response = asyncio.run(exchange(request))
+    assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert response.endswith(b'{"error": "question is required"}')
+
+def test_ask_runs_in_a_question_scope(monkeypatch):
+    scopes = []
+
+    async def answer(question):
+        scopes.append(telemetry._record.get())
+        yield "Ten days."
+
+    monkeypatch.setattr(rg, "aretrieval_generation_stream", answer)
+    telemetry.configure("json")
+    try:
+        app = AnswerServer()
+        app._semaphore = asyncio.Semaphore(1)
+        response = asyncio.run(exchange(b"GET /ask?question=sick+days HTTP/1.1\r\nConnection: close\r\n\r\n", app))
+    finally:
+        telemetry.configure()
+    assert response.endswith(b'{"answer": "Ten days."}')
+    assert scopes[0] is not None